@@ -1,29 +1,104 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file
-from flask_socketio import SocketIO, emit
+import eventlet
+eventlet.monkey_patch()  # Make imaplib sockets and the IMAP pool cooperative
+
+from flask import Flask, Response, g, stream_with_context, render_template, request, redirect, url_for, session, flash, jsonify, send_file
+from flask_socketio import SocketIO, emit, join_room
 from flask_cors import CORS
+from markupsafe import escape
+import base64
 import imaplib
-import email
-from email.header import decode_header
-from email.utils import parsedate_to_datetime
-from datetime import datetime, timedelta
-import tempfile
+import json
 import os
-import time
-import subprocess
-import shlex
+from datetime import datetime, timedelta
+
+import metrics
+from attachments import AttachmentPipeline
+from cli_session import CLISession
+from email_report import render_report
+from fetch_jobs import FetchCancelled, JobRegistry
+from fetch_orchestrator import MAIL_FOLDERS, iter_bodies, merge_records, sync_targets
+from imap_idle import IdleWatchers, supports_idle, wait_for_mail
+from imap_pool import IMAPConnectionPool, PoolTimeout
+from mail_groups import collapse
+from mail_rules import RuleSet
+from mail_store import HIGHLIGHT_END, HIGHLIGHT_START, MailStore
+from mail_sync import download_bodies, select_mailbox, sync_mailbox
+from raw_cache import RawMessageCache
+from report_cache import ReportCache, report_key
+from state_store import CredentialHandles, open_state_store
 
 
 app = Flask(__name__)
 CORS(app)
-app.secret_key = 'your-secret-key'
-socketio = SocketIO(app, async_mode='eventlet')
+# Every worker must sign sessions with the same key
+app.secret_key = os.environ.get("SECRET_KEY", 'your-secret-key')
+# With a message queue (e.g. redis://), an emit from any worker reaches sockets connected to the others
+socketio = SocketIO(app, async_mode='eventlet', message_queue=os.environ.get("SOCKETIO_MESSAGE_QUEUE"))
 
 IMAP_SERVER = "mail.bilkent.edu.tr"
 IMAP_PORT = 993
 
-# Global variable to store the report file path and running CLI process
-report_file_path = None
-running_process = None  # Store the running process globally
+# Department announcements shown on the dashboard, one category per rule (see mail_rules)
+RULES = RuleSet()
+SEARCH_CRITERIA = RULES.search_criteria
+
+# Local store of already downloaded messages
+mail_store = MailStore()
+
+# Logged-in IMAP connections shared by the login, report and socket handlers
+imap_pool = IMAPConnectionPool(lambda: imaplib.IMAP4_SSL(IMAP_SERVER, IMAP_PORT))
+
+# Fetched body sections on disk, so a rebuilt store does not download them again
+raw_cache = RawMessageCache()
+
+# Attachments of listed mail, downloaded and decoded in the background (see ATTACHMENT_TYPES)
+attachment_pipeline = AttachmentPipeline(mail_store)
+
+# Rendered reports, so an unchanged report is not rendered again
+report_cache = ReportCache()
+
+# Logins and running jobs, shared by all workers (see STATE_STORE_URL)
+state_store = open_state_store()
+credential_handles = CredentialHandles(state_store)
+
+# Background fetch jobs started from the dashboard
+fetch_jobs = JobRegistry(state_store)
+
+# Seconds to wait before reconnecting a dropped IDLE connection
+IDLE_RETRY = 30
+
+# IDLE connections pushing new mail to the dashboards of connected users
+idle_watchers = IdleWatchers(lambda username, password, stop: socketio.start_background_task(
+    run_idle_watcher, username, password, stop))
+
+# In-process CLI sessions of the /cli page, one per socket id
+cli_sessions = {}
+
+# Emails per /api/emails page: the default and the most a client may ask for
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Every HTTP request gets a trace collecting the time spent per stage; its id is sent back in X-Trace-Id
+@app.before_request
+def start_request_trace():
+    g.trace = metrics.Trace()
+    g.trace_token = metrics.activate(g.trace)
+
+@app.after_request
+def add_trace_header(response):
+    if 'trace' in g:
+        response.headers['X-Trace-Id'] = g.trace.id
+    return response
+
+@app.teardown_request
+def end_request_trace(exc):
+    if 'trace_token' in g:
+        metrics.deactivate(g.trace_token)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Process-wide stage timings and byte counts for Prometheus to scrape."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def home():
@@ -36,9 +111,15 @@ def login():
         password = request.form['password']
 
         # Authenticate the user
-        if authenticate_user(email, password):
+        try:
+            authenticated = authenticate_user(email, password)
+        except PoolTimeout:
+            flash("The mail server is busy. Please try again in a moment.", "error")
+            return redirect(url_for('home'))
+        if authenticated:
             session['email'] = email
-            session['password'] = password
+            # The password stays on the server; the cookie only carries a handle to it
+            session['credentials'] = credential_handles.issue(email, password)
             return redirect(url_for('dashboard'))
         else:
             flash("Login failed. Please check your credentials.", "error")
@@ -46,146 +127,401 @@ def login():
     else:
         return render_template('login.html')
 
+def current_login():
+    """Return (username, password) of the session's login, or None when logged out or expired."""
+    return credential_handles.lookup(session.get('credentials'))
+
 def authenticate_user(username, password):
+    """Return whether the IMAP login succeeds; PoolTimeout propagates when the account's pool is full."""
     try:
-        mail = imaplib.IMAP4_SSL(IMAP_SERVER, IMAP_PORT)
-        mail.login(username, password)
-        mail.logout()
-        return True
+        # The connection stays in the pool for the dashboard fetch that follows
+        with imap_pool.connection(username, password):
+            return True
     except imaplib.IMAP4.error:
         return False
 
 @app.route('/dashboard')
 def dashboard():
-    if 'email' not in session:
+    if current_login() is None:
         return redirect(url_for('home'))
     return render_template('dashboard.html')
 
 @app.route('/download_report')
 def download_report():
-    # Fetch emails without emitting real-time updates
-    email_data = fetch_emails_with_dynamic_range(session['email'], session['password'], emit_updates=False, max_weeks=4)
+    login = current_login()
+    if login is None:
+        return redirect(url_for('home'))
+    username, password = login
 
-    # Generate the report and get the file path
-    report_file_path, temp_dir = generate_html_file(email_data)
-    
-    # Ensure the report file exists and trigger the download
-    if report_file_path and os.path.exists(report_file_path):
-        return send_file(report_file_path, as_attachment=True, download_name="bilkent_emails_report.html")
-    else:
+    # Only the listing is needed to tell whether the report changed
+    records = select_recent_week(username, password, max_weeks=4)
+
+    if not records:
         flash("No report found.", "error")
         return redirect(url_for('dashboard'))
 
+    # The content hash is the ETag: an unchanged report is neither rendered nor re-sent
+    key = report_key(records)
+    etag = key[1]
+    shown = collapse(records)
+    html = report_cache.get(username, key)
+    # Only a report with every body in is cached or validated; one whose body fetch failed is rendered again
+    complete = html is not None or all(record.has_body for record in shown)
+    if complete and request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        if html is None:
+            # Send each email as soon as its body is in instead of rendering the whole report first
+            html = stream_with_context(stream_report(username, password, shown, key))
+        response = Response(html, mimetype="text/html")
+        response.headers["Content-Disposition"] = 'attachment; filename="bilkent_emails_report.html"'
+
+    if complete:
+        response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
 @app.route('/logout')
 def logout():
-    # Clear session and redirect to home (login) page
+    # Close pooled IMAP connections, clear session and redirect to home (login) page
+    if 'email' in session:
+        idle_watchers.stop(session['email'])
+        imap_pool.close_account(session['email'])
+        report_cache.invalidate(session['email'])
+    credential_handles.revoke(session.get('credentials'))
     session.clear()
     return redirect(url_for('home'))
 
-# WebSocket event for starting email fetching and streaming
+# Every socket of a logged-in user joins a room named after the user, so job events reach all their tabs
+@socketio.on('connect')
+def handle_connect():
+    login = current_login()
+    if login:
+        join_room(login[0])
+        # New mail is pushed over IDLE for as long as one of the user's sockets is open
+        idle_watchers.attach(*login)
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    cli = cli_sessions.pop(request.sid, None)
+    if cli:
+        cli.close()
+    if 'email' in session:
+        idle_watchers.detach(session['email'])
+
+# WebSocket event for starting email fetching and streaming; {'timings': true} adds a per-stage breakdown to fetch_complete
 @socketio.on('start_fetching_emails')
-def handle_email_fetching():
-    email = session.get('email')
-    password = session.get('password')
-
-    if email and password:
-        # Dynamically fetch emails and generate report according to current day.
-        global report_file_path
-        report_file_path = fetch_emails_with_dynamic_range(email, password, emit_updates=True, max_weeks=4)
-        emit('fetch_complete')  # Notify the client that fetching is complete
-
-def fetch_emails(username, password, since_date, before_date, emit_updates=False):
-    """Fetch emails from the Bilkent IMAP server."""
-    mail = imaplib.IMAP4_SSL(IMAP_SERVER)
-    mail.login(username, password)
-    mail.select("inbox")
-
-    # Search for emails in the given date range
-    search_query = f'(OR (OR (SUBJECT "DAIS") (SUBJECT "AIRS")) (OR (OR (SUBJECT "[BAIS-ANNC:BILKENT] EXPERIMENT") (SUBJECT "TRANSPORTATION")) (OR (SUBJECT "From the Transportation Unit") (SUBJECT "BUSES"))) SINCE {since_date} BEFORE {before_date})'
-
-    status, messages = mail.search(None, search_query)
-    message_ids = messages[0].split()
-
-    email_data = []
-
-    for num in message_ids:
-        status, msg_data = mail.fetch(num, "(FLAGS RFC822)")
-        msg = None
-        flags = None
-
-        for response_part in msg_data:
-            if isinstance(response_part, tuple):
-                if b"FLAGS" in response_part[0]:
-                    flags = response_part[0]
-                if response_part[1]:
-                    msg = email.message_from_bytes(response_part[1])
-
-        if msg is None or flags is None:
-            continue
-
-        subject = decode_header(msg["Subject"])[0][0]
-        subject = safe_decode(subject)
-        from_ = decode_mime_words(msg.get("From"))
-        date = parsedate_to_datetime(msg["Date"])
-        date_str = date.strftime('%d.%m.%Y')
-        time_str = date.strftime('%H:%M')
-
-        status = 'Read' if b'\\Seen' in flags else 'Unread'
-
-        body = get_email_body(msg) or "No body available"
-        
-        email_entry = {
-            'from': from_,
-            'subject': subject,
-            'body': body,
-            'date': date_str,
-            'time': time_str,
-            'status': status,
-        }
-
-        email_data.append(email_entry)
+def handle_email_fetching(data=None):
+    login = current_login()
+
+    if login:
+        email, password = login
+        # Fetch in a background task so the handler returns at once and other clients keep being served
+        job, is_new = fetch_jobs.start(email)
+        if is_new:
+            timings = bool(data and data.get('timings'))
+            socketio.start_background_task(run_fetch_job, job, email, password, timings)
+        emit('fetch_started', {'job_id': job.id})
+
+# WebSocket event for cancelling a running fetch
+@socketio.on('cancel_fetch')
+def handle_cancel_fetch(data):
+    login = current_login()
+    job = fetch_jobs.get((data or {}).get('job_id'), login[0]) if login else None
+    if job:
+        job.cancel()
+
+def run_fetch_job(job, username, password, timings=False):
+    """Run one dashboard fetch and stream its results to the user's room.
+
+    The job id doubles as the trace id of the fetch.
+    """
+    trace = metrics.Trace(job.id)
+    metrics.activate(trace)
 
-        if emit_updates:
-            emit('email_update', email_entry)
-        time.sleep(1)
+    def on_progress(stage, done=0, total=0):
+        job.check()
+        socketio.emit('fetch_progress', {'job_id': job.id, 'stage': stage, 'done': done, 'total': total}, to=username)
 
-    mail.logout()
+    try:
+        # Dynamically fetch emails according to current day.
+        since, before, records = fetch_emails_with_dynamic_range(username, password, max_weeks=4, on_progress=on_progress)
+    except FetchCancelled:
+        fetch_jobs.finish(job, 'cancelled')
+        socketio.emit('fetch_cancelled', {'job_id': job.id}, to=username)
+    except Exception as e:
+        fetch_jobs.finish(job, 'failed')
+        socketio.emit('fetch_error', {'job_id': job.id, 'error': str(e)}, to=username)
+    else:
+        fetch_jobs.finish(job, 'done')
+        # The emails themselves are paged in from /api/emails, so the event stays small however many there are
+        complete = {'job_id': job.id, 'total': len(records),
+                    'since': since and since.strftime('%Y-%m-%d'), 'before': before and before.strftime('%Y-%m-%d')}
+        if timings:
+            complete['timings'] = trace.breakdown()
+        socketio.emit('fetch_complete', complete, to=username)  # Notify the client that fetching is complete
+        socketio.start_background_task(extract_attachments, username, password, records)
+    finally:
+        print(f"[trace {trace.id}] fetch for {username} {job.status}: {trace.summary()}")
+
+def run_idle_watcher(username, password, stop):
+    """Hold an IDLE connection on the user's first folder and push newly arrived matches to their room."""
+    mailbox = MAIL_FOLDERS[0]
+    while not stop.is_set():
+        mail = None
+        try:
+            mail = imaplib.IMAP4_SSL(IMAP_SERVER, IMAP_PORT)
+            try:
+                mail.login(username, password)
+            except imaplib.IMAP4.abort:
+                raise
+            except imaplib.IMAP4.error as e:
+                print(f"IDLE login for {username} failed: {e}")
+                return
+            if not supports_idle(mail):
+                print(f"{IMAP_SERVER} does not support IDLE, no push updates for {username}")
+                return
+
+            # Catch up first, so only mail arriving from now on is pushed
+            sync_recent_weeks(mail, username, mailbox)
+            while not stop.is_set():
+                if wait_for_mail(mail, stop):
+                    push_new_mail(mail, username, mailbox)
+        except (imaplib.IMAP4.error, OSError) as e:
+            print(f"IDLE connection for {username} dropped: {e}")
+            stop.wait(IDLE_RETRY)
+        finally:
+            if mail is not None:
+                try:
+                    mail.logout()
+                except Exception:
+                    pass
+
+def sync_recent_weeks(mail, username, mailbox, max_weeks=4):
+    """Sync `mailbox` over the same window as the dashboard fetch; only new UIDs are searched and fetched."""
+    oldest_week_start, _ = get_week_date_range(weeks_back=max_weeks - 1)
+    return sync_mailbox(mail, mail_store, username, SEARCH_CRITERIA, oldest_week_start, mailbox)
+
+def push_new_mail(mail, username, mailbox):
+    """Fetch the listing of messages that arrived since the last sync and emit their summaries to the user's room."""
+    state = mail_store.get_state(username, mailbox, SEARCH_CRITERIA)
+    uidvalidity = sync_recent_weeks(mail, username, mailbox)
+    last_uid = state['last_uid'] if state and state['uidvalidity'] == uidvalidity else 0
+
+    records = [record for record in mail_store.messages(username, mailbox, SEARCH_CRITERIA)
+               if record.uidvalidity == uidvalidity and record.uid > last_uid]
+    for record in RULES.tag(records):
+        with metrics.timed('socket_emit'):
+            socketio.emit('email_update', record.summary(), to=username)
+
+def select_recent_week(username, password, max_weeks=4):
+    """
+    Search the whole max_weeks window once, then pick the most recent week with matches locally.
 
-    return email_data
+    Every folder in MAIL_FOLDERS is searched in parallel; returns the merged
+    records of that week without duplicates, newest first.
+    """
+    return find_recent_week(username, password, max_weeks)[2]
 
+def find_recent_week(username, password, max_weeks=4, on_progress=None):
+    """Like select_recent_week, but return (start, before, records) of the week; the dates are None if none matched.
 
-def fetch_emails_with_dynamic_range(username, password, max_weeks=4, emit_updates=False):
-    """
-    Dynamically search emails going backwards from today, week by week, for up to max_weeks.
+    `on_progress` is passed on to fetch_orchestrator.sync_targets.
     """
-    email_data = []
     today = datetime.now()
+    oldest_week_start, _ = get_week_date_range(weeks_back=max_weeks - 1)
+    credentials = {username: password}
+    targets = [(username, folder) for folder in MAIL_FOLDERS]
+
+    # One SEARCH and one header-only FETCH per folder for all weeks; only unseen UIDs are new to the store
+    targets = sync_targets(imap_pool, credentials, mail_store, targets, SEARCH_CRITERIA, oldest_week_start,
+                           on_progress=on_progress)
 
-    # Get the start of this week and today's end-of-day as initial boundaries
     for week in range(max_weeks):
         # Calculate the start and end of each past week
         start_of_week, end_of_week = get_week_date_range(weeks_back=week)
 
-        # If it's the current week, ensure we include today by adjusting 'before_date' to tomorrow
+        # If it's the current week, ensure we include today by adjusting 'before' to tomorrow
         if week == 0:
-            before_date = (today + timedelta(days=1)).strftime('%d-%b-%Y')  # Include today
+            before = today + timedelta(days=1)  # Include today
         else:
             # For past weeks, add 1 day after the end of the week
-            before_date = (end_of_week + timedelta(days=1)).strftime('%d-%b-%Y')
+            before = end_of_week + timedelta(days=1)
 
-        since_date = start_of_week.strftime('%d-%b-%Y')
+        records = merge_records(mail_store, targets, SEARCH_CRITERIA, start_of_week, before)
 
-        # Fetch emails for the calculated date range
-        email_data += fetch_emails(username, password, since_date, before_date, emit_updates=emit_updates)
+        # Categories come from the cached headers, without another SEARCH
+        RULES.tag(records)
 
         # If emails are found, stop searching
-        if email_data:
-            break
+        if records:
+            return start_of_week, before, records
         else:
-            print(f"No emails found between {since_date} and {before_date}, checking previous week...")
+            print(f"No emails found between {start_of_week:%d-%b-%Y} and {before:%d-%b-%Y}, checking previous week...")
 
-    return email_data
+    return None, None, []
 
+def fetch_emails_with_dynamic_range(username, password, max_weeks=4, on_progress=None):
+    """
+    Sync the listing and pick the most recent week with matches, from headers only.
+
+    Returns the (since, before) dates of that week and its records, which
+    the dashboard then pages through with /api/emails. `on_progress`
+    is called with (stage, done, total) at every stage of every folder's
+    sync and may raise to stop it.
+    """
+    return find_recent_week(username, password, max_weeks, on_progress)
+
+def extract_attachments(username, password, records):
+    """Download and decode the selected attachments of `records` off the fetch, then tell the user's dashboards."""
+    trace = metrics.Trace()
+    metrics.activate(trace)
+    try:
+        decoded = attachment_pipeline.run(imap_pool, {username: password}, records)
+    except Exception as e:
+        print(f"Attachment extraction for {username} failed: {e}")
+        return
+    print(f"[trace {trace.id}] {decoded} attachments for {username}: {trace.summary()}")
+    if decoded:
+        socketio.emit('attachments_ready', {'count': decoded}, to=username)
+
+def encode_cursor(record):
+    """Return the opaque /api/emails cursor pointing just after `record`."""
+    position = json.dumps([record.date.isoformat(), record.mailbox, record.uid])
+    return base64.urlsafe_b64encode(position.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    """Return the (date, mailbox, uid) position of a cursor; raises ValueError if it is malformed."""
+    try:
+        date, mailbox, uid = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(date), mailbox, int(uid)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+@app.route('/api/emails')
+def list_emails():
+    """Return one page of the stored email summaries, newest first.
+
+    Takes `cursor` (the `next_cursor` of the previous page), `limit` and the
+    `since`/`before` dates (YYYY-MM-DD, default: the dashboard's four weeks).
+    Only the local store is read; the dashboard fetch and IDLE keep it synced.
+    A thread or a series of near-identical announcements is listed once, by
+    its newest email, with `count` telling how many it stands for. The first
+    page also carries the `total` number of entries.
+    """
+    login = current_login()
+    if login is None:
+        return jsonify({'error': 'Not logged in'}), 401
+    username = login[0]
+
+    limit = max(1, min(request.args.get('limit', PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    try:
+        since = request.args.get('since')
+        since = datetime.strptime(since, '%Y-%m-%d') if since else get_week_date_range(weeks_back=3)[0]
+        before = request.args.get('before')
+        before = datetime.strptime(before, '%Y-%m-%d') if before else None
+        cursor = request.args.get('cursor')
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    records, total = mail_store.page(username, MAIL_FOLDERS, SEARCH_CRITERIA, since, before, after, limit, grouped=True)
+    RULES.tag(records)
+
+    page = {
+        'emails': [record.summary() for record in records],
+        'next_cursor': encode_cursor(records[-1]) if len(records) == limit else None,
+    }
+    if total is not None:
+        page['total'] = total
+    return jsonify(page)
+
+def stream_report(username, password, records, key):
+    """Yield the report while the bodies are downloaded, caching it once complete.
+
+    `records` are the entries of the report, already grouped by collapse.
+    A report missing a body that could not be fetched is not cached.
+    """
+    chunks = []
+    for chunk in render_report(iter_bodies(imap_pool, {username: password}, mail_store, records, raw_cache=raw_cache)):
+        chunks.append(chunk)
+        yield chunk
+
+    if all(record.has_body for record in records):
+        report_cache.put(username, key, b"".join(chunks))
+
+@app.route('/api/emails/<int:uid>/body')
+@app.route('/email_body/<int:uid>')
+def email_body(uid):
+    """Return the body of one message, downloading just its text part on first access, and its attachments."""
+    login = current_login()
+    if login is None:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    username, password = login
+    mailbox = request.args.get('mailbox', "INBOX")
+    record = mail_store.message(username, mailbox, uid)
+    if record is None:
+        return jsonify({'error': 'Unknown message'}), 404
+
+    if not record.has_body:
+        with imap_pool.connection(username, password) as mail:
+            uidvalidity = select_mailbox(mail, mailbox)
+            download_bodies(mail, mail_store, username, uidvalidity, [uid], mailbox, raw_cache=raw_cache)
+        record = mail_store.message(username, mailbox, uid)
+
+    attachments = []
+    for attachment in mail_store.attachments(username, mailbox, record.uidvalidity, uid):
+        attachment.pop('sha256')
+        attachment['url'] = (url_for('attachment_file', uid=uid, section=attachment['section'], mailbox=mailbox)
+                             if attachment['state'] == 'done' else None)
+        attachments.append(attachment)
+
+    return jsonify({'uid': uid, 'mailbox': mailbox, 'body': record.body or "No body available",
+                    'attachments': attachments})
+
+@app.route('/api/emails/<int:uid>/attachments/<section>')
+def attachment_file(uid, section):
+    """Send a decoded attachment from disk; only attachments the pipeline has processed are available."""
+    login = current_login()
+    if login is None:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    username = login[0]
+    mailbox = request.args.get('mailbox', "INBOX")
+    record = mail_store.message(username, mailbox, uid)
+    attachment = None
+    if record is not None:
+        attachment = next((attachment for attachment in mail_store.attachments(username, mailbox, record.uidvalidity, uid)
+                           if attachment['section'] == section), None)
+    path = attachment_pipeline.file(attachment) if attachment else None
+    if path is None:
+        return jsonify({'error': 'Unknown attachment'}), 404
+
+    return send_file(path, mimetype=attachment['content_type'], as_attachment=True,
+                     download_name=attachment['filename'] or f"attachment-{uid}-{section}")
+
+@app.route('/search')
+def search():
+    """Answer a full-text query from the local index of fetched mail, best matches first."""
+    login = current_login()
+    if login is None:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    query = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    records = mail_store.search(query, login[0], limit)
+
+    results = []
+    for record in records:
+        # Listing fields only; the snippet stands in for the body
+        entry = record.summary()
+        # Escape the snippet, then mark the matched terms
+        entry['snippet'] = str(escape(record.snippet)).replace(HIGHLIGHT_START, "<mark>").replace(HIGHLIGHT_END, "</mark>")
+        entry['score'] = record.score
+        results.append(entry)
+
+    return jsonify({'query': query, 'results': results})
 
 
 @app.route('/cli')
@@ -193,164 +529,30 @@ def cli_interface():
     # Directly serve the CLI interface without session or credential checks
     return render_template('cli.html')
 
-# WebSocket event for handling CLI commands for email_reader.py
+# WebSocket event for running email_reader.py in-process for this socket
 @socketio.on('start_cli')
 def start_cli():
-    global running_process
+    sid = request.sid
+    if sid in cli_sessions:
+        return  # One run at a time per socket
+
+    cli = CLISession(lambda event, data: socketio.emit(event, data, to=sid))
+    cli_sessions[sid] = cli
+    socketio.start_background_task(run_cli_session, sid, cli)
+
+def run_cli_session(sid, cli):
     try:
-        # Start the email_reader.py script as a subprocess
-        running_process = subprocess.Popen(
-            shlex.split("python email_reader.py"),
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1
-        )
-
-        # Continuously read the output from the script and send it to the client
-        while True:
-            output_line = running_process.stdout.readline()
-            if output_line:
-                emit('cli_output', {'output': output_line})  # Send real-time output to the client
-            else:
-                break
-    except Exception as e:
-        emit('cli_output', {'output': str(e)})
+        cli.run()
+    finally:
+        if cli_sessions.get(sid) is cli:
+            del cli_sessions[sid]
 
-# WebSocket event for sending input to the subprocess
+# WebSocket event for answering a prompt of this socket's CLI session
 @socketio.on('cli_input')
 def cli_input(data):
-    user_input = data.get('input') + '\n'  # Append newline to simulate terminal input
-    if running_process:
-        running_process.stdin.write(user_input)
-        running_process.stdin.flush()
-
-from datetime import datetime
-
-def generate_html_file(email_data):
-    """Generate a report file for emails with enhanced design and sorted by both date and time."""
-    temp_dir = tempfile.mkdtemp()
-    file_path = os.path.join(temp_dir, "emails_report.html")
-
-    # Ensure both date and time are taken into account for sorting
-    email_data = sorted(email_data, key=lambda x: datetime.strptime(f"{x['date']} {x['time']}", '%d.%m.%Y %H:%M'), reverse=True)
-
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write('''<html><head><title>Email Summary</title>
-        <style>
-            body { 
-                font-family: 'Poppins', Arial, sans-serif; 
-                line-height: 1.8; 
-                background-color: #f4f4f4; 
-                padding: 30px; 
-                color: #333;
-            }
-            h1 { 
-                color: #333; 
-                text-align: center; 
-                margin-bottom: 30px;
-            }
-            .email-container {
-                max-width: 800px;
-                margin: 20px auto;
-                background-color: #fff;
-                padding: 20px;
-                border-radius: 8px;
-                box-shadow: 0px 4px 12px rgba(0, 0, 0, 0.1);
-                border-left: 6px solid #4CAF50;
-            }
-            .email-content {
-                border-bottom: 1px solid #ddd;
-                padding-bottom: 20px;
-                margin-bottom: 20px;
-            }
-            .email-content:last-child {
-                border-bottom: none;
-                margin-bottom: 0;
-            }
-            h2 {
-                font-size: 1.4rem;
-                color: #4CAF50;
-                margin-bottom: 10px;
-            }
-            h3 {
-                font-size: 1.2rem;
-                color: #FF5722;
-                margin-bottom: 10px;
-            }
-            p {
-                font-size: 1rem;
-                color: #555;
-            }
-            .date, .time, .status {
-                color: #888;
-                font-style: italic;
-            }
-            .status {
-                color: #4CAF50;
-                font-weight: bold;
-            }
-            a {
-                color: #4CAF50;
-                text-decoration: none;
-            }
-            a:hover {
-                text-decoration: underline;
-            }
-        </style></head><body>''')
-
-        f.write("<h1>Email Summary</h1>")
-
-        for email in email_data:
-            subject = email['subject']
-            from_ = email['from']
-            body = email['body']
-            date = email['date']
-            time = email.get('time', '')  # Ensure there's a time field
-            status = email.get('status', 'Unread')  # Example of adding status (read/unread)
-
-            f.write(f'<div class="email-container">')
-            f.write(f'<div class="email-content">')
-            f.write(f"<h2>From: {from_}</h2>")
-            f.write(f"<h3>Subject: {subject}</h3>")
-            f.write(f'<p class="date">Date: {date} <span class="time">(Time: {time})</span></p>')
-            f.write(f'<p class="status">Status: {status}</p>')
-            f.write(f"<p>{body}</p>")
-            f.write("</div></div>")
-        
-        f.write("</body></html>")
-
-    return file_path, temp_dir
-
-
-def safe_decode(value):
-    if isinstance(value, bytes):
-        try:
-            return value.decode('utf-8')
-        except UnicodeDecodeError:
-            return value.decode('ISO-8859-9')
-    return value
-
-def decode_mime_words(s):
-    decoded_words = decode_header(s)
-    decoded_string = ""
-    for word, encoding in decoded_words:
-        if isinstance(word, bytes):
-            if encoding:
-                decoded_string += word.decode(encoding)
-            else:
-                decoded_string += word.decode("utf-8")
-        else:
-            decoded_string += word
-    return decoded_string
-
-def get_email_body(msg):
-    if msg.is_multipart():
-        for part in msg.walk():
-            if part.get_content_type() == "text/plain":
-                return part.get_payload(decode=True).decode("utf-8")
-    return msg.get_payload(decode=True).decode("utf-8")
+    cli = cli_sessions.get(request.sid)
+    if cli:
+        cli.send_input(data.get('input', ''))
 
 def get_week_date_range(weeks_back=0):
     """Return the start (Monday) and end (Sunday) of a past week based on weeks_back."""
@@ -360,7 +562,7 @@ def get_week_date_range(weeks_back=0):
     
     # Calculate the start of the week (Monday) and end of the week (Sunday) based on weeks_back
     start_of_week = last_sunday - timedelta(days=6 + weeks_back * 7)  # Calculate Monday of past weeks
-    end_of_week = last_sunday - timedelta(weeks=weeks_back * 7)  # Calculate Sunday of past weeks
+    end_of_week = last_sunday - timedelta(weeks=weeks_back)  # Calculate Sunday of past weeks
 
     return start_of_week, end_of_week
 
@@ -0,0 +1,152 @@
+import binascii
+import hashlib
+import multiprocessing.context
+import os
+import quopri
+import re
+import sys
+import tempfile
+
+from mail_parse import decode_bytes
+
+# Attachment decoding, run in the worker processes of attachments.AttachmentPipeline. The
+# workers also start from this module: with the spawn start method a child re-imports the
+# parent's __main__, which for `python app.py` would monkey patch it with eventlet and open
+# the stores and pools again, so only the standard library and mail_parse are imported here.
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # pypdf is optional; without it PDFs only get their metadata
+    PdfReader = None
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it images only get their metadata
+    Image = None
+
+# Characters of text kept per attachment
+ATTACHMENT_TEXT_CHARS = 64 * 1024
+
+# Bytes read and decoded at a time
+DECODE_CHUNK_SIZE = 64 * 1024
+
+_BASE64_NOISE = re.compile(rb"[^A-Za-z0-9+/]")
+
+
+def stored_path(root, sha256):
+    """Return where the decoded content with this hash is kept under `root`."""
+    return os.path.join(root, sha256[:2], sha256)
+
+
+class _HashingWriter:
+    """Writes to a file while computing the SHA-256 of what was written."""
+
+    def __init__(self, f):
+        self._file = f
+        self.digest = hashlib.sha256()
+
+    def write(self, data):
+        self.digest.update(data)
+        return self._file.write(data)
+
+
+def _decode_base64(src, dst):
+    pending = b""
+    for chunk in iter(lambda: src.read(DECODE_CHUNK_SIZE), b""):
+        # Padding only ever ends the data, so it is dropped here and added back at the end
+        data = pending + _BASE64_NOISE.sub(b"", chunk)
+        usable = len(data) - len(data) % 4
+        dst.write(binascii.a2b_base64(data[:usable]))
+        pending = data[usable:]
+    if len(pending) > 1:
+        dst.write(binascii.a2b_base64(pending + b"=" * (-len(pending) % 4)))
+
+
+def _extract(path, content_type, charset):
+    """Return (text, metadata) of a decoded attachment; either may be None."""
+    if content_type.startswith("text/"):
+        with open(path, "rb") as f:
+            data = f.read(ATTACHMENT_TEXT_CHARS * 4)
+        return decode_bytes(data, charset)[:ATTACHMENT_TEXT_CHARS], None
+
+    if content_type == "application/pdf" and PdfReader is not None:
+        reader = PdfReader(path)
+        text = ""
+        for page in reader.pages:
+            text += (page.extract_text() or "") + "\n"
+            if len(text) >= ATTACHMENT_TEXT_CHARS:
+                break
+        return text[:ATTACHMENT_TEXT_CHARS], {'pages': len(reader.pages)}
+
+    if content_type.startswith("image/") and Image is not None:
+        with Image.open(path) as image:
+            return None, {'width': image.width, 'height': image.height, 'format': image.format}
+
+    return None, None
+
+
+def decode_attachment(spool_path, encoding, content_type, charset, root):
+    """Decode a spooled attachment into `root`, named by the SHA-256 of its content.
+
+    Runs in a worker process and streams the data, so no attachment is
+    ever held in memory. The spooled file is removed. Content already
+    stored under `root` is not extracted again (`duplicate` is True and
+    the caller reuses the earlier extract).
+    """
+    fd, decoded_path = tempfile.mkstemp(dir=os.path.dirname(spool_path), suffix=".decoded")
+    try:
+        with open(spool_path, "rb") as src, os.fdopen(fd, "wb") as f:
+            dst = _HashingWriter(f)
+            if encoding == "base64":
+                _decode_base64(src, dst)
+            elif encoding == "quoted-printable":
+                quopri.decode(src, dst)
+            else:
+                for chunk in iter(lambda: src.read(DECODE_CHUNK_SIZE), b""):
+                    dst.write(chunk)
+
+        sha256 = dst.digest.hexdigest()
+        result = {'sha256': sha256, 'decoded_size': os.path.getsize(decoded_path), 'duplicate': False,
+                  'text': None, 'metadata': None}
+
+        path = stored_path(root, sha256)
+        if os.path.exists(path):
+            result['duplicate'] = True
+            return result
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(decoded_path, path)
+        try:
+            result['text'], result['metadata'] = _extract(path, content_type, charset)
+        except Exception as e:
+            # A broken file is still stored and listed, just without an extract
+            result['metadata'] = {'error': str(e)}
+        return result
+    finally:
+        for leftover in (spool_path, decoded_path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+class _WorkerProcess(multiprocessing.context.SpawnProcess):
+    """A spawned process that starts from this module instead of the parent's __main__."""
+
+    @staticmethod
+    def _Popen(process_obj):
+        # The preparation data sent to the child names sys.modules['__main__'] as the module to
+        # run first; it is read while the child is launched, without yielding to other greenlets
+        main = sys.modules['__main__']
+        sys.modules['__main__'] = sys.modules[__name__]
+        try:
+            return multiprocessing.context.SpawnProcess._Popen(process_obj)
+        finally:
+            sys.modules['__main__'] = main
+
+
+class _WorkerContext(multiprocessing.context.SpawnContext):
+    Process = _WorkerProcess
+
+
+def worker_context():
+    """Return the multiprocessing context for ProcessPoolExecutor(mp_context=...) running decode_attachment."""
+    return _WorkerContext()
@@ -0,0 +1,190 @@
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+from attachment_worker import decode_attachment, stored_path, worker_context
+from fetch_orchestrator import MAX_PARALLEL_FETCHES, run_targets
+from imap_fetch import fetch_batched, streamed_literals
+from mail_sync import select_mailbox
+
+# Where decoded attachments are kept, one file per distinct content (named by its SHA-256)
+ATTACHMENT_PATH = os.environ.get("ATTACHMENT_PATH", "attachments")
+
+# Content types that are downloaded and decoded, comma separated; "image/*" matches every image
+ATTACHMENT_TYPES = [value.strip().lower() for value in
+                    os.environ.get("ATTACHMENT_TYPES", "application/pdf,text/csv,text/plain,image/*").split(",")
+                    if value.strip()]
+
+# Attachments larger than this (as sent, i.e. still transfer-encoded) are only listed
+ATTACHMENT_MAX_BYTES = int(os.environ.get("ATTACHMENT_MAX_BYTES", 25 * 1024 * 1024))
+
+# Worker processes decoding attachments
+ATTACHMENT_WORKERS = int(os.environ.get("ATTACHMENT_WORKERS", "2"))
+
+# Seconds after which a spooled part or a claimed attachment is taken to be left over from a crashed process
+SPOOL_MAX_AGE = 3600
+
+
+def wanted(part, types=ATTACHMENT_TYPES, max_bytes=ATTACHMENT_MAX_BYTES):
+    """Tell whether an attachment listed by imap_fetch.find_attachments is to be downloaded."""
+    if part['size'] is not None and part['size'] > max_bytes:
+        return False
+    content_type = part['content_type'].lower()
+    return any(content_type == pattern or (pattern.endswith("/*") and content_type.startswith(pattern[:-1]))
+               for pattern in types)
+
+
+class _SpoolSink:
+    """Streams one FETCH literal to a file in `directory`; close() returns the file's path."""
+
+    def __init__(self, directory):
+        fd, self.path = tempfile.mkstemp(dir=directory, suffix=".part")
+        self._file = os.fdopen(fd, "wb")
+
+    def feed(self, data):
+        self._file.write(data)
+
+    def close(self):
+        self._file.close()
+        return self.path
+
+
+class AttachmentPipeline:
+    """Downloads the selected attachments of stored messages and decodes them on a process pool.
+
+    Only the selected parts are fetched, with BODY.PEEK[<section>], and
+    each is streamed to a file as it arrives; decoding, hashing and text extraction happen
+    in worker processes, so neither the memory of the server nor its
+    eventlet loop depends on attachment size. Results go into the message
+    store; identical content is kept on disk and extracted only once.
+    """
+
+    def __init__(self, store, path=ATTACHMENT_PATH, max_workers=ATTACHMENT_WORKERS):
+        self.store = store
+        self.path = path
+        self.max_workers = max_workers
+        self._spool = os.path.join(path, "spool")
+        self._executor = None
+        os.makedirs(self._spool, exist_ok=True)
+        # Attachments claimed by a run that did not finish are picked up again; other processes may be
+        # working on the recent claims
+        store.release_attachments(SPOOL_MAX_AGE)
+        # Spooled parts of an interrupted run are never picked up again; other workers may share the directory
+        for name in os.listdir(self._spool):
+            spooled = os.path.join(self._spool, name)
+            try:
+                if time.time() - os.path.getmtime(spooled) > SPOOL_MAX_AGE:
+                    os.remove(spooled)
+            except OSError:
+                pass
+
+    def executor(self):
+        if self._executor is None:
+            # Forked workers would inherit the parent's eventlet hub and sockets; spawned ones start
+            # clean, from attachment_worker rather than a re-import of the server's __main__
+            self._executor = ProcessPoolExecutor(self.max_workers, mp_context=worker_context())
+        return self._executor
+
+    def process(self, mail, account, mailbox, uidvalidity, uids):
+        """Fetch and decode the pending attachments of `uids`; `mail` must have `mailbox` selected.
+
+        Parts are claimed in the store first, so a run that overlaps another
+        one (a second dashboard fetch, another server process) does not fetch
+        them again. Returns the number of attachments decoded.
+        """
+        pending = self.store.claim_attachments(account, mailbox, uidvalidity, uids)
+
+        # One batched FETCH per distinct section, as for bodies
+        sections = {}
+        for uid, parts in pending.items():
+            for part in parts:
+                if wanted(part):
+                    sections.setdefault(part['section'], {})[uid] = part
+                else:
+                    self.store.save_attachment(account, mailbox, uidvalidity, uid, part['section'], 'skipped')
+
+        decoding = []
+        try:
+            for section, parts in sections.items():
+                with streamed_literals(mail, lambda: _SpoolSink(self._spool)):
+                    messages = list(fetch_batched(mail, list(parts), f"(UID BODY.PEEK[{section}])", uid=True))
+                for message in messages:
+                    spool_path = next((value for name, value in message.items() if name.startswith("BODY[")), None)
+                    part = parts.get(message["UID"])
+                    if part is None or spool_path is None:
+                        continue
+                    future = self.executor().submit(decode_attachment, spool_path, part['encoding'],
+                                                    part['content_type'].lower(), part['charset'], self.path)
+                    decoding.append((message["UID"], part, future))
+        finally:
+            # Parts that were fetched are decoded and saved even if a later FETCH failed; the others are
+            # handed back for the next run
+            decoded = self._save(account, mailbox, uidvalidity, decoding)
+            submitted = {(uid, part['section']) for uid, part, _ in decoding}
+            for section, parts in sections.items():
+                for uid in parts:
+                    if (uid, section) not in submitted:
+                        self.store.save_attachment(account, mailbox, uidvalidity, uid, section, None)
+        return decoded
+
+    def _save(self, account, mailbox, uidvalidity, decoding):
+        decoded = 0
+        for uid, part, future in decoding:
+            # Waiting is cooperative under eventlet; the work happens in another process
+            with metrics.timed("decode_attachment"):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Could not decode attachment {part['section']} of {mailbox}/{uid} ({account}): {e}")
+                    self.store.save_attachment(account, mailbox, uidvalidity, uid, part['section'], 'failed')
+                    continue
+            metrics.add_bytes("decode_attachment", result['decoded_size'])
+
+            text, metadata = result['text'], result['metadata']
+            if result['duplicate']:
+                text, metadata = self.store.extract_by_hash(result['sha256']) or (None, None)
+            self.store.save_attachment(account, mailbox, uidvalidity, uid, part['section'], 'done',
+                                       result['sha256'], result['decoded_size'], text, metadata)
+            decoded += 1
+        return decoded
+
+    def run(self, pool, credentials, records, max_workers=MAX_PARALLEL_FETCHES):
+        """Process the attachments of `records`, their folders in parallel; returns the number decoded."""
+        by_target = {}
+        for record in records:
+            by_target.setdefault((record.account, record.mailbox), []).append(record)
+
+        # Folders whose attachments were all handled already are not connected to at all
+        for target, target_records in list(by_target.items()):
+            if not self.store.pending_attachments(target[0], target[1], target_records[0].uidvalidity,
+                                                  [record.uid for record in target_records]):
+                del by_target[target]
+
+        def work(mail, account, mailbox):
+            target_records = by_target[(account, mailbox)]
+            uidvalidity = target_records[0].uidvalidity
+            if select_mailbox(mail, mailbox) != uidvalidity:
+                return 0  # The folder was rebuilt meanwhile; the next sync lists it again
+            return self.process(mail, account, mailbox, uidvalidity, [record.uid for record in target_records])
+
+        decoded = 0
+        for target, result in run_targets(pool, credentials, list(by_target), work, max_workers).items():
+            if isinstance(result, Exception):
+                print(f"Could not fetch attachments from {target[1]} of {target[0]}: {result}")
+            else:
+                decoded += result
+        return decoded
+
+    def file(self, attachment):
+        """Return the path of a decoded attachment (as listed by MailStore.attachments), or None."""
+        if attachment['state'] != 'done' or not attachment['sha256']:
+            return None
+        path = stored_path(self.path, attachment['sha256'])
+        return path if os.path.exists(path) else None
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
@@ -0,0 +1,490 @@
+"""In-process IMAP4rev1 stand-in used by the benchmarks.
+
+Implements just enough of RFC 3501 for the code paths in app.py and
+email_reader.py: LOGIN, SELECT, LIST, (UID) SEARCH, (UID) FETCH,
+(UID) STORE, IDLE, NOOP and LOGOUT over plain TCP on localhost.
+"""
+import email
+import re
+import select
+import socketserver
+import threading
+import time
+from email import policy
+from email.header import decode_header, make_header
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+
+class FakeMessage:
+    """A stored message with its UID, flags and INTERNALDATE."""
+
+    def __init__(self, uid, raw, flags=(), internaldate=None):
+        self.uid = uid
+        self.raw = raw
+        self.flags = set(flags)
+        self.msg = email.message_from_bytes(raw)
+        if internaldate is None:
+            try:
+                internaldate = parsedate_to_datetime(self.msg["Date"])
+            except (TypeError, ValueError):
+                internaldate = datetime.now(timezone.utc)
+        if internaldate.tzinfo is None:
+            internaldate = internaldate.replace(tzinfo=timezone.utc)
+        self.internaldate = internaldate
+
+
+class FakeMailbox:
+    """A folder holding messages in UID order."""
+
+    def __init__(self, name, uidvalidity=1):
+        self.name = name
+        self.uidvalidity = uidvalidity
+        self.messages = []
+        self.next_uid = 1
+
+    def append(self, raw, flags=(), internaldate=None):
+        message = FakeMessage(self.next_uid, raw, flags, internaldate)
+        self.next_uid += 1
+        self.messages.append(message)
+        return message
+
+
+# --- command tokenizer -------------------------------------------------------
+
+_TOKEN_RE = re.compile(r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|((?:[^\s()"\[\]]|\[[^\]]*\])+))')
+
+
+def tokenize(text):
+    stack = [[]]
+    position = 0
+    while position < len(text):
+        match = _TOKEN_RE.match(text, position)
+        if not match or match.end() == position:
+            break
+        position = match.end()
+        open_paren, close_paren, quoted, atom = match.groups()
+        if open_paren:
+            stack.append([])
+        elif close_paren:
+            finished = stack.pop()
+            stack[-1].append(finished)
+        elif quoted is not None:
+            stack[-1].append(re.sub(r'\\(.)', r'\1', quoted))
+        elif atom is not None:
+            stack[-1].append(atom)
+    return stack[0]
+
+
+def parse_sequence_set(text, largest):
+    numbers = set()
+    for piece in text.split(","):
+        if ":" in piece:
+            low, high = piece.split(":")
+            low = largest if low == "*" else int(low)
+            high = largest if high == "*" else int(high)
+            # "n:*" past the last UID still includes the last one, as on real servers
+            if low > high:
+                low, high = high, low
+            numbers.update(range(low, high + 1))
+        else:
+            numbers.add(largest if piece == "*" else int(piece))
+    return numbers
+
+
+def quote(value):
+    if value is None:
+        return "NIL"
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _split_part(part):
+    data = part.as_bytes(policy=policy.SMTP)
+    head, _, body = data.partition(b"\r\n\r\n")
+    return head + b"\r\n\r\n", body
+
+
+def body_structure(part):
+    if part.is_multipart():
+        children = "".join(body_structure(child) for child in part.get_payload())
+        boundary = part.get_param("boundary")
+        params = f'("boundary" {quote(boundary)})' if boundary else "NIL"
+        return f'({children} {quote(part.get_content_subtype())} {params} NIL NIL)'
+
+    params = [f'{quote(k)} {quote(v)}' for k, v in part.get_params()[1:]] if part.get_params() else []
+    params = f'({" ".join(params)})' if params else "NIL"
+    _, body = _split_part(part)
+    encoding = part.get("Content-Transfer-Encoding", "7bit").lower()
+    fields = (f'{quote(part.get_content_maintype())} {quote(part.get_content_subtype())} {params} '
+              f'NIL NIL {quote(encoding)} {len(body)}')
+    if part.get_content_maintype() == "text":
+        lines = body.count(b"\n")
+        fields += f" {lines}"
+    disposition = part.get_content_disposition()
+    if disposition:
+        filename = part.get_filename()
+        dsp_params = f'("filename" {quote(filename)})' if filename else "NIL"
+        disposition = f'({quote(disposition)} {dsp_params})'
+    else:
+        disposition = "NIL"
+    return f'({fields} NIL {disposition} NIL)'
+
+
+def find_part(msg, section):
+    part = msg
+    for index in section.split("."):
+        index = int(index)
+        if part.is_multipart():
+            part = part.get_payload()[index - 1]
+        elif index != 1:
+            return None
+    return part
+
+
+class Session(socketserver.StreamRequestHandler):
+    """One client connection; commands are dispatched to do_<COMMAND> methods."""
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.wfile.write(data)
+
+    def handle(self):
+        self.mailbox = None
+        self.server.connections += 1
+        self.send("* OK [CAPABILITY IMAP4rev1 IDLE] Fake IMAP ready\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            line = line.decode("utf-8", "replace").rstrip("\r\n")
+            if not line:
+                continue
+            tag, _, rest = line.partition(" ")
+            command, _, args = rest.partition(" ")
+            command = command.upper()
+            uid = False
+            if command == "UID":
+                uid = True
+                command, _, args = args.partition(" ")
+                command = command.upper()
+            handler = getattr(self, "do_" + command, None)
+            if handler is None:
+                self.send(f"{tag} BAD unknown command\r\n")
+                continue
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            try:
+                result = handler(tag, args, uid)
+            except Exception as exc:
+                self.send(f"{tag} BAD {exc}\r\n")
+                continue
+            if result == "LOGOUT":
+                return
+
+    def do_CAPABILITY(self, tag, args, uid):
+        self.send("* CAPABILITY IMAP4rev1 IDLE\r\n")
+        self.send(f"{tag} OK CAPABILITY completed\r\n")
+
+    def do_LOGIN(self, tag, args, uid):
+        username, password = tokenize(args)[:2]
+        expected = self.server.accounts.get(username)
+        if expected is not None and expected != password:
+            self.send(f"{tag} NO [AUTHENTICATIONFAILED] Invalid credentials\r\n")
+            return
+        self.server.logins += 1
+        self.send(f"{tag} OK LOGIN completed\r\n")
+
+    def do_IDLE(self, tag, args, uid):
+        """Report new messages of the selected mailbox as EXISTS until the client sends DONE."""
+        self.send("+ idling\r\n")
+        known = len(self.mailbox.messages) if self.mailbox else 0
+        while True:
+            readable, _, _ = select.select([self.connection], [], [], 0.05)
+            if readable:
+                self.rfile.readline()  # DONE
+                break
+            if self.mailbox and len(self.mailbox.messages) > known:
+                known = len(self.mailbox.messages)
+                self.send(f"* {known} EXISTS\r\n")
+        self.send(f"{tag} OK IDLE terminated\r\n")
+
+    def do_NOOP(self, tag, args, uid):
+        self.send(f"{tag} OK NOOP completed\r\n")
+
+    def do_LOGOUT(self, tag, args, uid):
+        self.send("* BYE logging out\r\n")
+        self.send(f"{tag} OK LOGOUT completed\r\n")
+        return "LOGOUT"
+
+    def do_SELECT(self, tag, args, uid):
+        name = tokenize(args)[0]
+        mailbox = self.server.mailboxes.get(name.upper()) or self.server.mailboxes.get(name)
+        if mailbox is None:
+            self.send(f"{tag} NO no such mailbox\r\n")
+            return
+        self.mailbox = mailbox
+        self.send(f"* {len(mailbox.messages)} EXISTS\r\n")
+        self.send("* 0 RECENT\r\n")
+        self.send(f"* OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid\r\n")
+        self.send(f"* OK [UIDNEXT {mailbox.next_uid}] Predicted next UID\r\n")
+        self.send("* FLAGS (\\Answered \\Flagged \\Deleted \\Seen \\Draft)\r\n")
+        self.send(f"{tag} OK [READ-WRITE] SELECT completed\r\n")
+
+    do_EXAMINE = do_SELECT
+
+    def do_LIST(self, tag, args, uid):
+        for name in self.server.mailboxes:
+            self.send(f'* LIST () "/" {quote(name)}\r\n')
+        self.send(f"{tag} OK LIST completed\r\n")
+
+    # --- SEARCH --------------------------------------------------------------
+
+    def _matches(self, tokens, position, message, seq):
+        key = tokens[position]
+        if isinstance(key, list):
+            end = 0
+            ok = True
+            while end < len(key):
+                matched, end = self._matches(key, end, message, seq)
+                ok = ok and matched
+            return ok, position + 1
+        upper = key.upper()
+        if upper == "ALL":
+            return True, position + 1
+        if upper == "OR":
+            left, position = self._matches(tokens, position + 1, message, seq)
+            right, position = self._matches(tokens, position, message, seq)
+            return left or right, position
+        if upper == "NOT":
+            matched, position = self._matches(tokens, position + 1, message, seq)
+            return not matched, position
+        if upper in ("SUBJECT", "FROM", "TO"):
+            value = str(make_header_text(message.msg.get(upper, "")))
+            return tokens[position + 1].lower() in value.lower(), position + 2
+        if upper == "HEADER":
+            value = str(make_header_text(message.msg.get(tokens[position + 1], "")))
+            return tokens[position + 2].lower() in value.lower(), position + 3
+        if upper in ("SINCE", "BEFORE", "ON"):
+            day = datetime.strptime(tokens[position + 1], "%d-%b-%Y").date()
+            internal = message.internaldate.date()
+            if upper == "SINCE":
+                return internal >= day, position + 2
+            if upper == "BEFORE":
+                return internal < day, position + 2
+            return internal == day, position + 2
+        if upper == "UID":
+            largest = self.mailbox.messages[-1].uid if self.mailbox.messages else 0
+            return message.uid in parse_sequence_set(tokens[position + 1], largest), position + 2
+        if upper == "SEEN":
+            return "\\Seen" in message.flags, position + 1
+        if upper == "UNSEEN":
+            return "\\Seen" not in message.flags, position + 1
+        if upper == "LARGER":
+            return len(message.raw) > int(tokens[position + 1]), position + 2
+        if upper == "SMALLER":
+            return len(message.raw) < int(tokens[position + 1]), position + 2
+        if upper == "CHARSET":
+            return True, position + 2
+        # A bare sequence set
+        return seq in parse_sequence_set(key, len(self.mailbox.messages)), position + 1
+
+    def do_SEARCH(self, tag, args, uid):
+        tokens = tokenize(args)
+        if tokens and isinstance(tokens[0], str) and tokens[0].upper() == "CHARSET":
+            tokens = tokens[2:]
+        results = []
+        for seq, message in enumerate(self.mailbox.messages, start=1):
+            position = 0
+            ok = True
+            while position < len(tokens):
+                matched, position = self._matches(tokens, position, message, seq)
+                ok = ok and matched
+            if ok:
+                results.append(str(message.uid if uid else seq))
+        self.send(("* SEARCH " + " ".join(results)).rstrip() + "\r\n")
+        self.send(f"{tag} OK SEARCH completed\r\n")
+
+    # --- FETCH ---------------------------------------------------------------
+
+    def _select_messages(self, message_set, uid):
+        messages = self.mailbox.messages
+        if uid:
+            largest = messages[-1].uid if messages else 0
+            wanted = parse_sequence_set(message_set, largest)
+            return [(seq, m) for seq, m in enumerate(messages, start=1) if m.uid in wanted]
+        wanted = parse_sequence_set(message_set, len(messages))
+        return [(seq, m) for seq, m in enumerate(messages, start=1) if seq in wanted]
+
+    def do_FETCH(self, tag, args, uid):
+        message_set, _, items = args.partition(" ")
+        items = tokenize(items)
+        if len(items) == 1 and isinstance(items[0], list):
+            items = items[0]
+        items = [i.upper() if isinstance(i, str) else i for i in items]
+        macros = {"ALL": ["FLAGS", "INTERNALDATE", "RFC822.SIZE"],
+                  "FAST": ["FLAGS", "INTERNALDATE", "RFC822.SIZE"]}
+        expanded = []
+        for item in items:
+            expanded.extend(macros.get(item, [item]))
+        if uid and "UID" not in expanded:
+            expanded.insert(0, "UID")
+
+        for seq, message in self._select_messages(message_set, uid):
+            self.server.fetched_messages += 1
+            out = [f"* {seq} FETCH (".encode()]
+            first = True
+            set_seen = False
+            for item in expanded:
+                piece = self._fetch_item(message, item)
+                if piece is None:
+                    continue
+                if item == "RFC822" or (item.startswith("BODY[") and not item.startswith("BODY.PEEK")):
+                    set_seen = True
+                if not first:
+                    out.append(b" ")
+                out.append(piece)
+                first = False
+            if set_seen and "\\Seen" not in message.flags:
+                message.flags.add("\\Seen")
+            out.append(b")\r\n")
+            data = b"".join(out)
+            self.server.bytes_sent += len(data)
+            self.send(data)
+        self.send(f"{tag} OK FETCH completed\r\n")
+
+    def _literal(self, name, data):
+        return f"{name} {{{len(data)}}}\r\n".encode() + data
+
+    def _fetch_item(self, message, item):
+        if item == "UID":
+            return f"UID {message.uid}".encode()
+        if item == "FLAGS":
+            return f"FLAGS ({' '.join(sorted(message.flags))})".encode()
+        if item == "INTERNALDATE":
+            return f'INTERNALDATE "{message.internaldate.strftime("%d-%b-%Y %H:%M:%S %z")}"'.encode()
+        if item == "RFC822.SIZE":
+            return f"RFC822.SIZE {len(message.raw)}".encode()
+        if item == "RFC822":
+            return self._literal("RFC822", message.raw)
+        if item == "RFC822.HEADER":
+            head, _, _ = message.raw.partition(b"\r\n\r\n")
+            return self._literal("RFC822.HEADER", head + b"\r\n\r\n")
+        if item in ("BODYSTRUCTURE", "BODY"):
+            return f"BODYSTRUCTURE {body_structure(message.msg)}".encode()
+        if item.startswith("BODY[") or item.startswith("BODY.PEEK["):
+            section = item[item.index("[") + 1:item.rindex("]")]
+            name = "BODY[" + section + "]"
+            data = self._section(message, section)
+            partial = re.fullmatch(r"<(\d+)\.(\d+)>", item[item.rindex("]") + 1:])
+            if partial:
+                start, count = int(partial.group(1)), int(partial.group(2))
+                name += f"<{start}>"
+                data = data[start:start + count]
+            return self._literal(name, data)
+        return None
+
+    def _section(self, message, section):
+        upper = section.upper()
+        if upper == "":
+            return message.raw
+        head, _, body = message.raw.partition(b"\r\n\r\n")
+        if upper == "HEADER":
+            return head + b"\r\n\r\n"
+        if upper == "TEXT":
+            return body
+        if upper.startswith("HEADER.FIELDS"):
+            wanted = {name.upper() for name in tokenize(section[section.index("("):])[0]}
+            lines = []
+            keep = False
+            for line in head.split(b"\r\n"):
+                if line[:1] in (b" ", b"\t"):
+                    if keep:
+                        lines.append(line)
+                    continue
+                name = line.split(b":", 1)[0].decode("ascii", "replace").upper()
+                keep = name in wanted
+                if keep:
+                    lines.append(line)
+            return b"\r\n".join(lines) + b"\r\n\r\n"
+        # Numeric part, optionally followed by .MIME / .HEADER / .TEXT
+        numbers = []
+        rest = ""
+        for piece in section.split("."):
+            if piece.isdigit() and not rest:
+                numbers.append(piece)
+            else:
+                rest = piece.upper()
+        part = find_part(message.msg, ".".join(numbers))
+        if part is None:
+            return b""
+        part_head, part_body = _split_part(part)
+        if rest == "MIME":
+            return part_head
+        return part_body
+
+    # --- STORE ---------------------------------------------------------------
+
+    def do_STORE(self, tag, args, uid):
+        message_set, mode, flags = args.split(" ", 2)
+        flags = tokenize(flags)
+        flags = flags[0] if flags and isinstance(flags[0], list) else flags
+        silent = mode.upper().endswith(".SILENT")
+        mode = mode.upper().replace(".SILENT", "")
+        for seq, message in self._select_messages(message_set, uid):
+            if mode == "+FLAGS":
+                message.flags.update(flags)
+            elif mode == "-FLAGS":
+                message.flags.difference_update(flags)
+            else:
+                message.flags = set(flags)
+            if not silent:
+                uid_part = f"UID {message.uid} " if uid else ""
+                self.send(f"* {seq} FETCH ({uid_part}FLAGS ({' '.join(sorted(message.flags))}))\r\n")
+        self.send(f"{tag} OK STORE completed\r\n")
+
+
+def make_header_text(value):
+    """Decode RFC 2047 words so SEARCH matches on the text a client would see."""
+    try:
+        return make_header(decode_header(value))
+    except Exception:
+        return value
+
+
+class FakeIMAPServer(socketserver.ThreadingTCPServer):
+    """A threaded fake IMAP server bound to localhost on a free port."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, accounts=None, latency=0.0):
+        super().__init__(("127.0.0.1", 0), Session)
+        self.accounts = accounts or {}
+        self.mailboxes = {"INBOX": FakeMailbox("INBOX")}
+        self.latency = latency
+        self.logins = 0
+        self.connections = 0
+        self.fetched_messages = 0
+        self.bytes_sent = 0
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def mailbox(self, name="INBOX"):
+        """Return the folder called `name`, creating it if needed."""
+        key = name.upper() if name.upper() == "INBOX" else name
+        if key not in self.mailboxes:
+            self.mailboxes[key] = FakeMailbox(key)
+        return self.mailboxes[key]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
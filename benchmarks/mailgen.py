@@ -0,0 +1,76 @@
+"""Synthetic department mail for the benchmarks."""
+import random
+from datetime import datetime, timedelta, timezone
+from email import policy
+from email.message import EmailMessage
+from email.utils import format_datetime
+
+SUBJECTS = [
+    "DAIS seminar: Graph neural networks",
+    "AIRS talk on reinforcement learning",
+    "[BAIS-ANNC:BILKENT] EXPERIMENT participants wanted",
+    "TRANSPORTATION schedule update",
+    "From the Transportation Unit: ring service",
+    "BUSES on the weekend",
+    "Yemekhane menüsü",
+    "Kütüphane çalışma saatleri",
+]
+
+SENDERS = [
+    "Department Secretary <secretary@cs.bilkent.edu.tr>",
+    "=?utf-8?q?G=C3=BCl=C5=9Fen_=C3=96zt=C3=BCrk?= <gulsen@bilkent.edu.tr>",
+    "Transportation Unit <transportation@bilkent.edu.tr>",
+    "AIRS Lab <airs@bilkent.edu.tr>",
+]
+
+# Turkish text so the ISO-8859-9 and Windows-1254 paths see non-ASCII bytes
+BODY_TEXT = "Değerli öğrenciler, toplantı Çarşamba günü saat 12:30'da EA-409'da yapılacaktır. "
+
+STRUCTURES = ("plain", "alternative", "mixed")
+
+CHARSETS = ("utf-8", "iso-8859-9", "windows-1254")
+
+
+def make_message(index, when, body_size=2048, structure="plain", charset="utf-8", attachment_size=0, rng=random):
+    """Build one RFC 5322 message as bytes.
+
+    `structure` is plain (text/plain only), alternative (text/plain and
+    text/html) or mixed (the text plus an application/pdf attachment of
+    `attachment_size` bytes).
+    """
+    message = EmailMessage(policy=policy.SMTP)
+    message['From'] = rng.choice(SENDERS)
+    message['To'] = "student@ug.bilkent.edu.tr"
+    message['Subject'] = f"{rng.choice(SUBJECTS)} #{index}"
+    message['Date'] = format_datetime(when)
+    message['Message-ID'] = f"<bench-{index}@bilkent.edu.tr>"
+
+    text = (BODY_TEXT * (body_size // len(BODY_TEXT) + 1))[:body_size]
+    message.set_content(text, charset=charset)
+    if structure == "alternative":
+        message.add_alternative(f"<html><body><p>{text}</p></body></html>", subtype="html", charset=charset)
+    elif structure == "mixed":
+        payload = bytes(rng.getrandbits(8) for _ in range(attachment_size or 64 * 1024))
+        message.add_attachment(payload, maintype="application", subtype="pdf", filename=f"announcement-{index}.pdf")
+
+    return message.as_bytes()
+
+
+def seed_mailbox(mailbox, count, days=28, body_size=2048, structures=STRUCTURES, charsets=CHARSETS,
+                 attachment_size=64 * 1024, seen_ratio=0.5, seed=0):
+    """Append `count` messages spread over the last `days` days to a fake mailbox.
+
+    Structures and charsets are cycled through so every combination shows
+    up; the same seed always produces the same mailbox.
+    """
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    total_bytes = 0
+    for index in range(count):
+        when = now - timedelta(seconds=rng.uniform(0, days * 24 * 3600))
+        raw = make_message(index, when, body_size, structures[index % len(structures)],
+                           charsets[index % len(charsets)], attachment_size, rng)
+        flags = ("\\Seen",) if rng.random() < seen_ratio else ()
+        mailbox.append(raw, flags=flags, internaldate=when)
+        total_bytes += len(raw)
+    return total_bytes
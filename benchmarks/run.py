@@ -0,0 +1,230 @@
+"""Time the fetch/parse/render path against the in-process fake IMAP server.
+
+Usage, from the repository root:
+
+    python -m benchmarks.run --messages 1000 --latency 0.005 --json bench.json
+
+Every step runs --repeat times and the best time is reported, together
+with messages/s, MB/s and the peak traced memory of one extra run.
+"""
+import argparse
+import email
+import imaplib
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from benchmarks.fake_imap import FakeIMAPServer
+from benchmarks.mailgen import CHARSETS, STRUCTURES, seed_mailbox
+from email_record import EmailRecord
+from email_report import generate_html_file, render_report
+from imap_fetch import FETCH_BATCH_SIZE, fetch_batched, streamed_literals
+from mail_parse import get_email_body, parse_headers
+from mail_store import MailStore
+from mail_stream import StreamingMessageParser
+from mail_sync import download_bodies, select_mailbox, sync_mailbox, uid_search
+
+DEFAULT_QUERY = '(OR (SUBJECT "DAIS") (SUBJECT "AIRS"))'
+
+
+class Context:
+    """State shared by the steps: the server, a logged-in connection and earlier results."""
+
+    def __init__(self, args):
+        self.args = args
+        self.server = FakeIMAPServer(latency=args.latency).start()
+        self.total_bytes = seed_mailbox(
+            self.server.mailbox(), args.messages, body_size=args.body_size, structures=args.structures,
+            charsets=args.charsets, attachment_size=args.attachment_size, seed=args.seed)
+        self.workdir = tempfile.mkdtemp(prefix="email-reader-bench-")
+        self.mail = imaplib.IMAP4("127.0.0.1", self.server.port)
+        self.mail.login("bench@bilkent.edu.tr", "bench")
+        self.uidvalidity = select_mailbox(self.mail, "INBOX")
+        self.since = date.today() - timedelta(days=args.days)
+        self.uids = []
+        self.raw = []
+        self.records = []
+        self.store = None
+        self.stores = 0
+
+    def new_store(self):
+        if self.store is not None:
+            self.store.close()
+        self.stores += 1
+        self.store = MailStore(os.path.join(self.workdir, f"store-{self.stores}.db"))
+        return self.store
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+        self.mail.logout()
+        self.server.stop()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def step_search(ctx):
+    ctx.uids = uid_search(ctx.mail, ctx.args.query)
+    return len(ctx.uids), 0
+
+
+def step_fetch(ctx):
+    """Full messages, batched, as the raw material for the parse step."""
+    ctx.raw = [message["BODY[]"] for message in
+               fetch_batched(ctx.mail, ctx.uids, "(UID BODY.PEEK[])", ctx.args.batch_size, uid=True)]
+    return len(ctx.raw), sum(len(raw) for raw in ctx.raw)
+
+
+def step_sync_cold(ctx):
+    """Header-only listing into an empty store."""
+    bytes_before = ctx.server.bytes_sent
+    sync_mailbox(ctx.mail, ctx.store, "bench", ctx.args.query, ctx.since)
+    return len(ctx.uids), ctx.server.bytes_sent - bytes_before
+
+
+def step_sync_warm(ctx):
+    """Re-sync of an up-to-date store: only new UIDs and flags cross the wire."""
+    bytes_before = ctx.server.bytes_sent
+    sync_mailbox(ctx.mail, ctx.store, "bench", ctx.args.query, ctx.since)
+    return len(ctx.uids), ctx.server.bytes_sent - bytes_before
+
+
+def prepare_bodies(ctx):
+    ctx.new_store()
+    sync_mailbox(ctx.mail, ctx.store, "bench", ctx.args.query, ctx.since)
+
+
+def step_bodies(ctx):
+    """Text parts only, located from BODYSTRUCTURE."""
+    bytes_before = ctx.server.bytes_sent
+    download_bodies(ctx.mail, ctx.store, "bench", ctx.uidvalidity, ctx.uids)
+    return len(ctx.uids), ctx.server.bytes_sent - bytes_before
+
+
+def step_parse(ctx):
+    """get_email_body and the decode_mime_words header decoding over the fetched messages."""
+    ctx.records = []
+    for uid, raw in zip(ctx.uids, ctx.raw):
+        msg = email.message_from_bytes(raw)
+        headers = parse_headers(msg)
+        record = EmailRecord(uid, date=headers['date'], sender=headers['from'], subject=headers['subject'])
+        ctx.records.append((record, get_email_body(msg) or "No body available"))
+    return len(ctx.raw), sum(len(raw) for raw in ctx.raw)
+
+
+def step_stream_parse(ctx):
+    """FETCH and parse in one go, feeding the literals to StreamingMessageParser as they arrive."""
+    bodies = 0
+    with streamed_literals(ctx.mail, StreamingMessageParser):
+        for message in fetch_batched(ctx.mail, ctx.uids, "(UID BODY.PEEK[])", ctx.args.batch_size, uid=True):
+            bodies += get_email_body(message["BODY[]"]) is not None
+    size = sum(len(raw) for raw in ctx.raw)
+    return bodies, size
+
+
+def step_render(ctx):
+    """The CLI's HTML file (generate_html_file) from the parsed messages."""
+    file_path, temp_dir = generate_html_file(ctx.records)
+    size = os.path.getsize(file_path)
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    return len(ctx.records), size
+
+
+def step_report(ctx):
+    """The dashboard's streamed report: render_report drained chunk by chunk over the stored listing.
+
+    Every synthetic message has the same body, so grouping would leave one
+    entry; all of them are rendered instead, as for distinct announcements.
+    """
+    records = ctx.store.messages("bench", "INBOX", ctx.args.query)
+    bodies = ctx.store.bodies("bench", "INBOX", ctx.uidvalidity, [record.uid for record in records])
+    size = sum(len(chunk) for chunk in render_report((record, bodies.get(record.uid)) for record in records))
+    return len(records), size
+
+
+# (name, step, prepare): prepare runs untimed before every run of the step
+STEPS = [
+    ("search", step_search, None),
+    ("fetch", step_fetch, None),
+    ("sync-cold", step_sync_cold, Context.new_store),
+    ("sync-warm", step_sync_warm, None),
+    ("bodies", step_bodies, prepare_bodies),
+    ("parse", step_parse, None),
+    ("stream", step_stream_parse, None),
+    ("render", step_render, None),
+    ("report", step_report, None),
+]
+
+
+def run_step(ctx, name, step, prepare=None):
+    best = None
+    for _ in range(ctx.args.repeat):
+        if prepare:
+            prepare(ctx)
+        start = time.perf_counter()
+        count, size = step(ctx)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    # One more run under tracemalloc; tracing slows it down, so it is not timed
+    if prepare:
+        prepare(ctx)
+    tracemalloc.start()
+    step(ctx)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'step': name,
+        'seconds': best,
+        'messages': count,
+        'bytes': size,
+        'messages_per_second': count / best if best else 0.0,
+        'mb_per_second': size / best / 1e6 if best else 0.0,
+        'peak_memory_mb': peak / 1e6,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the fetch/parse/render path against a fake IMAP server.")
+    parser.add_argument("--messages", type=int, default=500, help="messages in the synthetic INBOX")
+    parser.add_argument("--days", type=int, default=28, help="days the messages are spread over")
+    parser.add_argument("--body-size", type=int, default=2048, help="characters of text per message")
+    parser.add_argument("--attachment-size", type=int, default=64 * 1024, help="bytes per attachment")
+    parser.add_argument("--structures", default=",".join(STRUCTURES),
+                        help="comma separated MIME structures: plain, alternative, mixed")
+    parser.add_argument("--charsets", default=",".join(CHARSETS), help="comma separated body charsets")
+    parser.add_argument("--query", default=DEFAULT_QUERY, help="IMAP search criteria")
+    parser.add_argument("--batch-size", type=int, default=FETCH_BATCH_SIZE, help="messages per FETCH")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the server waits before each reply")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per step")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+    args.structures = tuple(args.structures.split(","))
+    args.charsets = tuple(args.charsets.split(","))
+
+    ctx = Context(args)
+    try:
+        print(f"{args.messages} messages, {ctx.total_bytes / 1e6:.1f} MB in the mailbox")
+        # Steps build on each other's results, so they always run in order
+        results = [run_step(ctx, name, step, prepare) for name, step, prepare in STEPS]
+    finally:
+        ctx.close()
+
+    print(f"{'step':<10} {'seconds':>9} {'msgs/s':>10} {'MB/s':>8} {'peak MB':>8}")
+    for result in results:
+        print(f"{result['step']:<10} {result['seconds']:>9.4f} {result['messages_per_second']:>10.1f} "
+              f"{result['mb_per_second']:>8.2f} {result['peak_memory_mb']:>8.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({'config': {k: v for k, v in vars(args).items() if k != 'json'}, 'results': results},
+                      f, indent=2, default=list)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import queue
+import shutil
+
+from rich.console import Console
+
+import email_reader
+
+# Characters per line of the web CLI output
+CLI_WIDTH = 100
+
+
+class CLISession:
+    """One run of the email_reader CLI inside the server, driven over a socket.
+
+    It plays the part of email_reader.TerminalCLI: console output is sent
+    line by line as `cli_output` events, prompts as `cli_prompt` events,
+    and `input`/`getpass` wait for `send_input`. `emit(event, data)` must
+    deliver an event to the session's socket only. Under eventlet the wait
+    for input is cooperative, so any number of sessions can run at once.
+    """
+
+    def __init__(self, emit):
+        self._emit = emit
+        self._inputs = queue.Queue()
+        self._partial = ""
+        # Plain text, as the CLI printed when its output was piped
+        self.console = Console(file=self, width=CLI_WIDTH, color_system=None, force_terminal=False)
+
+    # File interface for the rich console
+    def write(self, text):
+        lines = (self._partial + text).split("\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self._emit('cli_output', {'output': line})
+
+    def flush(self):
+        pass
+
+    def input(self, prompt):
+        return self._prompt(prompt, False)
+
+    def getpass(self, prompt):
+        return self._prompt(prompt, True)
+
+    def _prompt(self, prompt, secret):
+        self._emit('cli_prompt', {'prompt': prompt, 'secret': secret})
+        value = self._inputs.get()
+        if value is None:
+            raise EOFError("CLI session closed")
+        return value
+
+    def show_html(self, file_path, temp_dir):
+        """Send the generated report to the browser, which opens it in a new window."""
+        try:
+            with open(file_path, encoding="utf-8") as f:
+                self._emit('cli_report', {'html': f.read()})
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def send_input(self, text):
+        self._inputs.put(text)
+
+    def close(self):
+        """End the session; a pending or later prompt raises EOFError."""
+        self._inputs.put(None)
+
+    def run(self):
+        try:
+            email_reader.run_interactive(self)
+        except EOFError:
+            pass
+        except Exception as e:
+            self.console.print(f"Error: {e}", markup=False)
+        finally:
+            if self._partial:
+                self._emit('cli_output', {'output': self._partial})
+                self._partial = ""
+            self._emit('cli_exit', {})
@@ -0,0 +1,214 @@
+import imaplib
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+from email_report import write_html
+from fetch_orchestrator import MAIL_FOLDERS, iter_bodies, merge_records, sync_targets
+from imap_pool import IDLE_TIMEOUT, IMAPConnectionPool
+from mail_groups import collapse
+from mail_rules import CLI_CATEGORIES, RuleSet
+from mail_store import MailStore
+from raw_cache import RawMessageCache
+
+try:
+    import keyring
+except ImportError:  # keyring is optional; passwords can come from the environment
+    keyring = None
+
+IMAP_SERVER = "mail.bilkent.edu.tr"
+
+# Service name the passwords are stored under in the system keyring
+KEYRING_SERVICE = "email_reader"
+
+# Kept next to a digest written with only_new: the messages it already holds, so later runs and processes skip them
+WRITTEN_SUFFIX = ".written"
+
+# The same announcements as the terminal CLI
+RULES = RuleSet(categories=CLI_CATEGORIES)
+SEARCH_CRITERIA = RULES.search_criteria
+
+def lookup_password(account):
+    """Return the password of `account` without prompting.
+
+    Looked up in EMAIL_READER_PASSWORD_<ACCOUNT> (the address upper-cased,
+    other characters replaced by _), then EMAIL_READER_PASSWORD, then the
+    system keyring. Raises LookupError when none has it.
+    """
+    variable = "EMAIL_READER_PASSWORD_" + re.sub(r"\W", "_", account).upper()
+    password = os.environ.get(variable) or os.environ.get("EMAIL_READER_PASSWORD")
+    if not password and keyring is not None:
+        password = keyring.get_password(KEYRING_SERVICE, account)
+    if not password:
+        raise LookupError(f"No password for {account}: set {variable} or store it in the keyring "
+                          f"under the service {KEYRING_SERVICE!r}")
+    return password
+
+
+def _key(record):
+    return record.account, record.mailbox, record.uidvalidity, record.uid
+
+
+def digest_entry(record, body):
+    """Return the JSON form of one digest message."""
+    entry = record.summary()
+    entry.pop('time')
+    entry.update(account=record.account, date=record.date.isoformat(), message_id=record.message_id,
+                 body=body)
+    return entry
+
+
+def write_digest(f, messages, output_format):
+    """Write (record, body) pairs to the text file `f` as they come; JSON and JSONL are flushed per message."""
+    if output_format == "html":
+        write_html(f, messages)
+        return
+
+    if output_format == "json":
+        f.write("[")
+    for count, (record, body) in enumerate(messages):
+        line = json.dumps(digest_entry(record, body), ensure_ascii=False)
+        if output_format == "json":
+            line = ("," if count else "") + "\n" + line
+        else:
+            line += "\n"
+        f.write(line)
+        f.flush()
+    if output_format == "json":
+        f.write("\n]\n")
+
+
+class DigestRunner:
+    """Produces digests of the matching mail of several accounts, reusing one connection pool across runs.
+
+    Each account is written to `output`, a path that may contain {account}
+    and {date} (the run's date); "-" writes to stdout. With `only_new` a
+    run leaves out messages an earlier run already wrote to the same file,
+    and JSONL digests are appended to instead of overwritten; HTML and JSON
+    files cannot be appended to, so `only_new` raises ValueError for them.
+    What a file holds is recorded next to it (WRITTEN_SUFFIX), so this also
+    works across processes, e.g. cron runs; on stdout only this runner's
+    earlier runs are known.
+    """
+
+    def __init__(self, credentials, output="-", output_format="jsonl", days=7, since=None, before=None,
+                 only_new=False):
+        if only_new and output_format != "jsonl":
+            raise ValueError("only_new needs the jsonl format; an HTML or JSON digest would be overwritten")
+        self.credentials = credentials
+        self.output = output
+        self.output_format = output_format
+        self.days = days
+        self.since = since
+        self.before = before
+        self.only_new = only_new
+        self.store = MailStore()
+        self.raw_cache = RawMessageCache()
+        self.pool = IMAPConnectionPool(lambda: imaplib.IMAP4_SSL(IMAP_SERVER))
+        self._written = {}  # output path ("-" for stdout) -> keys of the messages written there
+
+    def window(self):
+        """Return the (since, before) dates of the next run."""
+        since = self.since or date.today() - timedelta(days=self.days)
+        return since, self.before
+
+    def run(self):
+        """Sync, then write one digest per account; returns the number of messages written."""
+        since, before = self.window()
+        targets = [(account, folder) for account in self.credentials for folder in MAIL_FOLDERS]
+        targets = sync_targets(self.pool, self.credentials, self.store, targets, SEARCH_CRITERIA, since)
+
+        count = 0
+        for account in self.credentials:
+            records = merge_records(self.store, [target for target in targets if target[0] == account],
+                                    SEARCH_CRITERIA, since, before)
+            path = self._path(account)
+            if self.only_new:
+                # Messages that left the window are never listed again, so they need not be remembered
+                written = self._written[path] = self._written_to(path) & {_key(record) for record in records}
+                records = [record for record in records if _key(record) not in written]
+            if self.output_format == "html":
+                # Like the CLI report, HTML digests show a thread or a series of near-duplicates once
+                records = collapse(records)
+            messages = iter_bodies(self.pool, self.credentials, self.store, RULES.tag(records),
+                                   raw_cache=self.raw_cache)
+            try:
+                count += self._write(path, account, self._remember(path, messages))
+            finally:
+                if self.only_new and path != "-" and os.path.exists(path):
+                    self._save_written(path)
+        return count
+
+    def _path(self, account):
+        if self.output == "-":
+            return "-"
+        return self.output.format(account=account, date=date.today().isoformat())
+
+    def _written_to(self, path):
+        """Return the keys of the messages the digest at `path` holds, read from its state file on first use."""
+        if path not in self._written:
+            keys = []
+            # A digest that was deleted holds nothing, whatever its state file says
+            if path != "-" and os.path.exists(path):
+                try:
+                    with open(path + WRITTEN_SUFFIX, encoding="utf-8") as f:
+                        keys = json.load(f)
+                except FileNotFoundError:
+                    pass
+            self._written[path] = {tuple(key) for key in keys}
+        return self._written[path]
+
+    def _save_written(self, path):
+        # Written under a temporary name, so a run that is killed leaves the previous state
+        fd, temp_path = tempfile.mkstemp(prefix=".", dir=os.path.dirname(path) or ".")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(sorted(self._written[path]), f)
+        os.replace(temp_path, path + WRITTEN_SUFFIX)
+
+    def _remember(self, path, messages):
+        for record, body in messages:
+            self._written.setdefault(path, set()).add(_key(record))
+            yield record, body
+
+    def _write(self, path, account, messages):
+        count = 0
+
+        def counted():
+            nonlocal count
+            for message in messages:
+                count += 1
+                yield message
+
+        if path == "-":
+            write_digest(sys.stdout, counted(), self.output_format)
+            return count
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        mode = "a" if self.only_new else "w"
+        with open(path, mode, encoding="utf-8") as f:
+            write_digest(f, counted(), self.output_format)
+        print(f"Wrote {count} messages of {account} to {path}", file=sys.stderr)
+        return count
+
+    def run_forever(self, every):
+        """Run every `every` seconds until interrupted; a failed run is reported and retried on schedule."""
+        # Keep the logged-in connections from one run to the next; a NOOP checks them before reuse
+        self.pool.idle_timeout = max(IDLE_TIMEOUT, every + 60)
+        try:
+            while True:
+                started = time.monotonic()
+                try:
+                    self.run()
+                except Exception as e:
+                    print(f"Digest run failed at {datetime.now():%Y-%m-%d %H:%M}: {e}", file=sys.stderr)
+                time.sleep(max(0, every - (time.monotonic() - started)))
+        finally:
+            self.close()
+
+    def close(self):
+        self.pool.close_all()
+        self.store.close()
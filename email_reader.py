@@ -1,122 +1,53 @@
+import json
 import sys
 import os
-import imaplib
-import email
-from email.header import decode_header
-import webbrowser
-import tempfile
 import time
-from rich.console import Console
-from email.utils import parsedate_to_datetime
 from getpass import getpass
-import pyfiglet  # Import pyfiglet for dynamic ASCII art generation
 import random  # Import random to select a random font
-from datetime import datetime, timedelta, timezone
-
-# Set the environment variable for the terminal to use UTF-8
-os.environ['PYTHONIOENCODING'] = 'utf-8'
-sys.stdout.reconfigure(encoding='utf-8')
-sys.stderr.reconfigure(encoding='utf-8')
-
-# Rich Console for colored output
-console = Console()
-
-# Define the file to store fetched UIDs
-uid_file = "fetched_uids.txt"
-
-def load_fetched_uids():
-    """Load the list of UIDs that have already been fetched."""
-    if os.path.exists(uid_file):
-        with open(uid_file, "r") as f:
-            return set(f.read().splitlines())
-    return set()
-
-def save_fetched_uid(uid):
-    """Save a UID to the file, marking it as fetched."""
-    with open(uid_file, "a") as f:
-        f.write(uid + "\n")
-
-def get_email_body(msg):
-    """Extract and return the body content of the email as text or HTML."""
-    if msg.is_multipart():
-        for part in msg.walk():
-            content_type = part.get_content_type()
-            content_disposition = str(part.get("Content-Disposition"))
-            if "attachment" not in content_disposition:
-                try:
-                    if content_type == "text/plain":
-                        return part.get_payload(decode=True).decode("utf-8")
-                    elif content_type == "text/html":
-                        return part.get_payload(decode=True).decode("utf-8")
-                except UnicodeDecodeError:
-                    try:
-                        return part.get_payload(decode=True).decode("ISO-8859-9")
-                    except UnicodeDecodeError:
-                        return part.get_payload(decode=True).decode("Windows-1254")
-    else:
-        try:
-            return msg.get_payload(decode=True).decode("utf-8")
-        except UnicodeDecodeError:
-            try:
-                return msg.get_payload(decode=True).decode("ISO-8859-9")
-            except UnicodeDecodeError:
-                return msg.get_payload(decode=True).decode("Windows-1254")
-    return None
-
-def decode_mime_words(s):
-    """Decode MIME encoded words to normal string."""
-    decoded_words = decode_header(s)
-    decoded_string = ""
-    for word, encoding in decoded_words:
-        if isinstance(word, bytes):
-            if encoding:
-                decoded_string += word.decode(encoding)
-            else:
-                decoded_string += word.decode("utf-8")
-        else:
-            decoded_string += word
-    return decoded_string
+from datetime import datetime, timedelta
 
-def safe_decode(value):
-    """Attempt to decode bytes using multiple encodings."""
-    if isinstance(value, bytes):
-        try:
-            return value.decode("utf-8")
-        except UnicodeDecodeError:
-            return value.decode("ISO-8859-9")  # Fallback for Turkish characters
-    return value
-
-def generate_html_file(email_data):
-    """Generate a single HTML file with all email subjects, from details, and content."""
-    temp_dir = tempfile.mkdtemp()
-    file_path = os.path.join(temp_dir, "emails.html")
-    
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write('''<html><head><title>Email Summary</title>
-        <style>
-            body { font-family: Arial, sans-serif; line-height: 1.6; background-color: #f9f9f9; padding: 20px; }
-            h1 { color: #333; }
-            h2 { color: #4CAF50; }
-            h3 { color: #FF5722; }
-            .email-content { border-bottom: 2px solid #ddd; padding-bottom: 10px; margin-bottom: 10px; }
-            .date { color: #999; }
-        </style></head><body>''')
-        f.write("<h1>Email Summary</h1>")
-        
-        for subject, from_, body, date in email_data:
-            f.write(f'<div class="email-content">')
-            f.write(f"<h2>From: {from_}</h2>")
-            f.write(f"<h3>Subject: {subject}</h3>")
-            formatted_date = date.strftime('%d.%m.%Y')
-            f.write(f'<p class="date">Date: {formatted_date}</p>')
-            f.write(f"<div>{body}</div><hr></div>")
-        
-        f.write("</body></html>")
-    
-    return file_path, temp_dir
+from mail_rules import CLI_CATEGORIES, RuleSet
+
+# Rich Console for colored output, created on first use since importing rich takes a while
+console = None
+
+# Fonts and already rendered banners, so pyfiglet is only loaded for a font not seen before
+BANNER_CACHE_PATH = os.environ.get("BANNER_CACHE_PATH", "banner_cache.json")
+
+BANNER_TEXT = "Bilkent Email Reader"
+
+# Department announcements listed by the CLI
+RULES = RuleSet(categories=CLI_CATEGORIES)
+SEARCH_CRITERIA = RULES.search_criteria
+
+class TerminalCLI:
+    """Output, prompts and report viewing of the terminal; cli_session.CLISession does the same over a socket."""
+
+    @property
+    def console(self):
+        global console
+        if console is None:
+            from rich.console import Console
+            console = Console()
+        return console
+
+    def input(self, prompt):
+        return input(prompt)
+
+    def getpass(self, prompt):
+        return getpass(prompt)
+
+    def show_html(self, file_path, temp_dir):
+        """Open the generated report in the browser, then delete it."""
+        self.console.print(f"To view the emails, [link=file://{file_path}]Click here[/link]", style="blue")
+        open_email_in_browser(file_path)
+        time.sleep(10)
+        delete_temp_directory(temp_dir)
 
 def open_email_in_browser(file_path):
     """Open the temporary email file in the user's default web browser."""
+    import webbrowser
+
     webbrowser.open(f"file://{file_path}")
 
 def delete_temp_directory(temp_dir):
@@ -143,132 +74,236 @@ def get_current_month_date_range():
     end_of_month = next_month - timedelta(days=1)
     return start_of_month, end_of_month
 
-def normalize_datetime(dt):
-    """Normalize datetime to handle offset-naive and offset-aware datetimes."""
-    if dt.tzinfo is None:  # If the datetime is naive (no timezone info)
-        return dt.replace(tzinfo=timezone.utc)  # Treat as UTC for consistency
-    return dt
+def fetch_emails(username, password, other_accounts=None, cli=None):
+    """Fetch emails from the Bilkent IMAP server and filter by the current week, then month if no results.
+
+    Every folder in MAIL_FOLDERS is searched, for `username` and for each
+    account in `other_accounts` ({email: password}), in parallel; a message
+    found more than once is listed once. Output and prompts go through
+    `cli` (see TerminalCLI), the terminal by default.
+    """
+    # The IMAP, store and cache modules take most of the import time, so they load once the prompts are answered
+    import imaplib
+
+    from email_report import generate_html_file
+    from fetch_orchestrator import MAIL_FOLDERS, iter_bodies, merge_records, run_targets, sync_targets
+    from imap_fetch import build_message_sets
+    from imap_pool import IMAPConnectionPool
+    from mail_groups import collapse
+    from mail_store import MailStore
+    from mail_sync import select_mailbox
+    from raw_cache import RawMessageCache
+
+    cli = cli or TerminalCLI()
+    credentials = {username: password}
+    credentials.update(other_accounts or {})
+    targets = [(account, folder) for account in credentials for folder in MAIL_FOLDERS]
+
+    # Separate connections per folder, reused for marking messages and downloading bodies
+    pool = IMAPConnectionPool(lambda: imaplib.IMAP4_SSL("mail.bilkent.edu.tr"))
+
+    # Get the start and end dates of the current week and month
+    start_of_week, end_of_week = get_week_date_range()
+    start_of_month, end_of_month = get_current_month_date_range()
 
-def fetch_emails(username, password):
-    """Fetch emails from the Bilkent IMAP server and filter by the current week, then month if no results."""
-    # Connect to the IMAP server
-    mail = imaplib.IMAP4_SSL("mail.bilkent.edu.tr")
-    
-    # Log in with credentials
-    mail.login(username, password)
-    
-    # Select the inbox
-    mail.select("inbox")
+    store = MailStore()
+    try:
+        # One search per folder covering both the week and the month; the week/month choice is made locally
+        targets = sync_targets(pool, credentials, store, targets, SEARCH_CRITERIA, min(start_of_week, start_of_month))
 
-    # Get the start and end dates of the current week
-    start_of_week, end_of_week = get_week_date_range()
-    start_of_week_str = start_of_week.strftime('%d-%b-%Y')
-    end_of_week_str = end_of_week.strftime('%d-%b-%Y')
+        # Emails from this week (Monday to Sunday) that have "DAIS" or "AIRS" in the subject
+        emails = merge_records(store, targets, SEARCH_CRITERIA, start_of_week, end_of_week)
 
-    # Search for emails from this week (Monday to Sunday) that have "DAIS" or "AIRS" in the subject
-    search_query = f'(OR (SUBJECT "DAIS") (SUBJECT "AIRS")) SINCE {start_of_week_str} BEFORE {end_of_week_str}'
-    status, messages = mail.search(None, search_query)
-    
-    message_ids = messages[0].split()
-
-    if not message_ids:
-        # If no emails are found, check for the whole month
-        console.print("[bold red]No emails found this week. Checking for the whole month...[/bold red]")
-        start_of_month, end_of_month = get_current_month_date_range()
-        start_of_month_str = start_of_month.strftime('%d-%b-%Y')
-        end_of_month_str = end_of_month.strftime('%d-%b-%Y')
-
-        # Update search query for the current month
-        search_query = f'(OR (SUBJECT "DAIS") (SUBJECT "AIRS")) SINCE {start_of_month_str} BEFORE {end_of_month_str}'
-        status, messages = mail.search(None, search_query)
-        message_ids = messages[0].split()
-
-        if not message_ids:
-            # If still no emails found, display a final message and exit
-            console.print("[bold red]No matching emails found for this week or month.[/bold red]")
-            return
-
-    # Get the list of UIDs of already fetched emails
-    fetched_uids = load_fetched_uids()
-
-    email_data = []
-    read_emails = []
-    unread_emails = []
-
-    for num in message_ids:
-        status, msg_data = mail.fetch(num, "(UID RFC822 FLAGS INTERNALDATE)")
-        
-        for response_part in msg_data:
-            if isinstance(response_part, tuple):
-                msg = email.message_from_bytes(response_part[1])
-                uid = msg_data[-1].decode().split()[-1]  # Get the UID
-                
-                if b'\\Seen' in response_part[0]:
-                    flags = '\\Seen'
-                else:
-                    flags = ''
-                
-                subject = decode_header(msg["Subject"])[0][0]
-                subject = safe_decode(subject)
-                
-                from_ = msg.get("From")
-                from_ = decode_mime_words(from_)
-                date = parsedate_to_datetime(msg["Date"])
-                date = normalize_datetime(date)  # Normalize the datetime to be offset-aware
-                email_body = get_email_body(msg) or "No body available"
-                
-                if '\\Seen' in flags:
-                    read_emails.append((subject, from_, email_body, date))
-                else:
-                    unread_emails.append((subject, from_, email_body, date))
-
-                if uid not in fetched_uids:
-                    save_fetched_uid(uid)
-
-        mail.store(num, '+FLAGS', '\\Seen')
-
-    # Sort both read and unread emails by newest to oldest
-    unread_emails.sort(key=lambda x: x[3], reverse=True)
-    read_emails.sort(key=lambda x: x[3], reverse=True)
-
-    total_emails = len(read_emails) + len(unread_emails)
-    console.print(f"[bold]Total Emails Filtered: {total_emails}[/bold]")
-
-    # Display unread emails first
-    for subject, from_, _, date in unread_emails:
-        formatted_date = date.strftime('%d.%m.%Y')
-        console.print(f"[bold green]New Email![/bold green] ** {from_} | Subject: {subject} | {formatted_date}")
-        console.print("-----")
-
-    # Display read emails afterward
-    for subject, from_, _, date in read_emails:
-        formatted_date = date.strftime('%d.%m.%Y')
-        console.print(f"[bold red]Old Email![/bold red] ** {from_} | Subject: {subject} | {formatted_date}")
-        console.print("-----")
-
-    choice = input("Do you want to generate an HTML file to view the emails? (y/n): ").strip().lower()
+        if not emails:
+            # If no emails are found, check for the whole month
+            cli.console.print("[bold red]No emails found this week. Checking for the whole month...[/bold red]")
+            emails = merge_records(store, targets, SEARCH_CRITERIA, start_of_month, end_of_month)
+
+            if not emails:
+                # If still no emails found, display a final message and exit
+                cli.console.print("[bold red]No matching emails found for this week or month.[/bold red]")
+                return
+
+        read_emails = []
+        unread_emails = []
+
+        # Merged messages are already sorted from newest to oldest; the listing needs headers only
+        for record in RULES.tag(emails):
+            if record.seen:
+                read_emails.append(record)
+            else:
+                unread_emails.append(record)
+
+        # Mark the listed messages as seen, one UID STORE per message-set and folder
+        def mark_seen(mail, account, mailbox):
+            records = [record for record in emails if (record.account, record.mailbox) == (account, mailbox)]
+            select_mailbox(mail, mailbox)
+            for message_set in build_message_sets([record.uid for record in records]):
+                mail.uid("STORE", message_set, '+FLAGS', '\\Seen')
+            store.update_flags(account, mailbox, records[0].uidvalidity,
+                               {record.uid: set(record.flags) | {'\\Seen'} for record in records})
+
+        run_targets(pool, credentials, sorted({(record.account, record.mailbox) for record in emails}), mark_seen)
+
+        total_emails = len(read_emails) + len(unread_emails)
+        cli.console.print(f"[bold]Total Emails Filtered: {total_emails}[/bold]")
+
+        # Display unread emails first
+        for record in unread_emails:
+            cli.console.print(f"[bold green]New Email![/bold green] ** {record.sender} | Subject: {record.subject} | {record.day} | {', '.join(record.categories)}")
+            cli.console.print("-----")
+
+        # Display read emails afterward
+        for record in read_emails:
+            cli.console.print(f"[bold red]Old Email![/bold red] ** {record.sender} | Subject: {record.subject} | {record.day} | {', '.join(record.categories)}")
+            cli.console.print("-----")
+
+        choice = cli.input("Do you want to generate an HTML file to view the emails? (y/n): ").strip().lower()
     
-    if choice == 'y':
-        all_emails = read_emails + unread_emails
-        file_path, temp_dir = generate_html_file(all_emails)
-        console.print(f"To view the emails, [link=file://{file_path}]Click here[/link]", style="blue")
-        open_email_in_browser(file_path)
-        time.sleep(10)
-        delete_temp_directory(temp_dir)
-    else:
-        console.print("[bold]HTML file not generated.[/bold]")
+        if choice == 'y':
+            # A thread or a series of near-identical announcements is shown once, read ones first
+            shown = sorted(collapse(emails), key=lambda record: not record.seen)
+            # Bodies are only downloaded now, and only their text parts
+            all_emails = [(record, body or "No body available")
+                          for record, body in iter_bodies(pool, credentials, store, shown, raw_cache=RawMessageCache())]
+            file_path, temp_dir = generate_html_file(all_emails)
+            cli.show_html(file_path, temp_dir)
+        else:
+            cli.console.print("[bold]HTML file not generated.[/bold]")
+    finally:
+        # The web CLI runs this once per session, so nothing may outlive the call
+        pool.close_all()
+        store.close()
 
-    mail.logout()
+def search_emails(query, account=None, limit=20, cli=None):
+    """Search the emails already in the local store and print the best matches with a snippet."""
+    from rich.markup import escape
+
+    from mail_store import HIGHLIGHT_END, HIGHLIGHT_START, MailStore
+
+    cli = cli or TerminalCLI()
+    store = MailStore()
+    try:
+        results = store.search(query, account, limit)
+    finally:
+        store.close()
+    if not results:
+        cli.console.print("[bold red]No stored emails match your search.[/bold red]")
+        return
+
+    for record in results:
+        snippet = escape(record.snippet).replace(HIGHLIGHT_START, "[bold yellow]").replace(HIGHLIGHT_END, "[/bold yellow]")
+        cli.console.print(f"** {escape(record.sender)} | Subject: {escape(record.subject)} | {record.day}")
+        cli.console.print(f"   {snippet}")
+        cli.console.print("-----")
+
+def render_banner(path=BANNER_CACHE_PATH):
+    """Return BANNER_TEXT in a random figlet font.
+
+    Listing the fonts scans every font file and importing pyfiglet is slow
+    too, so the font list and each rendered banner are cached in `path`.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {'fonts': [], 'banners': {}}
+
+    if not cache['fonts']:
+        import pyfiglet
+        cache['fonts'] = sorted(pyfiglet.FigletFont.getFonts())
+
+    font = random.choice(cache['fonts'])
+    banner = cache['banners'].get(font)
+    if banner is None:
+        import pyfiglet
+        banner = cache['banners'][font] = pyfiglet.figlet_format(BANNER_TEXT, font=font)
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(cache, f)
+        except OSError as e:
+            print(f"Could not save the banner cache: {e}")
+    return banner
+
+def run_interactive(cli, banner=True):
+    """Show the banner, ask for the credentials and fetch, all through `cli`."""
+    if banner:
+        cli.console.print(render_banner(), style="bold red")
+
+    username = cli.input("Enter your Bilkent email: ")
+    password = cli.getpass("Enter your email password: ")
+    # Further accounts are fetched along with the first and listed together
+    other_accounts = {}
+    while True:
+        other = cli.input("Add another account (email, blank to continue): ").strip()
+        if not other:
+            break
+        other_accounts[other] = cli.getpass(f"Enter the password of {other}: ")
+    cli.console.print("[bold]Fetching all emails...[/bold]")
+    fetch_emails(username, password, other_accounts, cli=cli)
+    cli.console.print("[bold]All emails fetched.[/bold]")
 
 # CLI interaction for login
 if __name__ == "__main__":
-    available_fonts = pyfiglet.FigletFont.getFonts()
-    random_font = random.choice(available_fonts)
-    ascii_header = pyfiglet.figlet_format("Bilkent Email Reader", font=random_font)
-    console.print(ascii_header, style="bold red")
-
-    username = input("Enter your Bilkent email: ")
-    password = getpass("Enter your email password: ")
-    console.print("[bold]Fetching all emails...[/bold]")
-    fetch_emails(username, password)
-    console.print("[bold]All emails fetched.[/bold]")
+    import argparse
+
+    # Set the environment variable for the terminal to use UTF-8; only for the CLI, not a process importing this module
+    os.environ['PYTHONIOENCODING'] = 'utf-8'
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stderr.reconfigure(encoding='utf-8')
+
+    parser = argparse.ArgumentParser(description="Read the department announcements from your Bilkent inbox.")
+    parser.add_argument("--search", metavar="QUERY", help="search the already fetched emails instead of fetching")
+    parser.add_argument("--account", action="append",
+                        help="account to write a digest for (repeat for several); with --search, the one account to search")
+    parser.add_argument("--no-banner", action="store_true", help="start without the ASCII art banner")
+    digest = parser.add_argument_group("batch mode", "write digests without any prompts, e.g. from cron")
+    digest.add_argument("--batch", action="store_true",
+                        help="fetch the --account mailboxes once and write a digest; passwords come from "
+                             "EMAIL_READER_PASSWORD_<ACCOUNT>, EMAIL_READER_PASSWORD or the keyring")
+    digest.add_argument("--every", type=float, metavar="MINUTES", help="keep running, one batch every MINUTES")
+    digest.add_argument("--format", choices=("html", "json", "jsonl"), default="jsonl", help="digest format")
+    digest.add_argument("--output", default="-",
+                        help="digest path, may contain {account} and {date}; - for stdout (default)")
+    digest.add_argument("--days", type=int, default=7, help="include the last DAYS days (default 7)")
+    digest.add_argument("--since", type=lambda value: datetime.strptime(value, "%Y-%m-%d").date(),
+                        help="include messages from this YYYY-MM-DD on instead of --days")
+    digest.add_argument("--before", type=lambda value: datetime.strptime(value, "%Y-%m-%d").date(),
+                        help="include messages before this YYYY-MM-DD only")
+    digest.add_argument("--only-new", action="store_true",
+                        help="leave out messages an earlier run wrote to the same JSONL digest and append to it; "
+                             "on stdout only with --every")
+    args = parser.parse_args()
+
+    if args.search:
+        if args.account and len(args.account) > 1:
+            parser.error("--search takes at most one --account")
+        # Answered from the local index, without logging in
+        search_emails(args.search, args.account[0] if args.account else None)
+        sys.exit(0)
+
+    if args.batch or args.every:
+        from email_digest import DigestRunner, lookup_password
+
+        if not args.account:
+            parser.error("--batch and --every need at least one --account")
+        if args.only_new and args.format != "jsonl":
+            parser.error("--only-new needs --format jsonl; HTML and JSON digests cannot be appended to")
+        if args.only_new and args.output == "-" and not args.every:
+            # Only a digest file records what it holds; a single run to stdout has nothing to leave out
+            parser.error("--only-new needs --every or an --output file")
+        try:
+            credentials = {account: lookup_password(account) for account in args.account}
+        except LookupError as e:
+            parser.error(str(e))
+
+        runner = DigestRunner(credentials, args.output, args.format, args.days, args.since, args.before,
+                              args.only_new)
+        if args.every:
+            runner.run_forever(args.every * 60)
+        else:
+            runner.run()
+            runner.close()
+        sys.exit(0)
+
+    run_interactive(TerminalCLI(), banner=not args.no_banner)
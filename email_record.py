@@ -0,0 +1,91 @@
+_NOT_LOADED = object()
+
+
+class EmailRecord:
+    """One message as listed, cached and indexed: identity, flags, headers and a lazily loaded body.
+
+    `date` is the timezone-aware Date header. `thread_key` is the Message-ID
+    of the first message of its thread and `group_key` names the group of
+    the thread and its near-duplicates (see mail_groups); `group_size` is
+    the number of messages a listing entry stands for and `signature` the
+    MinHash of the start of the body, taken at sync. The body is only
+    read (via `load_body`) the first time it is accessed, so listings never
+    pull bodies into memory.
+    """
+
+    __slots__ = (
+        'account', 'mailbox', 'uidvalidity', 'uid', 'flags', 'date', 'internaldate', 'size',
+        'sender', 'subject', 'message_id', 'list_id', 'thread_key', 'group_key', 'group_size', 'signature',
+        'text_part', 'attachments', 'has_body', 'categories', 'snippet', 'score', '_body', '_load_body',
+    )
+
+    def __init__(self, uid, flags=(), date=None, size=None, sender=None, subject=None, message_id=None,
+                 list_id=None, account=None, mailbox=None, uidvalidity=None, internaldate=None,
+                 thread_key=None, group_key=None, text_part=None, attachments=(), has_body=False,
+                 body=_NOT_LOADED, load_body=None):
+        self.account = account
+        self.mailbox = mailbox
+        self.uidvalidity = uidvalidity
+        self.uid = uid
+        self.flags = tuple(flags)
+        self.date = date
+        self.internaldate = internaldate
+        self.size = size
+        self.sender = sender
+        self.subject = subject
+        self.message_id = message_id
+        self.list_id = list_id
+        self.thread_key = thread_key
+        self.group_key = group_key
+        self.group_size = 1
+        self.signature = None
+        self.text_part = text_part
+        self.attachments = list(attachments)
+        self.has_body = has_body
+        self.categories = []
+        self.snippet = None
+        self.score = None
+        self._body = body
+        self._load_body = load_body
+
+    @property
+    def body(self):
+        if self._body is _NOT_LOADED:
+            self._body = self._load_body() if self._load_body and self.has_body else None
+        return self._body
+
+    @property
+    def day(self):
+        """The date as dd.mm.yyyy, the way the dashboard, the report and the CLI show it."""
+        return f"{self.date.day:02d}.{self.date.month:02d}.{self.date.year}"
+
+    @property
+    def seen(self):
+        return '\\Seen' in self.flags
+
+    def summary(self):
+        """Return the compact dict the dashboard lists, without the body.
+
+        The dashboard loads the body from /api/emails/<uid>/body?mailbox=<mailbox>
+        when the message is opened.
+        """
+        return {
+            'uid': self.uid,
+            'mailbox': self.mailbox,
+            'from': self.sender,
+            'subject': self.subject,
+            'date': self.day,
+            'time': f"{self.date.hour:02d}:{self.date.minute:02d}",
+            'status': 'Read' if self.seen else 'Unread',
+            'categories': self.categories,
+            'count': self.group_size,
+        }
+
+    def to_json(self):
+        """Return the summary plus the body, which is None until it has been downloaded."""
+        entry = self.summary()
+        entry['body'] = (self.body or "No body available") if self.has_body else None
+        return entry
+
+    def __repr__(self):
+        return f"EmailRecord({self.account!r}, {self.mailbox!r}, uid={self.uid!r}, subject={self.subject!r})"
@@ -0,0 +1,141 @@
+import os
+import tempfile
+
+import metrics
+
+# The HTML reports: the file of the terminal CLI, shared with the batch digests of email_digest, and the
+# streamed report of the dashboard, kept here so the benchmarks can render it without starting the server
+
+
+def generate_html_file(email_data):
+    """Generate a single HTML file with all email subjects, from details, and content from (record, body) pairs."""
+    temp_dir = tempfile.mkdtemp()
+    file_path = os.path.join(temp_dir, "emails.html")
+
+    with open(file_path, "w", encoding="utf-8") as f:
+        write_html(f, email_data)
+
+    return file_path, temp_dir
+
+
+def write_html(f, email_data):
+    """Write the HTML summary of (record, body) pairs to the text file `f`, one message at a time.
+
+    Records grouped by mail_groups.collapse say how many messages they stand for.
+    """
+    f.write('''<html><head><title>Email Summary</title>
+    <style>
+        body { font-family: Arial, sans-serif; line-height: 1.6; background-color: #f9f9f9; padding: 20px; }
+        h1 { color: #333; }
+        h2 { color: #4CAF50; }
+        h3 { color: #FF5722; }
+        .email-content { border-bottom: 2px solid #ddd; padding-bottom: 10px; margin-bottom: 10px; }
+        .date { color: #999; }
+    </style></head><body>''')
+    f.write("<h1>Email Summary</h1>")
+
+    for record, body in email_data:
+        with metrics.timed("render_html"):
+            f.write('<div class="email-content">')
+            f.write(f"<h2>From: {record.sender}</h2>")
+            f.write(f"<h3>Subject: {record.subject}</h3>")
+            f.write(f'<p class="date">Date: {record.day}</p>')
+            if record.group_size > 1:
+                f.write(f'<p class="date">Sent {record.group_size} times</p>')
+            f.write(f"<div>{body}</div><hr></div>")
+
+    f.write("</body></html>")
+
+
+def render_report(messages):
+    """Yield the email report as HTML chunks with enhanced design, one chunk per email.
+
+    `messages` yields (record, body) pairs already sorted by date and time
+    and grouped (see mail_groups.collapse), so each email goes out as soon
+    as its body is available; an entry standing for several messages says how many.
+    """
+    yield ('''<html><head><title>Email Summary</title>
+        <style>
+            body { 
+                font-family: 'Poppins', Arial, sans-serif; 
+                line-height: 1.8; 
+                background-color: #f4f4f4; 
+                padding: 30px; 
+                color: #333;
+            }
+            h1 { 
+                color: #333; 
+                text-align: center; 
+                margin-bottom: 30px;
+            }
+            .email-container {
+                max-width: 800px;
+                margin: 20px auto;
+                background-color: #fff;
+                padding: 20px;
+                border-radius: 8px;
+                box-shadow: 0px 4px 12px rgba(0, 0, 0, 0.1);
+                border-left: 6px solid #4CAF50;
+            }
+            .email-content {
+                border-bottom: 1px solid #ddd;
+                padding-bottom: 20px;
+                margin-bottom: 20px;
+            }
+            .email-content:last-child {
+                border-bottom: none;
+                margin-bottom: 0;
+            }
+            h2 {
+                font-size: 1.4rem;
+                color: #4CAF50;
+                margin-bottom: 10px;
+            }
+            h3 {
+                font-size: 1.2rem;
+                color: #FF5722;
+                margin-bottom: 10px;
+            }
+            p {
+                font-size: 1rem;
+                color: #555;
+            }
+            .date, .time, .status {
+                color: #888;
+                font-style: italic;
+            }
+            .status {
+                color: #4CAF50;
+                font-weight: bold;
+            }
+            a {
+                color: #4CAF50;
+                text-decoration: none;
+            }
+            a:hover {
+                text-decoration: underline;
+            }
+        </style></head><body>'''
+           "<h1>Email Summary</h1>").encode("utf-8")
+
+    for record, body in messages:
+        with metrics.timed("render_html"):
+            entry = record.summary()
+            body = body or "No body available"
+            repeats = f'<p class="status">Sent {record.group_size} times</p>' if record.group_size > 1 else ""
+
+            chunk = (
+                '<div class="email-container">'
+                '<div class="email-content">'
+                f"<h2>From: {entry['from']}</h2>"
+                f"<h3>Subject: {entry['subject']}</h3>"
+                f'<p class="date">Date: {entry["date"]} <span class="time">(Time: {entry["time"]})</span></p>'
+                f'<p class="status">Status: {entry["status"]}</p>'
+                f"{repeats}"
+                f"<p>{body}</p>"
+                "</div></div>"
+            ).encode("utf-8")
+        metrics.add_bytes("render_html", len(chunk))
+        yield chunk
+
+    yield b"</body></html>"
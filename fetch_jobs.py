@@ -0,0 +1,82 @@
+import time
+import uuid
+
+# Seconds a user's fetch counts as running; bounds how long a job of a crashed worker blocks a new one
+JOB_TTL = 15 * 60
+
+# How often a running job looks in the store for a cancellation
+CANCEL_POLL = 0.5
+
+
+class FetchCancelled(Exception):
+    """Raised inside a running job once the user has cancelled it."""
+
+
+class FetchJob:
+    """One background email fetch started from the dashboard, possibly on another worker."""
+
+    def __init__(self, job_id, owner, store):
+        self.id = job_id
+        self.owner = owner
+        self.status = 'running'
+        self._store = store
+        self._cancelled = False
+        self._polled_at = 0.0
+
+    @property
+    def cancelled(self):
+        # The flag may be set by any worker; it is read at most every CANCEL_POLL seconds
+        if not self._cancelled and time.monotonic() - self._polled_at >= CANCEL_POLL:
+            self._polled_at = time.monotonic()
+            self._cancelled = self._store.get(f"job:{self.id}:cancel") is not None
+        return self._cancelled
+
+    def cancel(self):
+        self._store.set(f"job:{self.id}:cancel", b"1", ex=JOB_TTL)
+        self._cancelled = True
+
+    def check(self):
+        """Stop the job at the next safe point if it has been cancelled."""
+        if self.cancelled:
+            raise FetchCancelled(self.id)
+
+
+class JobRegistry:
+    """Running fetch jobs, at most one per user across all workers.
+
+    The state lives in a state_store store (SQLite or Redis), so a job
+    started on one worker can be found and cancelled from any other.
+    """
+
+    def __init__(self, store, ttl=JOB_TTL):
+        self._store = store
+        self.ttl = ttl
+
+    def start(self, owner):
+        """Return the user's running job, or register a new one.
+
+        The boolean tells whether the job is new and still has to be run.
+        """
+        key = f"job:owner:{owner}"
+        while True:
+            job_id = uuid.uuid4().hex
+            if self._store.set(key, job_id, ex=self.ttl, nx=True):
+                return FetchJob(job_id, owner, self._store), True
+            running = self._store.get(key)
+            if running is not None:
+                return FetchJob(running.decode(), owner, self._store), False
+            # The running job ended in between; try again
+
+    def get(self, job_id, owner):
+        running = self._store.get(f"job:owner:{owner}")
+        if running is None or running.decode() != job_id:
+            return None
+        return FetchJob(job_id, owner, self._store)
+
+    def finish(self, job, status):
+        job.status = status
+        key = f"job:owner:{job.owner}"
+        running = self._store.get(key)
+        if running is not None and running.decode() == job.id:
+            self._store.delete(key)
+        self._store.delete(f"job:{job.id}:cancel")
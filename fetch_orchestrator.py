@@ -0,0 +1,175 @@
+import contextvars
+import imaplib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from imap_fetch import FETCH_BATCH_SIZE
+from mail_sync import download_bodies, select_mailbox, sync_mailbox
+
+# Folders searched for each account: INBOX plus any server-side filter folders, comma separated
+MAIL_FOLDERS = [folder.strip() for folder in os.environ.get("MAIL_FOLDERS", "INBOX").split(",") if folder.strip()]
+
+# Upper bound on IMAP connections working at the same time, across all accounts
+MAX_PARALLEL_FETCHES = int(os.environ.get("MAX_PARALLEL_FETCHES", "4"))
+
+
+def _lanes(targets, per_account):
+    """Split (account, mailbox) targets into lanes that each run on one connection.
+
+    An account gets at most `per_account` lanes so its folders never wait
+    on each other for a pooled connection; a lane SELECTs its folders in turn.
+    """
+    by_account = {}
+    for target in targets:
+        by_account.setdefault(target[0], []).append(target)
+
+    lanes = []
+    for account_targets in by_account.values():
+        count = min(per_account, len(account_targets))
+        lanes.extend(account_targets[i::count] for i in range(count))
+    return lanes
+
+
+def run_targets(pool, credentials, targets, work, max_workers=MAX_PARALLEL_FETCHES):
+    """Call work(mail, account, mailbox) for every target at the same time.
+
+    Targets run on separate pooled connections, at most `max_workers` at
+    once. Returns {target: result}; a target whose work raised maps to the
+    exception, so one missing folder does not fail the others.
+    """
+    def run_lane(lane):
+        results = {}
+        account = lane[0][0]
+        try:
+            with pool.connection(account, credentials[account]) as mail:
+                for target in lane:
+                    try:
+                        results[target] = work(mail, *target)
+                    except imaplib.IMAP4.abort:
+                        raise
+                    except Exception as e:
+                        results[target] = e
+        except Exception as e:
+            # Login failed or the connection dropped: the rest of the lane fails with it
+            for target in lane:
+                results.setdefault(target, e)
+        return results
+
+    lanes = _lanes(targets, pool.max_per_account)
+    results = {}
+    if not lanes:
+        return results
+    # Each lane runs in a copy of the caller's context, so its timings land in the caller's trace
+    contexts = [contextvars.copy_context() for _ in lanes]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(lanes))) as executor:
+        for lane_results in executor.map(lambda context, lane: context.run(run_lane, lane), contexts, lanes):
+            results.update(lane_results)
+    return results
+
+
+def sync_targets(pool, credentials, store, targets, query, since, max_workers=MAX_PARALLEL_FETCHES,
+                 on_progress=None):
+    """Sync the `query` listing of every (account, mailbox) target in parallel.
+
+    Returns the targets that synced. Failing targets are reported and
+    skipped; if all of them fail, the first error is raised. `on_progress`
+    is called with (stage, done, total) at every stage of every target (see
+    sync_mailbox) and with ("synced", targets done, targets) as each one
+    finishes. If it raises, every target stops at its next stage and the
+    exception is raised from here.
+    """
+    stopped = []
+    finished = 0
+
+    def progress(stage, done=0, total=0):
+        if stopped:
+            raise stopped[0]
+        if on_progress:
+            try:
+                on_progress(stage, done, total)
+            except Exception as e:
+                stopped.append(e)
+                raise
+
+    def sync(mail, account, mailbox):
+        nonlocal finished
+        uidvalidity = sync_mailbox(mail, store, account, query, since, mailbox, on_stage=progress)
+        finished += 1
+        progress("synced", finished, len(targets))
+        return uidvalidity
+
+    results = run_targets(pool, credentials, targets, sync, max_workers)
+    if stopped:
+        raise stopped[0]
+
+    failed = [target for target in targets if isinstance(results[target], Exception)]
+    if targets and len(failed) == len(targets):
+        raise results[failed[0]]
+    for account, mailbox in failed:
+        print(f"Skipping {mailbox} of {account}: {results[(account, mailbox)]}")
+
+    return [target for target in targets if target not in failed]
+
+
+def merge_records(store, targets, query, since=None, before=None):
+    """Return the stored `query` matches of all targets as one list, newest first.
+
+    A message filed in several folders or delivered to several accounts is
+    kept once, by Message-ID, from the first target listing it.
+    """
+    seen = set()
+    merged = []
+    for account, mailbox in targets:
+        for record in store.messages(account, mailbox, query, since, before):
+            message_id = record.message_id
+            if message_id:
+                if message_id in seen:
+                    continue
+                seen.add(message_id)
+            merged.append(record)
+
+    merged.sort(key=lambda record: record.date, reverse=True)
+    return merged
+
+
+def iter_bodies(pool, credentials, store, records, max_workers=MAX_PARALLEL_FETCHES, raw_cache=None):
+    """Yield (record, body) for `records` in the given order, downloading missing bodies on the way.
+
+    Bodies are fetched in batches that start at one message and double up
+    to FETCH_BATCH_SIZE, so the first body is available after a single
+    round trip; the folders of a batch are fetched in parallel. Bodies in
+    `raw_cache` are decoded from there instead of being fetched. A record
+    gets `has_body` set once its body is stored; it stays False when the
+    download failed.
+    """
+    records = list(records)
+    batch_size = 1
+    start = 0
+    while start < len(records):
+        batch = records[start:start + batch_size]
+
+        by_target = {}
+        for record in batch:
+            by_target.setdefault((record.account, record.mailbox), []).append(record)
+
+        def download(mail, account, mailbox):
+            target_records = by_target[(account, mailbox)]
+            uidvalidity = target_records[0].uidvalidity
+            uids = [record.uid for record in target_records]
+            select_mailbox(mail, mailbox)
+            download_bodies(mail, store, account, uidvalidity, uids, mailbox, raw_cache=raw_cache)
+            return store.bodies(account, mailbox, uidvalidity, uids)
+
+        results = run_targets(pool, credentials, list(by_target), download, max_workers)
+        for target, result in results.items():
+            if isinstance(result, Exception):
+                print(f"Could not fetch bodies from {target[1]} of {target[0]}: {result}")
+                results[target] = {}
+
+        for record in batch:
+            bodies = results[(record.account, record.mailbox)]
+            record.has_body = record.uid in bodies
+            yield record, bodies.get(record.uid)
+
+        start += len(batch)
+        batch_size = min(batch_size * 2, FETCH_BATCH_SIZE)
@@ -0,0 +1,265 @@
+import re
+import imaplib
+from contextlib import contextmanager
+from datetime import datetime
+
+import metrics
+
+# Number of messages requested per FETCH command
+FETCH_BATCH_SIZE = 200
+
+# Bytes read from the socket at a time while a literal is streamed
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Tokens of an IMAP FETCH response: parentheses, quoted strings, a trailing
+# literal marker such as {1234}, or an atom (which may contain a bracketed
+# section like BODY[HEADER.FIELDS (FROM SUBJECT)])
+_TOKEN_RE = re.compile(
+    rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\d+)\}$|((?:[^\s()"\[\]{]|\[[^\]]*\])+))'
+)
+
+
+def build_message_sets(ids, batch_size=FETCH_BATCH_SIZE):
+    """Group message ids into IMAP message-sets such as "1:200" or "3,7,9:12"."""
+    numbers = sorted({int(i) for i in ids})
+
+    for start in range(0, len(numbers), batch_size):
+        chunk = numbers[start:start + batch_size]
+        ranges = []
+        low = high = chunk[0]
+        for number in chunk[1:]:
+            if number == high + 1:
+                high = number
+                continue
+            ranges.append(f"{low}:{high}" if low != high else str(low))
+            low = high = number
+        ranges.append(f"{low}:{high}" if low != high else str(low))
+        yield ",".join(ranges)
+
+
+def _segments(data):
+    """Flatten imaplib's FETCH data into text and literal segments."""
+    for item in data:
+        if isinstance(item, tuple):
+            yield False, item[0]
+            yield True, item[1]
+        elif item is not None:
+            yield False, item
+
+
+def _atom(value):
+    text = value.decode("utf-8", "replace")
+    return None if text.upper() == "NIL" else text
+
+
+def _to_record(seq, items):
+    """Turn the (name value name value ...) list of one message into a dict."""
+    record = {"SEQ": int(seq)}
+    for name, value in zip(items[0::2], items[1::2]):
+        name = name.upper()
+        if name in ("UID", "RFC822.SIZE") and value is not None:
+            value = int(value)
+        elif name == "FLAGS":
+            value = tuple(value)
+        record[name] = value
+    return record
+
+
+def parse_fetch_response(data):
+    """Parse the data of a (possibly multi-message) FETCH into one dict per message.
+
+    Keys are the item names returned by the server (FLAGS, UID, RFC822,
+    BODY[...], ...) plus SEQ for the message sequence number.
+    """
+    stack = [[]]
+
+    for is_literal, segment in _segments(data):
+        if is_literal:
+            stack[-1].append(segment)
+            continue
+
+        position = 0
+        while position < len(segment):
+            match = _TOKEN_RE.match(segment, position)
+            if not match or match.end() == position:
+                break
+            position = match.end()
+            open_paren, close_paren, quoted, _literal, atom = match.groups()
+
+            if open_paren:
+                stack.append([])
+            elif close_paren:
+                if len(stack) == 1:
+                    continue
+                finished = stack.pop()
+                stack[-1].append(finished)
+                # A message is complete once its attribute list is closed
+                if len(stack) == 1 and len(stack[0]) >= 2:
+                    seq, items = stack[0][0], stack[0][-1]
+                    stack[0] = []
+                    yield _to_record(seq, items)
+            elif quoted is not None:
+                stack[-1].append(re.sub(rb'\\(.)', rb'\1', quoted).decode("utf-8", "replace"))
+            elif atom is not None:
+                stack[-1].append(_atom(atom))
+
+
+def parse_internaldate(value):
+    """Parse an INTERNALDATE string such as "17-Oct-2026 10:00:00 +0300"."""
+    return datetime.strptime(value.strip(), "%d-%b-%Y %H:%M:%S %z")
+
+
+def _text_parts(structure, section=""):
+    """Yield the inline text/plain and text/html parts of a parsed BODYSTRUCTURE in order."""
+    if not isinstance(structure, list) or not structure:
+        return
+
+    if isinstance(structure[0], list):
+        # Multipart: the child parts come first, followed by the subtype
+        for index, child in enumerate(structure, start=1):
+            if not isinstance(child, list):
+                break
+            yield from _text_parts(child, f"{section}.{index}" if section else str(index))
+        return
+
+    maintype, subtype = (str(value).lower() for value in structure[:2])
+    if maintype != "text" or subtype not in ("plain", "html"):
+        return
+
+    # Text parts: type, subtype, params, id, description, encoding, size, lines, md5, disposition
+    disposition = structure[9] if len(structure) > 9 else None
+    if isinstance(disposition, list) and disposition and str(disposition[0]).lower() == "attachment":
+        return
+
+    params = _params(structure[2])
+
+    yield {
+        'section': section or "1",
+        'subtype': subtype,
+        'encoding': (structure[5] or "7bit").lower(),
+        'charset': params.get("charset"),
+    }
+
+
+def find_text_part(structure, prefer="plain"):
+    """Locate the inline text part of a parsed BODYSTRUCTURE that holds the message body.
+
+    The first part of the `prefer`red subtype ("plain" or "html") wins,
+    otherwise the first part of the other one. Returns a dict with the
+    part's section number (e.g. "1" or "1.2"), its subtype, transfer
+    encoding and charset, or None when the message has no readable text part.
+    """
+    fallback = None
+    for part in _text_parts(structure):
+        if part['subtype'] == prefer:
+            return part
+        if fallback is None:
+            fallback = part
+    return fallback
+
+
+def _params(values):
+    """Turn a BODYSTRUCTURE parameter list such as ["charset", "utf-8"] into a dict with lower-case keys."""
+    values = values if isinstance(values, list) else []
+    return {str(key).lower(): value for key, value in zip(values[0::2], values[1::2])}
+
+
+def find_attachments(structure, section=""):
+    """List the attachments of a parsed BODYSTRUCTURE, in order.
+
+    Every leaf part that is not an inline text/plain or text/html part
+    counts: files, inline images, forwarded messages. Each is a dict with
+    its section number, content type, filename (None if it has none),
+    transfer encoding, charset and encoded size in bytes.
+    """
+    if not isinstance(structure, list) or not structure:
+        return []
+
+    if isinstance(structure[0], list):
+        attachments = []
+        for index, child in enumerate(structure, start=1):
+            if not isinstance(child, list):
+                break
+            attachments += find_attachments(child, f"{section}.{index}" if section else str(index))
+        return attachments
+
+    maintype, subtype = (str(value).lower() for value in structure[:2])
+    # The extension data (md5, disposition, ...) follows the line count of text parts
+    # and the envelope, body and line count of attached messages
+    extension = 8 if maintype == "text" else 10 if (maintype, subtype) == ("message", "rfc822") else 7
+    disposition = structure[extension + 1] if len(structure) > extension + 1 else None
+    disposition, disposition_params = (disposition if isinstance(disposition, list) and len(disposition) == 2
+                                       else (None, None))
+    disposition = str(disposition).lower() if disposition else None
+
+    if maintype == "text" and subtype in ("plain", "html") and disposition != "attachment":
+        return []
+
+    params = _params(structure[2])
+    filename = _params(disposition_params).get("filename") or params.get("name")
+    try:
+        size = int(structure[6])
+    except (TypeError, ValueError):
+        size = None
+
+    return [{
+        'section': section or "1",
+        'content_type': f"{maintype}/{subtype}",
+        'filename': filename,
+        'encoding': (structure[5] or "7bit").lower(),
+        'charset': params.get("charset"),
+        'size': size,
+    }]
+
+
+def fetch_batched(mail, ids, items, batch_size=FETCH_BATCH_SIZE, uid=False):
+    """Fetch `items` for `ids` in chunks of message-sets and yield one dict per message.
+
+    Each chunk is a single FETCH round trip; messages are yielded as soon as
+    their chunk has been parsed so callers can stream progress.
+    """
+    for message_set in build_message_sets(ids, batch_size):
+        with metrics.timed("imap_fetch"):
+            if uid:
+                status, data = mail.uid("FETCH", message_set, items)
+            else:
+                status, data = mail.fetch(message_set, items)
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"FETCH {message_set} failed: {data}")
+        # Streamed literals are counted as they are read
+        metrics.add_bytes("imap_fetch", sum(len(part) for item in data for part in
+                                            (item if isinstance(item, tuple) else (item,))
+                                            if isinstance(part, bytes)))
+
+        for message in parse_fetch_response(data):
+            yield message
+
+
+@contextmanager
+def streamed_literals(mail, make_sink, chunk_size=STREAM_CHUNK_SIZE):
+    """Stream the literals of responses read while active into sinks instead of buffering them.
+
+    Every literal (e.g. the BODY[] of a FETCH) gets a fresh `make_sink()`
+    whose feed() receives it in chunks of at most `chunk_size` bytes; the
+    value of sink.close() takes the literal's place in the response.
+    """
+    read = mail.read
+
+    def read_literal(size):
+        sink = make_sink()
+        remaining = size
+        while remaining:
+            chunk = read(min(chunk_size, remaining))
+            if not chunk:
+                raise mail.abort("connection closed while reading a literal")
+            sink.feed(chunk)
+            remaining -= len(chunk)
+        metrics.add_bytes("imap_fetch", size)
+        return sink.close()
+
+    # imaplib reads every literal through self.read(size)
+    mail.read = read_literal
+    try:
+        yield mail
+    finally:
+        del mail.read
@@ -0,0 +1,128 @@
+import imaplib
+import re
+import socket
+import threading
+import time
+
+# Seconds before an IDLE is ended and re-issued; RFC 2177 asks for less than 30 minutes
+IDLE_RENEW = 29 * 60
+
+# How often a waiting IDLE wakes up to notice that it should stop
+IDLE_POLL = 5
+
+# Seconds to wait for the server to answer IDLE or DONE
+IDLE_RESPONSE_TIMEOUT = 30
+
+_EXISTS_RE = re.compile(rb"^\* \d+ EXISTS")
+
+
+class _LineReader:
+    """Reads response lines straight from the socket, with a timeout per wait.
+
+    imaplib's buffered file cannot be read again after a timeout, so the
+    IDLE exchange bypasses it; it is empty between commands.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._buffer = b""
+
+    def readline(self, timeout):
+        """Return the next line without its CRLF, or None if nothing arrived within `timeout`."""
+        while b"\n" not in self._buffer:
+            self.sock.settimeout(timeout)
+            try:
+                data = self.sock.recv(4096)
+            except socket.timeout:
+                return None
+            finally:
+                self.sock.settimeout(None)
+            if not data:
+                raise imaplib.IMAP4.abort("connection closed during IDLE")
+            self._buffer += data
+        line, _, self._buffer = self._buffer.partition(b"\n")
+        return line.rstrip(b"\r")
+
+
+def supports_idle(mail):
+    return "IDLE" in mail.capabilities
+
+
+def wait_for_mail(mail, stop, timeout=IDLE_RENEW):
+    """Run one IDLE on the selected mailbox of `mail`.
+
+    Returns True as soon as the server reports new messages (EXISTS) and
+    False once `timeout` seconds passed or the `stop` event was set. The
+    IDLE is always ended with DONE, so `mail` can be used again afterwards.
+    """
+    tag = mail._new_tag()
+    mail.send(tag + b" IDLE\r\n")
+    reader = _LineReader(mail.sock)
+
+    line = reader.readline(IDLE_RESPONSE_TIMEOUT)
+    if line is None or not line.startswith(b"+"):
+        raise imaplib.IMAP4.error(f"IDLE refused: {line!r}")
+
+    has_new_mail = False
+    deadline = time.monotonic() + timeout
+    while not has_new_mail and not stop.is_set() and time.monotonic() < deadline:
+        line = reader.readline(IDLE_POLL)
+        if line is None:
+            continue
+        if _EXISTS_RE.match(line):
+            has_new_mail = True
+        elif line.startswith(b"* BYE"):
+            raise imaplib.IMAP4.abort(line.decode("utf-8", "replace"))
+
+    mail.send(b"DONE\r\n")
+    while True:
+        line = reader.readline(IDLE_RESPONSE_TIMEOUT)
+        if line is None:
+            raise imaplib.IMAP4.abort("no response to DONE")
+        if line.startswith(tag + b" "):
+            if not line[len(tag) + 1:].upper().startswith(b"OK"):
+                raise imaplib.IMAP4.error(line.decode("utf-8", "replace"))
+            return has_new_mail
+        if _EXISTS_RE.match(line):
+            has_new_mail = True
+
+
+class IdleWatchers:
+    """One IDLE watcher per user, kept running while at least one of their sockets is connected.
+
+    `start(username, password, stop)` must launch the watcher in the
+    background; it should return once the `stop` event is set.
+    """
+
+    def __init__(self, start):
+        self._start = start
+        self._lock = threading.Lock()
+        self._watchers = {}  # username -> [connected sockets, stop event]
+
+    def attach(self, username, password):
+        with self._lock:
+            watcher = self._watchers.get(username)
+            if watcher is not None:
+                watcher[0] += 1
+                return
+            stop = threading.Event()
+            self._watchers[username] = [1, stop]
+        self._start(username, password, stop)
+
+    def detach(self, username):
+        with self._lock:
+            watcher = self._watchers.get(username)
+            if watcher is None:
+                return
+            watcher[0] -= 1
+            if watcher[0] > 0:
+                return
+            del self._watchers[username]
+        watcher[1].set()
+
+    def stop(self, username):
+        """Stop the watcher of `username` regardless of open sockets, e.g. on logout."""
+        with self._lock:
+            watcher = self._watchers.pop(username, None)
+        if watcher is not None:
+            watcher[1].set()
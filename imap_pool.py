@@ -0,0 +1,168 @@
+import hmac
+import imaplib
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+# Connections idle for longer than this are logged out instead of reused
+IDLE_TIMEOUT = 300
+
+# Connections idle for longer than this get a NOOP before being handed out
+HEALTH_CHECK_AFTER = 60
+
+# Upper bound on simultaneous connections per account; the server throttles logins
+MAX_CONNECTIONS_PER_ACCOUNT = 2
+
+# How long a checkout waits for a free connection before giving up
+CHECKOUT_TIMEOUT = 30
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection for an account became free in time.
+
+    It is not an imaplib error, so callers can tell a busy pool from a failed LOGIN.
+    """
+
+
+def _close(conn):
+    try:
+        conn.logout()
+    except Exception:
+        pass
+
+
+class IMAPConnectionPool:
+    """Per-account pool of logged-in IMAP connections.
+
+    Uses threading primitives, which eventlet's monkey patching turns into
+    green ones, so a checkout waiting for a free slot only parks its own
+    greenlet.
+    """
+
+    def __init__(self, connect, max_per_account=MAX_CONNECTIONS_PER_ACCOUNT,
+                 idle_timeout=IDLE_TIMEOUT, health_check_after=HEALTH_CHECK_AFTER,
+                 checkout_timeout=CHECKOUT_TIMEOUT):
+        self._connect = connect
+        self.max_per_account = max_per_account
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.checkout_timeout = checkout_timeout
+        self._cond = threading.Condition()
+        self._idle = {}  # username -> [(connection, password, last_used)]
+        self._in_use = {}  # username -> number of checked out connections
+
+    @contextmanager
+    def connection(self, username, password):
+        """Check out a logged-in connection for `username`, returning it to the pool afterwards.
+
+        A LOGIN failure raises imaplib.IMAP4.error like a plain login would.
+        Connections that hit a socket or protocol abort are dropped instead
+        of being returned.
+        """
+        conn = self._checkout(username, password)
+        try:
+            yield conn
+        except (imaplib.IMAP4.abort, OSError):
+            self._discard(username, conn)
+            raise
+        except BaseException:
+            self._release(username, password, conn)
+            raise
+        else:
+            self._release(username, password, conn)
+
+    def close_account(self, username):
+        """Log out every idle connection of `username`, e.g. when the user logs out."""
+        with self._cond:
+            idle = self._idle.pop(username, [])
+        for conn, _, _ in idle:
+            _close(conn)
+
+    def close_all(self):
+        with self._cond:
+            idle = [entry for entries in self._idle.values() for entry in entries]
+            self._idle.clear()
+        for conn, _, _ in idle:
+            _close(conn)
+
+    def _checkout(self, username, password):
+        deadline = time.monotonic() + self.checkout_timeout
+        conn = last_used = None
+        stale = []
+
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                idle = self._idle.setdefault(username, [])
+
+                # Drop expired connections
+                for entry in list(idle):
+                    if now - entry[2] > self.idle_timeout:
+                        idle.remove(entry)
+                        stale.append(entry[0])
+
+                # Only a connection opened with the same password is handed out; the others stay for their owner
+                in_use = self._in_use.get(username, 0)
+                matching = [entry for entry in idle if hmac.compare_digest(entry[1], password)]
+                if matching:
+                    idle.remove(matching[-1])
+                    conn, _, last_used = matching[-1]
+                    self._in_use[username] = in_use + 1
+                    break
+                if in_use < self.max_per_account:
+                    self._in_use[username] = in_use + 1
+                    break
+
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise PoolTimeout(f"No free IMAP connection for {username}")
+                self._cond.wait(remaining)
+
+        for old in stale:
+            _close(old)
+
+        # Make sure a connection that sat idle for a while is still alive
+        if conn is not None and time.monotonic() - last_used > self.health_check_after:
+            try:
+                conn.noop()
+            except Exception:
+                _close(conn)
+                conn = None
+
+        if conn is None:
+            try:
+                with metrics.timed("imap_connect"):
+                    conn = self._connect()
+                with metrics.timed("imap_login"):
+                    conn.login(username, password)
+            except BaseException:
+                if conn is not None:
+                    _close(conn)
+                with self._cond:
+                    self._in_use[username] -= 1
+                    self._cond.notify()
+                raise
+
+            # Only a successful login makes room, by logging out the least recently used idle connection
+            with self._cond:
+                idle = self._idle.get(username, [])
+                surplus = idle[:max(0, self._in_use[username] + len(idle) - self.max_per_account)]
+                del idle[:len(surplus)]
+            for old, _, _ in surplus:
+                _close(old)
+
+        return conn
+
+    def _release(self, username, password, conn):
+        with self._cond:
+            self._in_use[username] -= 1
+            self._idle.setdefault(username, []).append((conn, password, time.monotonic()))
+            self._cond.notify()
+
+    def _discard(self, username, conn):
+        with self._cond:
+            self._in_use[username] -= 1
+            self._cond.notify()
+        _close(conn)
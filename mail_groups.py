@@ -0,0 +1,103 @@
+import hashlib
+import os
+import random
+import re
+import struct
+
+# Words per shingle of a normalised body
+SHINGLE_SIZE = 5
+
+# Bodies with fewer words ("See the attachment.") say too little to be told apart, and get no signature
+MIN_WORDS = 20
+
+# Hash functions per MinHash signature, split into bands of BAND_ROWS rows for the LSH lookup
+NUM_PERM = 64
+BAND_ROWS = 4
+
+# Estimated Jaccard similarity from which two bodies count as the same announcement
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+
+# One random XOR mask per hash function; the seed is fixed so that signatures stored in one run
+# can be compared with those of the next
+_rng = random.Random(2024)
+_MASKS = [_rng.getrandbits(64) for _ in range(NUM_PERM)]
+
+_SIGNATURE = struct.Struct(f"<{NUM_PERM}Q")
+
+_TAGS = re.compile(r"<[^>]*>")
+_DIGITS = re.compile(r"\d+")
+_WORDS = re.compile(r"\w+")
+_MESSAGE_ID = re.compile(r"<[^<>]+>")
+
+
+def thread_key(message_id, in_reply_to=None, references=None):
+    """Return the Message-ID of the first message of a thread, from References, In-Reply-To or the message's own id."""
+    for header in (references, in_reply_to):
+        ids = _MESSAGE_ID.findall(header or "")
+        if ids:
+            return ids[0]
+    return message_id
+
+
+def normalise(text):
+    """Reduce a body to its words: markup dropped, lower-cased, and every number the same.
+
+    Recurring announcements differ mostly in dates, times and room numbers,
+    so numbers are not told apart.
+    """
+    return _WORDS.findall(_DIGITS.sub("0", _TAGS.sub(" ", text)).lower())
+
+
+def shingles(words, size=SHINGLE_SIZE):
+    """Return the 64-bit hashes of the `size`-word windows of a list of words."""
+    windows = [words[i:i + size] for i in range(max(1, len(words) - size + 1))]
+    return {int.from_bytes(hashlib.blake2b(" ".join(window).encode("utf-8"), digest_size=8).digest(), "big")
+            for window in windows if window}
+
+
+def minhash(text):
+    """Return the MinHash signature of a body as bytes, or None when it has fewer than MIN_WORDS words."""
+    words = normalise(text or "")
+    if len(words) < MIN_WORDS:
+        return None
+    hashes = shingles(words)
+    return _SIGNATURE.pack(*(min(map(mask.__xor__, hashes)) for mask in _MASKS))
+
+
+def similarity(signature, other):
+    """Estimate the Jaccard similarity of the shingles behind two signatures."""
+    values, other_values = _SIGNATURE.unpack(signature), _SIGNATURE.unpack(other)
+    return sum(value == other_value for value, other_value in zip(values, other_values)) / NUM_PERM
+
+
+def bands(signature):
+    """Return one (band, value) key per band of a signature; near-duplicates very likely share one."""
+    values = _SIGNATURE.unpack(signature)
+    keys = []
+    for band, start in enumerate(range(0, NUM_PERM, BAND_ROWS)):
+        rows = struct.pack(f"<{BAND_ROWS}Q", *values[start:start + BAND_ROWS])
+        # Signed 63 bits, so the value fits an SQLite INTEGER
+        keys.append((band, int.from_bytes(hashlib.blake2b(rows, digest_size=8).digest(), "big") >> 1))
+    return keys
+
+
+def collapse(records):
+    """Return the first of `records` of each group (see MailStore group_key), in the order given.
+
+    Its `group_size` is set to the number of `records` in its group, so a
+    listing sorted newest first shows each thread or series of
+    near-duplicates once, by its newest message, as MailStore.page does
+    with `grouped`. Nothing is read or computed besides the stored keys.
+    """
+    shown = []
+    firsts = {}
+    for record in records:
+        first = firsts.get(record.group_key) if record.group_key else None
+        if first is None:
+            record.group_size = 1
+            shown.append(record)
+            if record.group_key:
+                firsts[record.group_key] = record
+        else:
+            first.group_size += 1
+    return shown
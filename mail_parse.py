@@ -0,0 +1,147 @@
+import base64
+import binascii
+import codecs
+import re
+import os
+import quopri
+from email.header import decode_header
+from email.utils import parsedate_to_datetime
+from datetime import timezone
+
+import metrics
+
+# Which text subtype a message body is taken from when it has both
+BODY_PREFERENCE = os.environ.get("BODY_PREFERENCE", "plain")
+
+# Tried in order after the declared charset, for mail that leaves it out or gets it wrong
+FALLBACK_CHARSETS = ("utf-8", "ISO-8859-9", "Windows-1254")
+
+# Shown for mail sent without a Subject or From header
+NO_SUBJECT = "(no subject)"
+UNKNOWN_SENDER = "(unknown sender)"
+
+_WHITESPACE = re.compile(rb"\s+")
+
+
+def decode_bytes(data, charset=None):
+    """Decode text with its declared charset, falling back to UTF-8 and the Turkish code pages."""
+    for candidate in ((charset,) if charset else ()) + FALLBACK_CHARSETS:
+        try:
+            return data.decode(candidate)
+        except (LookupError, UnicodeDecodeError):
+            continue
+    return data.decode("utf-8", "replace")
+
+
+def _decode_part(part):
+    payload = part.get_payload(decode=True)
+    if payload is None:
+        return None
+    return decode_bytes(payload, part.get_content_charset())
+
+
+@metrics.timed("parse_body")
+def get_email_body(msg, prefer=BODY_PREFERENCE):
+    """Extract and return the body content of the email as text or HTML.
+
+    The first inline part of the `prefer`red subtype ("plain" or "html")
+    wins and ends the walk; otherwise the first part of the other subtype
+    is used. Only the chosen part's payload is decoded, once.
+    """
+    preferred = "text/" + prefer
+    fallback = None
+    for part in msg.walk():
+        if part.is_multipart() or part.get_content_disposition() == "attachment":
+            continue
+        content_type = part.get_content_type()
+        if content_type == preferred:
+            return _decode_part(part)
+        if content_type in ("text/plain", "text/html") and fallback is None:
+            fallback = part
+    return _decode_part(fallback) if fallback is not None else None
+
+
+@metrics.timed("decode_header")
+def decode_mime_words(s):
+    """Decode MIME encoded words to normal string."""
+    decoded_words = decode_header(s)
+    decoded_string = ""
+    for word, encoding in decoded_words:
+        if isinstance(word, bytes):
+            decoded_string += decode_bytes(word, encoding)
+        else:
+            decoded_string += word
+    return decoded_string
+
+
+def safe_decode(value):
+    """Attempt to decode bytes using multiple encodings."""
+    if isinstance(value, bytes):
+        return decode_bytes(value)
+    return value
+
+
+def normalize_datetime(dt):
+    """Normalize datetime to handle offset-naive and offset-aware datetimes."""
+    if dt.tzinfo is None:  # If the datetime is naive (no timezone info)
+        return dt.replace(tzinfo=timezone.utc)  # Treat as UTC for consistency
+    return dt
+
+
+def parse_headers(msg):
+    """Return the from/subject/date fields shown in listings, plus the Message-ID, List-Id and thread headers, for a parsed message or header block.
+
+    A missing Subject or From gets a placeholder; a missing or unparseable Date is None.
+    """
+    subject = decode_mime_words(msg["Subject"]) if msg["Subject"] else NO_SUBJECT
+    from_ = decode_mime_words(msg["From"]) if msg["From"] else UNKNOWN_SENDER
+    try:
+        date = normalize_datetime(parsedate_to_datetime(msg["Date"]))
+    except (TypeError, ValueError, IndexError):
+        date = None
+
+    return {
+        'from': from_,
+        'subject': subject,
+        'date': date,
+        'message_id': (msg.get("Message-ID") or "").strip() or None,
+        'list_id': decode_mime_words(msg["List-Id"]) if msg["List-Id"] else None,
+        'in_reply_to': msg.get("In-Reply-To"),
+        'references': msg.get("References"),
+    }
+
+
+@metrics.timed("parse_body")
+def decode_text_part(data, encoding, charset=None):
+    """Decode a single fetched body part according to its transfer encoding and declared charset."""
+    try:
+        if encoding == "base64":
+            data = base64.b64decode(data)
+        elif encoding == "quoted-printable":
+            data = quopri.decodestring(data)
+    except (binascii.Error, ValueError):
+        pass
+
+    return decode_bytes(data, charset)
+
+
+def decode_text_prefix(data, encoding, charset=None):
+    """Decode the start of a body part, as fetched with BODY.PEEK[<section>]<0.n>.
+
+    Unlike decode_text_part, a base64 group or a character cut off at the
+    end is dropped instead of spoiling the rest.
+    """
+    try:
+        if encoding == "base64":
+            data = _WHITESPACE.sub(b"", data)
+            data = base64.b64decode(data[:len(data) - len(data) % 4])
+        elif encoding == "quoted-printable":
+            data = quopri.decodestring(data)
+    except (binascii.Error, ValueError):
+        pass
+
+    try:
+        # Without final=True an incomplete trailing sequence is held back rather than rejected
+        return codecs.getincrementaldecoder(charset or "utf-8")().decode(data)
+    except (LookupError, UnicodeDecodeError):
+        return decode_bytes(data, charset)
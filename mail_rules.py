@@ -0,0 +1,134 @@
+import json
+import os
+import re
+from datetime import date, datetime
+
+# Where user-defined rules are read from, if set; a JSON list shaped like DEFAULT_RULES
+MAIL_RULES_PATH = os.environ.get("MAIL_RULES_PATH")
+
+# Categories listed by the terminal CLI and its batch digests
+CLI_CATEGORIES = ("Seminars",)
+
+# Each rule names a category and lists terms per field. A message matches a rule
+# when every field of the rule has a matching term (substring, case-insensitive,
+# like IMAP SEARCH); since/before are ISO dates compared against the message date.
+DEFAULT_RULES = [
+    {'category': 'Seminars', 'subject': ["DAIS", "AIRS"]},
+    {'category': 'Experiments', 'subject': ["[BAIS-ANNC:BILKENT] EXPERIMENT"]},
+    {'category': 'Transportation', 'subject': ["TRANSPORTATION", "From the Transportation Unit", "BUSES"]},
+]
+
+# Rule fields, the IMAP search key each compiles to and the EmailRecord attribute matched locally
+_FIELDS = {
+    'subject': ("SUBJECT", 'subject'),
+    'from': ("FROM", 'sender'),
+    'list_id': ("HEADER List-Id", 'list_id'),
+}
+
+
+def _quote(value):
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _or_tree(criteria):
+    """Join search keys with OR as a balanced tree, so nesting grows with log2 of the count."""
+    if len(criteria) == 1:
+        return criteria[0]
+    middle = len(criteria) // 2
+    return f"(OR {_or_tree(criteria[:middle])} {_or_tree(criteria[middle:])})"
+
+
+def _to_date(value):
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def load_rules(path=MAIL_RULES_PATH):
+    """Return the rules from `path`, or DEFAULT_RULES when no path is configured."""
+    if not path:
+        return DEFAULT_RULES
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class Rule:
+    """One category rule compiled for both IMAP SEARCH and local matching."""
+
+    def __init__(self, spec):
+        self.category = spec['category']
+        self.terms = {field: list(spec[field]) for field in _FIELDS if spec.get(field)}
+        self.since = _to_date(spec.get('since'))
+        self.before = _to_date(spec.get('before'))
+        if not self.terms and self.since is None and self.before is None:
+            raise ValueError(f"Rule {self.category!r} has no conditions")
+
+        # One case-insensitive alternation per field, the local counterpart of the ORed search keys
+        self._patterns = {
+            field: re.compile("|".join(re.escape(term) for term in terms), re.IGNORECASE)
+            for field, terms in self.terms.items()
+        }
+
+    def search_keys(self):
+        """Return IMAP search keys any of which matches this rule.
+
+        A rule on a single field is just its terms, so they can be spread
+        over the whole OR tree; otherwise it is one key with the fields
+        ANDed and the terms of each field ORed.
+        """
+        fields = [[f"({_FIELDS[field][0]} {_quote(term)})" for term in terms]
+                  for field, terms in self.terms.items()]
+        if len(fields) == 1 and self.since is None and self.before is None:
+            return fields[0]
+
+        keys = [_or_tree(terms) for terms in fields]
+        if self.since is not None:
+            keys.append(f"SINCE {self.since.strftime('%d-%b-%Y')}")
+        if self.before is not None:
+            keys.append(f"BEFORE {self.before.strftime('%d-%b-%Y')}")
+        return ["(" + " ".join(keys) + ")"]
+
+    def matches(self, record):
+        """Check a stored EmailRecord (see MailStore.messages) against the rule without any IMAP traffic."""
+        for field, pattern in self._patterns.items():
+            if not pattern.search(getattr(record, _FIELDS[field][1]) or ""):
+                return False
+        day = record.date.date() if isinstance(record.date, datetime) else record.date
+        if self.since is not None and day < self.since:
+            return False
+        if self.before is not None and day >= self.before:
+            return False
+        return True
+
+
+class RuleSet:
+    """Category rules compiled into one balanced IMAP SEARCH expression and a local matcher.
+
+    Adding a category only grows the single SEARCH; categorizing stored
+    messages runs entirely on their cached headers.
+    """
+
+    def __init__(self, rules=None, categories=None):
+        rules = load_rules() if rules is None else rules
+        self.rules = [Rule(spec) for spec in rules
+                      if categories is None or spec['category'] in categories]
+        if not self.rules:
+            raise ValueError("No rules to search with")
+
+        # Keys shared by several rules are searched once
+        keys = list(dict.fromkeys(key for rule in self.rules for key in rule.search_keys()))
+        self.search_criteria = _or_tree(keys)
+        if not self.search_criteria.startswith("("):
+            self.search_criteria = f"({self.search_criteria})"
+
+    @property
+    def categories(self):
+        return list(dict.fromkeys(rule.category for rule in self.rules))
+
+    def categorize(self, record):
+        """Return the categories whose rules match `record`, in rule order."""
+        return list(dict.fromkeys(rule.category for rule in self.rules if rule.matches(record)))
+
+    def tag(self, records):
+        """Set the categories of each record in place and return the records."""
+        for record in records:
+            record.categories = self.categorize(record)
+        return records
@@ -0,0 +1,575 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from email_record import EmailRecord
+from mail_groups import NEAR_DUPLICATE_THRESHOLD, bands, similarity
+
+# Location of the local SQLite message store shared by app.py and email_reader.py
+MAIL_STORE_PATH = os.environ.get("MAIL_STORE_PATH", "mail_store.db")
+
+# Bump when the tables change; the store is a cache and is rebuilt on mismatch
+SCHEMA_VERSION = 10
+
+_TABLES = ("sync_state", "messages", "query_matches", "attachments", "minhash_bands")
+
+# Columns read for listings; bodies are loaded separately, on first access
+_LISTING_COLUMNS = ", ".join(
+    f"m.{column}" for column in ("account", "mailbox", "uidvalidity", "uid", "flags", "size", "sender", "subject",
+                                 "message_id", "list_id", "thread_key", "group_key", "date", "has_body"))
+
+# Wrapped around the matched terms of search snippets; callers escape the text and swap in real markup
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_END = "\x03"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sync_state (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    query TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    last_uid INTEGER NOT NULL,
+    synced_since TEXT,
+    PRIMARY KEY (account, mailbox, query)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    flags TEXT,
+    internal_date TEXT,
+    internal_ts REAL,
+    size INTEGER,
+    sender TEXT,
+    subject TEXT,
+    message_id TEXT,
+    list_id TEXT,
+    thread_key TEXT,
+    group_key TEXT,
+    date TEXT,
+    date_ts REAL,
+    text_part TEXT,
+    has_body INTEGER NOT NULL DEFAULT 0,
+    body_hash TEXT,
+    minhash BLOB,
+    PRIMARY KEY (account, mailbox, uidvalidity, uid)
+);
+CREATE INDEX IF NOT EXISTS messages_thread ON messages (account, thread_key);
+CREATE INDEX IF NOT EXISTS messages_group ON messages (account, group_key);
+CREATE TABLE IF NOT EXISTS bodies (
+    hash TEXT PRIMARY KEY,
+    body TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS minhash_bands (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    band INTEGER NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (account, mailbox, uidvalidity, uid, band)
+);
+CREATE INDEX IF NOT EXISTS minhash_bands_value ON minhash_bands (account, band, value);
+CREATE VIEW IF NOT EXISTS messages_content AS
+    SELECT m.rowid AS rowid, m.subject, m.sender, b.body FROM messages m LEFT JOIN bodies b ON b.hash = m.body_hash;
+CREATE TABLE IF NOT EXISTS query_matches (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    query TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    PRIMARY KEY (account, mailbox, query, uidvalidity, uid)
+);
+CREATE TABLE IF NOT EXISTS attachments (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    section TEXT NOT NULL,
+    content_type TEXT,
+    filename TEXT,
+    encoding TEXT,
+    charset TEXT,
+    size INTEGER,
+    state TEXT,
+    claimed_at REAL,
+    sha256 TEXT,
+    decoded_size INTEGER,
+    text TEXT,
+    metadata TEXT,
+    PRIMARY KEY (account, mailbox, uidvalidity, uid, section)
+);
+CREATE INDEX IF NOT EXISTS attachments_sha256 ON attachments (sha256);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    subject, sender, body,
+    content='messages_content', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, subject, sender, body)
+    VALUES (new.rowid, new.subject, new.sender, (SELECT body FROM bodies WHERE hash = new.body_hash));
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, subject, sender, body)
+    VALUES ('delete', old.rowid, old.subject, old.sender, (SELECT body FROM bodies WHERE hash = old.body_hash));
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF subject, sender, body_hash ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, subject, sender, body)
+    VALUES ('delete', old.rowid, old.subject, old.sender, (SELECT body FROM bodies WHERE hash = old.body_hash));
+    INSERT INTO messages_fts (rowid, subject, sender, body)
+    VALUES (new.rowid, new.subject, new.sender, (SELECT body FROM bodies WHERE hash = new.body_hash));
+END;
+"""
+
+
+class MailStore:
+    """Parsed messages and per-query sync state, keyed on (mailbox, UIDVALIDITY, UID).
+
+    Bodies are kept once per distinct content. Messages of one thread or
+    with near-identical bodies share a `group_key` (see mail_groups), set
+    when their headers are saved.
+    """
+
+    def __init__(self, path=MAIL_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        # Server processes, digest runs and attachment pipelines write to the same file; with WAL
+        # readers do not wait for a writer, and a writer waits for another instead of failing
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.row_factory = sqlite3.Row
+
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self._db.execute("DROP VIEW IF EXISTS messages_content")
+            for table in _TABLES + ("messages_fts", "bodies"):
+                self._db.execute(f"DROP TABLE IF EXISTS {table}")
+            self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def get_state(self, account, mailbox, query):
+        """Return the sync state of a (account, mailbox, query) triple, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT uidvalidity, last_uid, synced_since FROM sync_state "
+                "WHERE account = ? AND mailbox = ? AND query = ?",
+                (account, mailbox, query),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def save_state(self, account, mailbox, query, uidvalidity, last_uid, synced_since):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?, ?, ?)",
+                (account, mailbox, query, uidvalidity, last_uid, synced_since),
+            )
+
+    def reset_mailbox(self, account, mailbox, uidvalidity):
+        """Forget everything stored under a UIDVALIDITY other than `uidvalidity`."""
+        with self._lock, self._db:
+            for table in _TABLES:
+                self._db.execute(
+                    f"DELETE FROM {table} WHERE account = ? AND mailbox = ? AND uidvalidity != ?",
+                    (account, mailbox, uidvalidity),
+                )
+            self._db.execute(
+                "DELETE FROM bodies WHERE hash NOT IN (SELECT body_hash FROM messages WHERE body_hash IS NOT NULL)"
+            )
+
+    def remove_messages(self, account, mailbox, uidvalidity, uids):
+        """Forget messages that were expunged on the server, with their matches, attachments and signatures."""
+        keys = [(account, mailbox, uidvalidity, uid) for uid in uids]
+        if not keys:
+            return
+        with self._lock, self._db:
+            for table in ("messages", "query_matches", "attachments", "minhash_bands"):
+                self._db.executemany(
+                    f"DELETE FROM {table} WHERE account = ? AND mailbox = ? AND uidvalidity = ? AND uid = ?", keys
+                )
+            self._db.execute(
+                "DELETE FROM bodies WHERE hash NOT IN (SELECT body_hash FROM messages WHERE body_hash IS NOT NULL)"
+            )
+
+    def save_headers(self, account, mailbox, uidvalidity, records):
+        """Insert the listing data of new messages.
+
+        Records are EmailRecords with uid, flags, internaldate, size, sender,
+        subject, date, message_id, list_id, thread_key, signature, text_part
+        (where the body lives, see imap_fetch.find_text_part) and attachments
+        (see imap_fetch.find_attachments) set. A message joins the group of
+        its thread, and that group joins the group of a stored near-duplicate
+        (MinHash LSH on `signature`). Messages that are already stored only
+        get their flags refreshed.
+        """
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO messages (account, mailbox, uidvalidity, uid, flags, internal_date, internal_ts, "
+                "size, sender, subject, message_id, list_id, thread_key, group_key, date, date_ts, text_part, minhash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, "
+                "COALESCE((SELECT group_key FROM messages WHERE account = ? AND thread_key = ? LIMIT 1), ?), "
+                "?, ?, ?, ?) "
+                "ON CONFLICT (account, mailbox, uidvalidity, uid) DO UPDATE SET flags = excluded.flags",
+                [(account, mailbox, uidvalidity, record.uid, " ".join(record.flags),
+                  record.internaldate.date().isoformat(), record.internaldate.timestamp(),
+                  record.size, record.sender, record.subject, record.message_id, record.list_id, record.thread_key,
+                  account, record.thread_key, record.thread_key or f"{mailbox}/{uidvalidity}/{record.uid}",
+                  record.date.isoformat(), record.date.timestamp(), json.dumps(record.text_part), record.signature)
+                 for record in records],
+            )
+            for record in records:
+                if record.signature is not None:
+                    self._join_near_duplicates(account, mailbox, uidvalidity, record.uid, record.signature)
+            # Listed only; the attachment pipeline fetches and decodes them later
+            self._db.executemany(
+                "INSERT OR IGNORE INTO attachments (account, mailbox, uidvalidity, uid, section, content_type, "
+                "filename, encoding, charset, size) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(account, mailbox, uidvalidity, record.uid, part['section'], part['content_type'],
+                  part['filename'], part['encoding'], part['charset'], part['size'])
+                 for record in records for part in record.attachments],
+            )
+
+    def save_bodies(self, account, mailbox, uidvalidity, bodies):
+        """Store downloaded bodies given as {uid: body}; identical bodies are stored once."""
+        hashes = {uid: hashlib.sha256(body.encode("utf-8")).hexdigest() for uid, body in bodies.items()
+                  if body is not None}
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO bodies (hash, body) VALUES (?, ?)",
+                [(body_hash, bodies[uid]) for uid, body_hash in hashes.items()],
+            )
+            self._db.executemany(
+                "UPDATE messages SET has_body = 1, body_hash = ? "
+                "WHERE account = ? AND mailbox = ? AND uidvalidity = ? AND uid = ?",
+                [(hashes.get(uid), account, mailbox, uidvalidity, uid) for uid in bodies],
+            )
+
+    def _join_near_duplicates(self, account, mailbox, uidvalidity, uid, signature):
+        """Merge the message's group into that of the first stored near-duplicate, then index its signature."""
+        key = (account, mailbox, uidvalidity, uid)
+        keys = bands(signature)
+        candidates = self._db.execute(
+            "SELECT DISTINCT mailbox, uidvalidity, uid FROM minhash_bands WHERE account = ? AND ("
+            + " OR ".join("(band = ? AND value = ?)" for _ in keys) + ")",
+            [account] + [value for band_value in keys for value in band_value],
+        ).fetchall()
+
+        own_group = self._db.execute(
+            "SELECT group_key FROM messages WHERE account = ? AND mailbox = ? AND uidvalidity = ? AND uid = ?", key
+        ).fetchone()['group_key']
+        for candidate in candidates:
+            if (account,) + tuple(candidate) == key:
+                continue
+            row = self._db.execute(
+                "SELECT group_key, minhash FROM messages WHERE account = ? AND mailbox = ? AND uidvalidity = ? AND uid = ?",
+                (account,) + tuple(candidate),
+            ).fetchone()
+            if row is None or row['minhash'] is None:
+                continue
+            if similarity(signature, row['minhash']) >= NEAR_DUPLICATE_THRESHOLD:
+                if row['group_key'] != own_group:
+                    self._db.execute("UPDATE messages SET group_key = ? WHERE account = ? AND group_key = ?",
+                                     (row['group_key'], account, own_group))
+                break
+
+        self._db.executemany(
+            "INSERT OR REPLACE INTO minhash_bands VALUES (?, ?, ?, ?, ?, ?)",
+            [key + band_value for band_value in keys],
+        )
+
+    def add_matches(self, account, mailbox, query, uidvalidity, uids):
+        """Record that `uids` match the search `query`."""
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO query_matches VALUES (?, ?, ?, ?, ?)",
+                [(account, mailbox, query, uidvalidity, uid) for uid in uids],
+            )
+
+    def matched_uids(self, account, mailbox, query, uidvalidity, since=None):
+        """Return the stored UIDs matching `query`, optionally only those from `since` on."""
+        return {record.uid for record in self.messages(account, mailbox, query, since)
+                if record.uidvalidity == uidvalidity}
+
+    def pending_bodies(self, account, mailbox, uidvalidity, uids):
+        """Return {uid: text_part} for those of `uids` whose body has not been downloaded."""
+        wanted = set(uids)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT uid, text_part FROM messages "
+                "WHERE account = ? AND mailbox = ? AND uidvalidity = ? AND has_body = 0",
+                (account, mailbox, uidvalidity),
+            ).fetchall()
+        return {row['uid']: json.loads(row['text_part']) for row in rows if row['uid'] in wanted}
+
+    def bodies(self, account, mailbox, uidvalidity, uids):
+        """Return {uid: body} for the downloaded bodies among `uids`."""
+        wanted = set(uids)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT m.uid, b.body FROM messages m LEFT JOIN bodies b ON b.hash = m.body_hash "
+                "WHERE m.account = ? AND m.mailbox = ? AND m.uidvalidity = ? AND m.has_body = 1",
+                (account, mailbox, uidvalidity),
+            ).fetchall()
+        return {row['uid']: row['body'] for row in rows if row['uid'] in wanted}
+
+    def body(self, account, mailbox, uidvalidity, uid):
+        """Return the downloaded body of one message, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT b.body FROM messages m JOIN bodies b ON b.hash = m.body_hash "
+                "WHERE m.account = ? AND m.mailbox = ? AND m.uidvalidity = ? AND m.uid = ?",
+                (account, mailbox, uidvalidity, uid),
+            ).fetchone()
+        return row['body'] if row else None
+
+    def pending_attachments(self, account, mailbox, uidvalidity, uids):
+        """Return {uid: [part, ...]} for the attachments of `uids` the pipeline has not handled yet."""
+        wanted = set(uids)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT uid, section, content_type, filename, encoding, charset, size FROM attachments "
+                "WHERE account = ? AND mailbox = ? AND uidvalidity = ? AND state IS NULL ORDER BY uid, section",
+                (account, mailbox, uidvalidity),
+            ).fetchall()
+        pending = {}
+        for row in rows:
+            if row['uid'] in wanted:
+                pending.setdefault(row['uid'], []).append(dict(row))
+        return pending
+
+    def claim_attachments(self, account, mailbox, uidvalidity, uids):
+        """Mark the pending attachments of `uids` "queued" and return them like pending_attachments.
+
+        A part another pipeline claimed meanwhile, in this process or another, is left out.
+        """
+        pending = self.pending_attachments(account, mailbox, uidvalidity, uids)
+        claimed = {}
+        now = time.time()
+        with self._lock, self._db:
+            for uid, parts in pending.items():
+                for part in parts:
+                    cursor = self._db.execute(
+                        "UPDATE attachments SET state = 'queued', claimed_at = ? WHERE account = ? AND mailbox = ? "
+                        "AND uidvalidity = ? AND uid = ? AND section = ? AND state IS NULL",
+                        (now, account, mailbox, uidvalidity, uid, part['section']),
+                    )
+                    if cursor.rowcount:
+                        claimed.setdefault(uid, []).append(part)
+        return claimed
+
+    def release_attachments(self, max_age):
+        """Make attachments claimed over `max_age` seconds ago pending again, e.g. those of a killed run.
+
+        Younger claims may belong to a run still going on in another process and are kept.
+        """
+        with self._lock, self._db:
+            self._db.execute("UPDATE attachments SET state = NULL WHERE state = 'queued' AND claimed_at < ?",
+                             (time.time() - max_age,))
+
+    def save_attachment(self, account, mailbox, uidvalidity, uid, section, state, sha256=None, decoded_size=None,
+                        text=None, metadata=None):
+        """Record the outcome of one attachment: "done" with its content hash and extract, "skipped" or "failed".
+
+        A state of None makes a claimed attachment pending again.
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE attachments SET state = ?, sha256 = ?, decoded_size = ?, text = ?, metadata = ? "
+                "WHERE account = ? AND mailbox = ? AND uidvalidity = ? AND uid = ? AND section = ?",
+                (state, sha256, decoded_size, text, json.dumps(metadata) if metadata is not None else None,
+                 account, mailbox, uidvalidity, uid, section),
+            )
+
+    def extract_by_hash(self, sha256):
+        """Return (text, metadata) already extracted from content with this hash, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT text, metadata FROM attachments WHERE sha256 = ? AND state = 'done' LIMIT 1", (sha256,)
+            ).fetchone()
+        if row is None:
+            return None
+        return row['text'], json.loads(row['metadata']) if row['metadata'] else None
+
+    def attachments(self, account, mailbox, uidvalidity, uid):
+        """Return the attachments of one message, in order, with whatever the pipeline extracted from them."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT section, content_type, filename, size, state, sha256, decoded_size, text, metadata "
+                "FROM attachments WHERE account = ? AND mailbox = ? AND uidvalidity = ? AND uid = ? ORDER BY section",
+                (account, mailbox, uidvalidity, uid),
+            ).fetchall()
+        attachments = []
+        for row in rows:
+            attachment = dict(row)
+            attachment['metadata'] = json.loads(row['metadata']) if row['metadata'] else None
+            attachments.append(attachment)
+        return attachments
+
+    def update_flags(self, account, mailbox, uidvalidity, flags_by_uid):
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE messages SET flags = ? "
+                "WHERE account = ? AND mailbox = ? AND uidvalidity = ? AND uid = ?",
+                [(" ".join(flags), account, mailbox, uidvalidity, uid)
+                 for uid, flags in flags_by_uid.items()],
+            )
+
+    def messages(self, account, mailbox, query, since=None, before=None):
+        """Return stored messages matching `query`, newest first.
+
+        `since` and `before` are dates compared against the INTERNALDATE day,
+        the same way IMAP SINCE/BEFORE do. Bodies are read on first access
+        of `record.body`; it is None while `has_body` is False.
+        """
+        sql = (
+            f"SELECT {_LISTING_COLUMNS} FROM messages m JOIN query_matches q "
+            "ON q.account = m.account AND q.mailbox = m.mailbox "
+            "AND q.uidvalidity = m.uidvalidity AND q.uid = m.uid "
+            "WHERE q.account = ? AND q.mailbox = ? AND q.query = ?"
+        )
+        params = [account, mailbox, query]
+        if since is not None:
+            sql += " AND m.internal_date >= ?"
+            params.append(since.strftime('%Y-%m-%d'))
+        if before is not None:
+            sql += " AND m.internal_date < ?"
+            params.append(before.strftime('%Y-%m-%d'))
+        sql += " ORDER BY m.date_ts DESC"
+
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+
+        return [self._to_record(row) for row in rows]
+
+    def page(self, account, mailboxes, query, since=None, before=None, after=None, limit=50, grouped=False):
+        """Return one page of the `query` matches of several mailboxes, newest first, and their total.
+
+        Like fetch_orchestrator.merge_records for a single account: a message
+        filed in several of `mailboxes` is listed once, from the first of them.
+        With `grouped`, each group (thread or near-duplicates) is listed once,
+        by its newest message, whose `group_size` counts the group's messages
+        in the window. Records are ordered by (date, position of the mailbox,
+        UID descending); `after` is the (date, mailbox, uid) of the last
+        record of the previous page and the next page starts right after it.
+        The total counts the listed records of all pages and is only computed
+        for the first page (None otherwise).
+        """
+        mailboxes = list(mailboxes)
+        if not mailboxes:
+            return [], 0
+        rank = "CASE m.mailbox " + " ".join("WHEN ? THEN ?" for _ in mailboxes) + " END"
+        params = [value for position, mailbox in enumerate(mailboxes) for value in (mailbox, position)]
+        listed = (
+            f"SELECT {_LISTING_COLUMNS}, m.date_ts, {rank} AS rank FROM messages m JOIN query_matches q "
+            "ON q.account = m.account AND q.mailbox = m.mailbox "
+            "AND q.uidvalidity = m.uidvalidity AND q.uid = m.uid "
+            f"WHERE q.account = ? AND q.query = ? AND q.mailbox IN ({', '.join('?' * len(mailboxes))})"
+        )
+        params += [account, query] + mailboxes
+        if since is not None:
+            listed += " AND m.internal_date >= ?"
+            params.append(since.strftime('%Y-%m-%d'))
+        if before is not None:
+            listed += " AND m.internal_date < ?"
+            params.append(before.strftime('%Y-%m-%d'))
+        # Messages without a Message-ID are never duplicates of each other
+        merged = (
+            f"WITH listed AS ({listed}), merged AS ("
+            "SELECT *, ROW_NUMBER() OVER (PARTITION BY COALESCE(NULLIF(message_id, ''), mailbox || ' ' || uid) "
+            "ORDER BY rank) AS copy FROM listed), "
+        )
+        if grouped:
+            merged += (
+                "shown AS (SELECT * FROM (SELECT *, "
+                "ROW_NUMBER() OVER (PARTITION BY group_key ORDER BY date_ts DESC, rank, uid DESC) AS position, "
+                "COUNT(*) OVER (PARTITION BY group_key) AS group_size FROM merged WHERE copy = 1) "
+                "WHERE position = 1) "
+            )
+        else:
+            merged += "shown AS (SELECT *, 1 AS group_size FROM merged WHERE copy = 1) "
+
+        sql = merged + "SELECT * FROM shown WHERE 1"
+        page_params = list(params)
+        if after is not None:
+            date, mailbox, uid = after
+            date_ts = date.timestamp()
+            after_rank = mailboxes.index(mailbox) if mailbox in mailboxes else -1
+            sql += " AND (date_ts < ? OR (date_ts = ? AND (rank > ? OR (rank = ? AND uid < ?))))"
+            page_params += [date_ts, date_ts, after_rank, after_rank, uid]
+        sql += " ORDER BY date_ts DESC, rank, uid DESC LIMIT ?"
+        page_params.append(limit)
+
+        with self._lock:
+            rows = self._db.execute(sql, page_params).fetchall()
+            total = None
+            if after is None:
+                total = self._db.execute(merged + "SELECT COUNT(*) FROM shown", params).fetchone()[0]
+
+        records = []
+        for row in rows:
+            record = self._to_record(row)
+            record.group_size = row['group_size']
+            records.append(record)
+        return records, total
+
+    def message(self, account, mailbox, uid):
+        """Return one stored message by UID, or None."""
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {_LISTING_COLUMNS} FROM messages m WHERE account = ? AND mailbox = ? AND uid = ? "
+                "ORDER BY uidvalidity DESC LIMIT 1",
+                (account, mailbox, uid),
+            ).fetchone()
+        return self._to_record(row) if row else None
+
+    def search(self, text, account=None, limit=20):
+        """Full-text search over the subject, sender and body of stored messages, best match first.
+
+        Every word of `text` must match, as a prefix. Records get a `snippet`
+        with the matched terms between HIGHLIGHT_START and HIGHLIGHT_END and
+        their bm25 `score` (lower is better). `limit` must be positive.
+        """
+        if limit <= 0:
+            raise ValueError(f"limit must be positive, not {limit}")
+        words = [word.replace('"', '""') for word in text.split()]
+        if not words:
+            return []
+        match = " ".join(f'"{word}"*' for word in words)
+
+        sql = (
+            f"SELECT {_LISTING_COLUMNS}, snippet(messages_fts, -1, ?, ?, '…', 12) AS snippet, bm25(messages_fts) AS score "
+            "FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid "
+            "WHERE messages_fts MATCH ?"
+        )
+        params = [HIGHLIGHT_START, HIGHLIGHT_END, match]
+        if account is not None:
+            sql += " AND m.account = ?"
+            params.append(account)
+        sql += " ORDER BY score LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+
+        results = []
+        for row in rows:
+            record = self._to_record(row)
+            record.snippet = row['snippet']
+            record.score = row['score']
+            results.append(record)
+        return results
+
+    def _to_record(self, row):
+        key = (row['account'], row['mailbox'], row['uidvalidity'], row['uid'])
+        return EmailRecord(
+            row['uid'], flags=row['flags'].split(), date=datetime.fromisoformat(row['date']), size=row['size'],
+            sender=row['sender'], subject=row['subject'], message_id=row['message_id'], list_id=row['list_id'],
+            thread_key=row['thread_key'], group_key=row['group_key'],
+            account=row['account'], mailbox=row['mailbox'], uidvalidity=row['uidvalidity'],
+            has_body=bool(row['has_body']), load_body=lambda: self.body(*key))
@@ -0,0 +1,103 @@
+import tempfile
+from email.parser import BytesFeedParser, BytesHeaderParser
+from email.utils import collapse_rfc2231_value
+
+
+class StreamingMessageParser:
+    """Parse a message fed in chunks, keeping only its text parts in memory.
+
+    Lines are fed to a BytesFeedParser as they arrive, except the bodies
+    of attachments and other non-text parts: those are dropped, or written
+    to a temporary file when `spill` is set, so memory use does not grow
+    with attachment size. Skipped parts stay in the parsed tree with an
+    empty payload; `attachments` lists them with their size and, when
+    spilled, the path of the still transfer-encoded data.
+    """
+
+    def __init__(self, spill=False):
+        self.spill = spill
+        self.attachments = []
+        self._parser = BytesFeedParser()
+        self._pending = b""
+        self._boundaries = []
+        self._state = "headers"  # headers, body or skip
+        self._headers = []
+        self._attachment = None
+        self._spill_file = None
+
+    def feed(self, data):
+        lines = (self._pending + data).split(b"\n")
+        self._pending = lines.pop()
+        for line in lines:
+            self._line(line + b"\n")
+
+    def close(self):
+        """Finish parsing and return the email.message.Message."""
+        if self._pending:
+            self._line(self._pending)
+            self._pending = b""
+        self._end_part()
+        return self._parser.close()
+
+    def _line(self, line):
+        stripped = line.rstrip()
+
+        # A boundary of any enclosing multipart ends the current part
+        if self._boundaries and stripped.startswith(b"--"):
+            for depth in range(len(self._boundaries) - 1, -1, -1):
+                delimiter = b"--" + self._boundaries[depth]
+                if stripped == delimiter or stripped == delimiter + b"--":
+                    self._end_part()
+                    if stripped == delimiter:
+                        del self._boundaries[depth + 1:]
+                        self._state = "headers"
+                        self._headers = []
+                    else:
+                        # Whatever follows the closing boundary is epilogue
+                        del self._boundaries[depth:]
+                        self._state = "body"
+                    self._parser.feed(line)
+                    return
+
+        if self._state == "headers":
+            self._parser.feed(line)
+            self._headers.append(line)
+            if not stripped:
+                self._start_part(b"".join(self._headers))
+        elif self._state == "skip":
+            self._attachment['size'] += len(line)
+            if self._spill_file is not None:
+                self._spill_file.write(line)
+        else:
+            self._parser.feed(line)
+
+    def _start_part(self, header_block):
+        headers = BytesHeaderParser().parsebytes(header_block)
+        maintype = headers.get_content_maintype()
+
+        if maintype == "multipart":
+            boundary = headers.get_param("boundary")
+            if boundary:
+                self._boundaries.append(collapse_rfc2231_value(boundary).encode("latin-1", "replace"))
+            self._state = "body"
+        elif maintype == "text" and headers.get_content_disposition() != "attachment":
+            self._state = "body"
+        else:
+            self._state = "skip"
+            self._attachment = {
+                'content_type': headers.get_content_type(),
+                'filename': headers.get_filename(),
+                'encoding': (headers.get("Content-Transfer-Encoding") or "7bit").strip().lower(),
+                'size': 0,
+                'path': None,
+            }
+            if self.spill:
+                self._spill_file = tempfile.NamedTemporaryFile(prefix="attachment-", delete=False)
+                self._attachment['path'] = self._spill_file.name
+            self.attachments.append(self._attachment)
+
+    def _end_part(self):
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+        self._attachment = None
@@ -0,0 +1,233 @@
+import email
+from datetime import datetime
+
+import metrics
+from email_record import EmailRecord
+from imap_fetch import (FETCH_BATCH_SIZE, fetch_batched, find_attachments, find_text_part, parse_internaldate,
+                        streamed_literals)
+from mail_groups import minhash, thread_key
+from mail_parse import (BODY_PREFERENCE, decode_mime_words, decode_text_part, decode_text_prefix, get_email_body,
+                        parse_headers)
+from mail_stream import StreamingMessageParser
+
+# Listing data: everything the dashboard and the CLI show without a body
+LISTING_ITEMS = ("(UID FLAGS INTERNALDATE RFC822.SIZE BODYSTRUCTURE "
+                 "BODY.PEEK[HEADER.FIELDS (FROM SUBJECT DATE MESSAGE-ID LIST-ID IN-REPLY-TO REFERENCES)])")
+
+# Bytes of a new message's text part fetched at sync, so near-duplicates are grouped before bodies are downloaded
+SIGNATURE_BYTES = 4096
+
+
+def select_mailbox(mail, mailbox):
+    """SELECT `mailbox` and return its UIDVALIDITY."""
+    with metrics.timed("imap_select"):
+        status, data = mail.select(mailbox)
+    if status != "OK":
+        raise mail.error(f"SELECT {mailbox} failed: {data}")
+    _, uidvalidity = mail.response("UIDVALIDITY")
+    return int(uidvalidity[0])
+
+
+def uid_search(mail, query):
+    """Run UID SEARCH and return the matching UIDs as ints."""
+    with metrics.timed("imap_search"):
+        status, data = mail.uid("SEARCH", None, query)
+    if status != "OK":
+        raise mail.error(f"UID SEARCH {query} failed: {data}")
+    metrics.add_bytes("imap_search", len(data[0] or b""))
+    return [int(uid) for uid in data[0].split()]
+
+
+def _item(message, prefix):
+    """Return the first FETCH item whose name starts with `prefix`, e.g. "BODY[HEADER"."""
+    for name, value in message.items():
+        if name.startswith(prefix):
+            return value
+    return None
+
+
+def _sign(mail, records):
+    """Set the MinHash `signature` of records from the first SIGNATURE_BYTES of their text part."""
+    sections = {}
+    for record in records:
+        if record.text_part and record.text_part['section']:
+            sections.setdefault(record.text_part['section'], {})[record.uid] = record
+
+    for section, by_uid in sections.items():
+        items = f"(UID BODY.PEEK[{section}]<0.{SIGNATURE_BYTES}>)"
+        for message in fetch_batched(mail, list(by_uid), items, uid=True):
+            data = _item(message, "BODY[")
+            record = by_uid.get(message["UID"])
+            if data is None or record is None:
+                continue
+            record.signature = minhash(decode_text_prefix(data, record.text_part['encoding'],
+                                                          record.text_part['charset']))
+
+
+def sync_mailbox(mail, store, account, query, since, mailbox="INBOX", on_stage=None):
+    """Bring the stored listing of `query` matches since `since` up to date.
+
+    The first sync of a query searches everything SINCE `since`; later syncs
+    ask for `UID last_uid+1:*` only. New matches get a header-only FETCH
+    (FROM/SUBJECT/DATE/MESSAGE-ID/LIST-ID/IN-REPLY-TO/REFERENCES, FLAGS,
+    RFC822.SIZE and BODYSTRUCTURE) plus the first SIGNATURE_BYTES of their
+    text part, whose MinHash puts near-duplicates into one group right away;
+    already stored ones get a FLAGS-only FETCH, so no whole body crosses the wire.
+    Stored matches in the window that the server no longer has (expunged)
+    are removed. A changed UIDVALIDITY drops the stored copy of the mailbox. Bodies are
+    fetched on demand by download_bodies. `on_stage` is called with
+    (stage, done, total) before each step ("searching", "listing", "signing",
+    "flags") and after each FETCH batch of the listing; it may raise to stop
+    the sync. Returns the mailbox UIDVALIDITY.
+    """
+    on_stage = on_stage or (lambda stage, done=0, total=0: None)
+
+    uidvalidity = select_mailbox(mail, mailbox)
+    since = since.date() if isinstance(since, datetime) else since
+
+    state = store.get_state(account, mailbox, query)
+    if state is None or state['uidvalidity'] != uidvalidity:
+        store.reset_mailbox(account, mailbox, uidvalidity)
+        state = {'last_uid': 0, 'synced_since': None}
+
+    on_stage("searching")
+    synced_since = state['synced_since']
+    if synced_since is None or since.isoformat() < synced_since:
+        # New or widened window: one search over the whole window
+        uids = uid_search(mail, f"{query} SINCE {since.strftime('%d-%b-%Y')}")
+        synced_since = since.isoformat()
+    else:
+        uids = uid_search(mail, f"UID {state['last_uid'] + 1}:* {query}")
+
+    stored = store.matched_uids(account, mailbox, query, uidvalidity)
+    store.add_matches(account, mailbox, query, uidvalidity, uids)
+
+    new = [uid for uid in uids if uid not in stored]
+    records = []
+    on_stage("listing", 0, len(new))
+    for done, message in enumerate(fetch_batched(mail, new, LISTING_ITEMS, uid=True), start=1):
+        if done % FETCH_BATCH_SIZE == 0:
+            on_stage("listing", done, len(new))
+        headers = _item(message, "BODY[HEADER")
+        if headers is None:
+            continue
+
+        parsed = parse_headers(email.message_from_bytes(headers))
+        # Mail without a usable Date header is dated by its arrival
+        internaldate = parse_internaldate(message["INTERNALDATE"])
+        structure = message.get("BODYSTRUCTURE")
+        attachments = find_attachments(structure)
+        for part in attachments:
+            if part['filename']:
+                part['filename'] = decode_mime_words(part['filename'])
+        records.append(EmailRecord(
+            message["UID"], flags=message.get("FLAGS", ()), date=parsed['date'] or internaldate,
+            size=message.get("RFC822.SIZE"), sender=parsed['from'], subject=parsed['subject'],
+            message_id=parsed['message_id'], list_id=parsed['list_id'], internaldate=internaldate,
+            thread_key=thread_key(parsed['message_id'], parsed['in_reply_to'], parsed['references']),
+            # Without a usable BODYSTRUCTURE the whole message is fetched later
+            text_part=(find_text_part(structure, BODY_PREFERENCE) if isinstance(structure, list)
+                       else {'section': None}),
+            attachments=attachments))
+
+    on_stage("signing", 0, len(records))
+    _sign(mail, records)
+    store.save_headers(account, mailbox, uidvalidity, records)
+
+    # Read/unread state of stored messages in the window may have changed, and some may have been expunged
+    on_stage("flags")
+    stale = store.matched_uids(account, mailbox, query, uidvalidity, since) & stored
+    if stale:
+        present = set(uid_search(mail, f"UID 1:{max(stale)} {query} SINCE {since.strftime('%d-%b-%Y')}"))
+        store.remove_messages(account, mailbox, uidvalidity, stale - present)
+        stale &= present
+    flags = {message["UID"]: message.get("FLAGS", ())
+             for message in fetch_batched(mail, stale, "(UID FLAGS)", uid=True)}
+    store.update_flags(account, mailbox, uidvalidity, flags)
+
+    last_uid = max([state['last_uid']] + uids)
+    store.save_state(account, mailbox, query, uidvalidity, last_uid, synced_since)
+
+    return uidvalidity
+
+
+def _fetch_streamed(mail, uids):
+    """FETCH BODY.PEEK[] of `uids`, yielding messages whose BODY[] is an already parsed Message."""
+    uids = sorted(uids)
+    for start in range(0, len(uids), FETCH_BATCH_SIZE):
+        # The literals are parsed while imaplib reads the response, inside the FETCH call
+        with streamed_literals(mail, StreamingMessageParser):
+            messages = list(fetch_batched(mail, uids[start:start + FETCH_BATCH_SIZE], "(UID BODY.PEEK[])", uid=True))
+        yield from messages
+
+
+def _section_data(mail, raw_cache, account, mailbox, uidvalidity, section, uids):
+    """Yield (uid, data) for one body section of `uids`, from `raw_cache` where possible.
+
+    Data is the raw section, or a parsed Message when the whole message is
+    needed (section None). Whatever is fetched is added to the cache; whole
+    messages are cached as parsed, without the attachment payloads.
+    """
+    missing = []
+    for uid in uids:
+        data = raw_cache.get(account, mailbox, uidvalidity, uid, section) if raw_cache else None
+        if data is None:
+            missing.append(uid)
+        else:
+            yield uid, data if section else email.message_from_bytes(data)
+
+    if not missing:
+        return
+    if section:
+        messages = fetch_batched(mail, missing, f"(UID BODY.PEEK[{section}])", uid=True)
+    else:
+        # Whole messages are parsed while they arrive so attachments are never held in memory
+        messages = _fetch_streamed(mail, missing)
+
+    for message in messages:
+        data = _item(message, "BODY[")
+        if data is None:
+            continue
+        if raw_cache:
+            raw = data if section else data.as_bytes(policy=data.policy.clone(linesep="\r\n"))
+            raw_cache.put(account, mailbox, uidvalidity, message["UID"], raw, section)
+        yield message["UID"], data
+
+
+def download_bodies(mail, store, account, uidvalidity, uids, mailbox="INBOX", on_body=None, raw_cache=None):
+    """Fetch the bodies of those of `uids` that the store does not have yet.
+
+    Only the text section located from BODYSTRUCTURE is fetched, with
+    BODY.PEEK so the message is not marked as read; attachments never
+    cross the wire. Sections found in `raw_cache` (a RawMessageCache) are
+    not fetched at all. `mail` must have `mailbox` selected. `on_body` is
+    called with (uid, body) as soon as each body has been decoded.
+    """
+    pending = store.pending_bodies(account, mailbox, uidvalidity, uids)
+
+    # Messages without a text part have nothing to download
+    bodies = {uid: None for uid, part in pending.items() if part is None}
+
+    # One batched FETCH per distinct section, usually just "1" and "1.1"
+    sections = {}
+    for uid, part in pending.items():
+        if part is not None:
+            sections.setdefault(part['section'], []).append(uid)
+
+    for section, section_uids in sections.items():
+        for uid, data in _section_data(mail, raw_cache, account, mailbox, uidvalidity, section, section_uids):
+            if section:
+                body = decode_text_part(data, pending[uid]['encoding'], pending[uid]['charset'])
+            else:
+                body = get_email_body(data)
+            bodies[uid] = body
+
+            if on_body:
+                on_body(uid, body)
+
+            if len(bodies) >= FETCH_BATCH_SIZE:
+                store.save_bodies(account, mailbox, uidvalidity, bodies)
+                bodies = {}
+
+    store.save_bodies(account, mailbox, uidvalidity, bodies)
+
@@ -0,0 +1,128 @@
+import bisect
+import contextvars
+import threading
+import time
+import uuid
+from contextlib import ContextDecorator
+
+# Upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+_lock = threading.Lock()
+_stages = {}  # stage -> [bucket counts (last one is +Inf), seconds, calls, bytes]
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    """Per-request or per-job totals of every stage, under one trace id."""
+
+    def __init__(self, trace_id=None):
+        self.id = trace_id or uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stages = {}  # stage -> [seconds, calls, bytes]
+
+    def add(self, stage, seconds, nbytes, calls):
+        with self._lock:
+            totals = self._stages.get(stage)
+            if totals is None:
+                totals = self._stages[stage] = [0.0, 0, 0]
+            totals[0] += seconds
+            totals[1] += calls
+            totals[2] += nbytes
+
+    def breakdown(self):
+        """Return {stage: {'seconds', 'calls', 'bytes'}} plus the wall time under 'total'."""
+        with self._lock:
+            stages = {stage: {'seconds': round(seconds, 6), 'calls': calls, 'bytes': nbytes}
+                      for stage, (seconds, calls, nbytes) in self._stages.items()}
+        stages['total'] = {'seconds': round(time.perf_counter() - self.started, 6), 'calls': 1, 'bytes': 0}
+        return stages
+
+    def summary(self):
+        """One log line with the slowest stages first."""
+        stages = sorted(self.breakdown().items(), key=lambda item: -item[1]['seconds'])
+        return " ".join(f"{stage}={totals['seconds']:.3f}s" for stage, totals in stages)
+
+
+def record(stage, seconds=0.0, nbytes=0, calls=1):
+    """Add a measurement to the process-wide counters and to the current trace, if any."""
+    with _lock:
+        totals = _stages.get(stage)
+        if totals is None:
+            totals = _stages[stage] = [[0] * (len(BUCKETS) + 1), 0.0, 0, 0]
+        if calls:
+            totals[0][bisect.bisect_left(BUCKETS, seconds)] += calls
+        totals[1] += seconds
+        totals[2] += calls
+        totals[3] += nbytes
+
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds, nbytes, calls)
+
+
+def add_bytes(stage, nbytes):
+    record(stage, nbytes=nbytes, calls=0)
+
+
+class timed(ContextDecorator):
+    """Time a block or, as a decorator, every call of a function under `stage`."""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self._start = None
+
+    def _recreate_cm(self):
+        # Every decorated call gets its own start time, so concurrent calls do not mix up
+        return timed(self.stage)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.stage, time.perf_counter() - self._start)
+        return False
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def activate(trace):
+    """Make `trace` the current one; returns a token for deactivate()."""
+    return _current_trace.set(trace)
+
+
+def deactivate(token):
+    _current_trace.reset(token)
+
+
+def render():
+    """Return all counters in the Prometheus text exposition format."""
+    with _lock:
+        stages = {stage: (list(buckets), seconds, calls, nbytes)
+                  for stage, (buckets, seconds, calls, nbytes) in sorted(_stages.items())}
+
+    lines = [
+        "# HELP email_reader_stage_seconds Time spent in each stage of the fetch pipeline.",
+        "# TYPE email_reader_stage_seconds histogram",
+    ]
+    for stage, (buckets, seconds, calls, _) in stages.items():
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), buckets):
+            cumulative += count
+            lines.append(f'email_reader_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'email_reader_stage_seconds_sum{{stage="{stage}"}} {seconds:.6f}')
+        lines.append(f'email_reader_stage_seconds_count{{stage="{stage}"}} {calls}')
+
+    lines += [
+        "# HELP email_reader_stage_bytes_total Bytes moved by each stage of the fetch pipeline.",
+        "# TYPE email_reader_stage_bytes_total counter",
+    ]
+    for stage, (_, _, _, nbytes) in stages.items():
+        if nbytes:
+            lines.append(f'email_reader_stage_bytes_total{{stage="{stage}"}} {nbytes}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,151 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; zlib is always available
+    zstandard = None
+
+# Directory of the on-disk cache of fetched message data, shared by app.py and email_reader.py
+RAW_CACHE_PATH = os.environ.get("RAW_CACHE_PATH", "raw_cache")
+
+# Upper bound on the compressed size of all cached entries; least recently used ones go first
+RAW_CACHE_MAX_BYTES = int(os.environ.get("RAW_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# Seconds after which a write rescans the directory, since other processes add to it too
+RESCAN_INTERVAL = 10
+
+# First byte of every entry, naming the codec it was written with
+_ZLIB = b"Z"
+_ZSTD = b"S"
+
+
+def _compress(data):
+    if zstandard is not None:
+        return _ZSTD + zstandard.ZstdCompressor(level=3).compress(data)
+    return _ZLIB + zlib.compress(data, 6)
+
+
+def _decompress(data):
+    codec, payload = data[:1], data[1:]
+    if codec == _ZSTD:
+        if zstandard is None:
+            return None
+        return zstandard.ZstdDecompressor().decompress(payload)
+    if codec == _ZLIB:
+        return zlib.decompress(payload)
+    return None
+
+
+class RawMessageCache:
+    """Compressed fetched message data on disk, keyed on (account, mailbox, UIDVALIDITY, UID, section).
+
+    Files are named after a hash of their key, so a UIDVALIDITY change
+    simply stops old entries from being found until they are evicted.
+    Recency is kept in the file mtimes, so the LRU order survives
+    restarts and is shared with the other processes using the directory;
+    entries are read through mmap. The in-memory index only speeds things
+    up: a miss still looks on disk, and the byte budget is enforced on the
+    directory as a whole, rescanned when this process's count goes over it
+    or every RESCAN_INTERVAL seconds.
+    """
+
+    def __init__(self, path=RAW_CACHE_PATH, max_bytes=RAW_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # file name -> size, least recently used first
+        self._size = 0
+        self._scanned = 0
+
+        os.makedirs(path, exist_ok=True)
+        self._rescan()
+
+    def _rescan(self):
+        """Rebuild the index from the directory, least recently used first, and return the total size."""
+        files = []
+        for entry in os.scandir(self.path):
+            try:
+                if entry.is_file() and not entry.name.startswith("."):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, entry.name, stat.st_size))
+            except FileNotFoundError:
+                pass  # Evicted by another process meanwhile
+        entries = OrderedDict((name, size) for _, name, size in sorted(files))
+        with self._lock:
+            self._entries = entries
+            self._size = sum(entries.values())
+            self._scanned = time.monotonic()
+            return self._size
+
+    @staticmethod
+    def _name(account, mailbox, uidvalidity, uid, section):
+        key = f"{account}\0{mailbox}\0{uidvalidity}\0{uid}\0{section or ''}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, account, mailbox, uidvalidity, uid, section=None):
+        """Return the cached bytes, or None."""
+        name = self._name(account, mailbox, uidvalidity, uid, section)
+        with self._lock:
+            if name in self._entries:
+                self._entries.move_to_end(name)
+
+        # Not in the index may still mean cached by another process
+        file_path = os.path.join(self.path, name)
+        try:
+            with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                size = len(data)
+                value = _decompress(data)
+            os.utime(file_path)
+        except (OSError, ValueError, zlib.error):
+            # Not cached, evicted by another process, or unreadable
+            value = None
+        if value is None:
+            self._forget(name)
+            return None
+        with self._lock:
+            self._size += size - self._entries.pop(name, 0)
+            self._entries[name] = size
+        return value
+
+    def put(self, account, mailbox, uidvalidity, uid, data, section=None):
+        name = self._name(account, mailbox, uidvalidity, uid, section)
+        compressed = _compress(bytes(data))
+        if len(compressed) > self.max_bytes:
+            return
+
+        # Written under a temporary name so readers never see a partial entry
+        fd, temp_path = tempfile.mkstemp(prefix=".", dir=self.path)
+        with os.fdopen(fd, "wb") as f:
+            f.write(compressed)
+        os.replace(temp_path, os.path.join(self.path, name))
+
+        with self._lock:
+            self._size += len(compressed) - self._entries.pop(name, 0)
+            self._entries[name] = len(compressed)
+            rescan = self._size > self.max_bytes or time.monotonic() - self._scanned > RESCAN_INTERVAL
+        # The budget covers the whole directory, so what counts is its size on disk, not this process's share
+        if not rescan or self._rescan() <= self.max_bytes:
+            return
+
+        with self._lock:
+            evicted = []
+            while self._size > self.max_bytes:
+                old_name, size = self._entries.popitem(last=False)
+                self._size -= size
+                evicted.append(old_name)
+        for old_name in evicted:
+            try:
+                os.remove(os.path.join(self.path, old_name))
+            except FileNotFoundError:
+                pass
+
+    def _forget(self, name):
+        with self._lock:
+            self._size -= self._entries.pop(name, 0)
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds a rendered report stays valid
+REPORT_CACHE_TTL = 600
+
+# Upper bound on the total size of all cached reports
+REPORT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Record fields that end up in the report besides the body
+_KEY_FIELDS = ('account', 'mailbox', 'uid', 'uidvalidity', 'flags', 'sender', 'subject', 'date')
+
+
+def report_key(records):
+    """Return (uids, content_hash) identifying the report rendered from `records`.
+
+    The hash covers the listing fields of every message, so it changes when
+    a message is added, removed or read. Bodies are left out: they never
+    change for a given UID, and leaving them out lets the key be computed
+    before any body is downloaded. It doubles as the report's ETag, which
+    is only used for reports that have every body.
+    """
+    uids = tuple(sorted(record.uid for record in records))
+    listing = [[getattr(record, field) for field in _KEY_FIELDS] for record in records]
+    content = json.dumps(listing, default=str).encode("utf-8")
+    return uids, hashlib.sha256(content).hexdigest()
+
+
+class ReportCache:
+    """Per-user cache of rendered HTML reports with a TTL and size-bounded LRU eviction."""
+
+    def __init__(self, ttl=REPORT_CACHE_TTL, max_bytes=REPORT_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (owner, uids, content_hash) -> (html, expires_at)
+        self._size = 0
+
+    def get(self, owner, key):
+        """Return the cached report bytes for `owner` and `key`, or None."""
+        with self._lock:
+            entry = self._entries.get((owner,) + key)
+            if entry is None:
+                return None
+            html, expires_at = entry
+            if expires_at < time.monotonic():
+                self._remove((owner,) + key)
+                return None
+            self._entries.move_to_end((owner,) + key)
+            return html
+
+    def put(self, owner, key, html):
+        with self._lock:
+            cache_key = (owner,) + key
+            if cache_key in self._entries:
+                self._remove(cache_key)
+            if len(html) > self.max_bytes:
+                return
+            self._entries[cache_key] = (html, time.monotonic() + self.ttl)
+            self._size += len(html)
+
+            # Evict least recently used reports until the budget fits
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, owner):
+        """Drop every report of `owner`, e.g. on logout."""
+        with self._lock:
+            for cache_key in [k for k in self._entries if k[0] == owner]:
+                self._remove(cache_key)
+
+    def _remove(self, cache_key):
+        html, _ = self._entries.pop(cache_key)
+        self._size -= len(html)
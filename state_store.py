@@ -0,0 +1,128 @@
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from cryptography.fernet import Fernet, InvalidToken
+
+# Where state shared by all workers lives: sqlite:///<path> for one host, redis://... for several
+STATE_STORE_URL = os.environ.get("STATE_STORE_URL", "sqlite:///app_state.db")
+
+# Seconds a login stays valid on the server without being used
+CREDENTIAL_TTL = int(os.environ.get("CREDENTIAL_TTL", 12 * 3600))
+
+
+class SQLiteStateStore:
+    """Key-value store with expiry on a local SQLite file.
+
+    It implements the subset of the redis-py client the app uses (get,
+    set with ex/nx, expire, delete), so a Redis client can be used in its place.
+    Several worker processes on one host can share the file.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)"
+        )
+        self._db.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time()),
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ex=None, nx=False):
+        """Store `value` (bytes or str) under `key`, expiring after `ex` seconds.
+
+        With `nx` the key is only set if it does not exist (or has
+        expired); returns whether it was set.
+        """
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        now = time.time()
+        expires_at = now + ex if ex else None
+        with self._lock, self._db:
+            if nx:
+                self._db.execute("DELETE FROM state WHERE key = ? AND expires_at <= ?", (key, now))
+                cursor = self._db.execute(
+                    "INSERT OR IGNORE INTO state (key, value, expires_at) VALUES (?, ?, ?)", (key, value, expires_at)
+                )
+                return cursor.rowcount == 1
+            self._db.execute("INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+                             (key, value, expires_at))
+            return True
+
+    def expire(self, key, seconds):
+        """Let an existing key expire `seconds` from now; returns whether it existed."""
+        now = time.time()
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "UPDATE state SET expires_at = ? WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (now + seconds, key, now),
+            )
+            return cursor.rowcount == 1
+
+    def delete(self, *keys):
+        with self._lock, self._db:
+            return sum(self._db.execute("DELETE FROM state WHERE key = ?", (key,)).rowcount for key in keys)
+
+
+def open_state_store(url=STATE_STORE_URL):
+    """Return the store for `url`: sqlite:///<path> or any redis:// / rediss:// URL."""
+    if url.startswith("sqlite:///"):
+        return SQLiteStateStore(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        import redis  # Only needed when the state is shared through Redis
+
+        return redis.Redis.from_url(url)
+    raise ValueError(f"Unsupported STATE_STORE_URL: {url}")
+
+
+class CredentialHandles:
+    """Logins kept on the server, so the session cookie only carries an opaque handle.
+
+    A handle is "<id>.<key>": the store keeps the login under the id,
+    encrypted (Fernet) with the key, which only the handle carries. The
+    store alone, or a copy of it, does not reveal any password.
+    """
+
+    def __init__(self, store, ttl=CREDENTIAL_TTL):
+        self.store = store
+        self.ttl = ttl
+
+    def issue(self, username, password):
+        """Remember a login and return its handle."""
+        handle_id = secrets.token_urlsafe(16)
+        key = Fernet.generate_key()
+        login = json.dumps({'username': username, 'password': password}).encode("utf-8")
+        self.store.set(f"credentials:{handle_id}", Fernet(key).encrypt(login), ex=self.ttl)
+        return f"{handle_id}.{key.decode('ascii')}"
+
+    def lookup(self, handle):
+        """Return (username, password) for `handle`, or None when it is unknown, expired or forged."""
+        handle_id, _, key = (handle or "").partition(".")
+        if not handle_id or not key:
+            return None
+        value = self.store.get(f"credentials:{handle_id}")
+        if value is None:
+            return None
+        try:
+            credentials = json.loads(Fernet(key.encode("ascii")).decrypt(value))
+        except (InvalidToken, ValueError, UnicodeError):
+            return None
+        # Using a login keeps it alive
+        self.store.expire(f"credentials:{handle_id}", self.ttl)
+        return credentials['username'], credentials['password']
+
+    def revoke(self, handle):
+        handle_id = (handle or "").partition(".")[0]
+        if handle_id:
+            self.store.delete(f"credentials:{handle_id}")
@@ -0,0 +1,69 @@
+import imaplib
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from email.utils import format_datetime
+
+import pytest
+
+# The modules live at the top of the repository, next to this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_imap import FakeIMAPServer  # noqa: E402
+from email_record import EmailRecord  # noqa: E402
+from mail_store import MailStore  # noqa: E402
+
+# Matches every message the tests build
+QUERY = '(SUBJECT "DAIS")'
+
+ANNOUNCEMENT = ("The DAIS seminar of this week is given by a visiting speaker on graph neural networks "
+                "for molecule property prediction, followed by questions and coffee in the lounge of the "
+                "department. Everyone is welcome, no registration is needed.")
+
+
+def make_message(number, hours_ago, body=None, references=None, subject=None):
+    """Return the bytes of a DAIS announcement sent `hours_ago` hours ago, with Message-ID <m<number>@x>."""
+    message = EmailMessage()
+    message['From'] = f"Sender {number} <s{number}@bilkent.edu.tr>"
+    message['Subject'] = subject or f"DAIS seminar #{number}"
+    message['Date'] = format_datetime(datetime.now(timezone.utc) - timedelta(hours=hours_ago))
+    message['Message-ID'] = f"<m{number}@x>"
+    if references:
+        message['References'] = references
+    message.set_content(body or f"Body of message {number}")
+    return message.as_bytes()
+
+
+def save_message(store, uid, subject, sender="Sender <s@bilkent.edu.tr>", body=None, account="u@x",
+                 mailbox="INBOX", hours_ago=0):
+    """Store one message of `account` as a sync would, without a server, optionally with its body."""
+    when = datetime.now(timezone.utc) - timedelta(hours=hours_ago)
+    record = EmailRecord(uid, date=when, internaldate=when, sender=sender, subject=subject,
+                         message_id=f"<{account}-{mailbox}-{uid}@x>", text_part={'section': "1"})
+    store.save_headers(account, mailbox, 1, [record])
+    store.add_matches(account, mailbox, QUERY, 1, [uid])
+    if body is not None:
+        store.save_bodies(account, mailbox, 1, {uid: body})
+
+
+@pytest.fixture
+def server():
+    server = FakeIMAPServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def mail(server):
+    mail = imaplib.IMAP4("127.0.0.1", server.port)
+    mail.login("u@x", "pw")
+    yield mail
+    mail.logout()
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MailStore(str(tmp_path / "store.db"))
+    yield store
+    store.close()
@@ -0,0 +1,53 @@
+import base64
+import io
+import time
+from datetime import datetime, timezone
+
+import attachment_worker
+from attachment_worker import _decode_base64
+from email_record import EmailRecord
+
+PDF = {'section': "2", 'content_type': "application/pdf", 'filename': "slides.pdf", 'encoding': "base64",
+       'charset': None, 'size': 1000}
+
+
+def save_with_attachment(store, uid):
+    now = datetime.now(timezone.utc)
+    record = EmailRecord(uid, date=now, internaldate=now, subject=f"DAIS seminar #{uid}", attachments=[PDF])
+    store.save_headers("u@x", "INBOX", 1, [record])
+
+
+def test_a_claimed_attachment_is_not_claimed_again(store):
+    save_with_attachment(store, 1)
+    assert list(store.claim_attachments("u@x", "INBOX", 1, [1])) == [1]
+    assert store.claim_attachments("u@x", "INBOX", 1, [1]) == {}
+
+
+def test_release_keeps_the_claims_of_running_pipelines(store, monkeypatch):
+    save_with_attachment(store, 1)
+    save_with_attachment(store, 2)
+    clock = time.time()
+    monkeypatch.setattr(time, "time", lambda: clock)
+    store.claim_attachments("u@x", "INBOX", 1, [1])
+    clock += 120
+    store.claim_attachments("u@x", "INBOX", 1, [2])
+
+    # A pipeline starting in another process only takes over the claim left for over a minute
+    store.release_attachments(60)
+    assert list(store.pending_attachments("u@x", "INBOX", 1, [1, 2])) == [1]
+
+
+def test_base64_is_decoded_across_chunks_and_line_breaks(monkeypatch):
+    monkeypatch.setattr(attachment_worker, "DECODE_CHUNK_SIZE", 7)
+    data = bytes(range(256)) * 3
+    for size in (len(data), len(data) - 1, len(data) - 2):
+        encoded = base64.encodebytes(data[:size])  # lines of 76 characters, padded at the end
+        decoded = io.BytesIO()
+        _decode_base64(io.BytesIO(encoded), decoded)
+        assert decoded.getvalue() == data[:size]
+
+
+def test_base64_noise_and_missing_padding_are_tolerated():
+    decoded = io.BytesIO()
+    _decode_base64(io.BytesIO(b"aGVs\r\nbG8g*d29y\tbGQ"), decoded)
+    assert decoded.getvalue() == b"hello world"
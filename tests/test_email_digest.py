@@ -0,0 +1,61 @@
+import imaplib
+import json
+
+import pytest
+
+from conftest import make_message
+from email_digest import WRITTEN_SUFFIX, DigestRunner
+
+
+@pytest.fixture
+def run_digest(server, tmp_path, monkeypatch):
+    """Run a fresh DigestRunner, as a --batch run started by cron would, and return the lines of its digest."""
+    # The store and the raw cache default to paths relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(imaplib, "IMAP4_SSL", lambda host: imaplib.IMAP4("127.0.0.1", server.port))
+    output = str(tmp_path / "digests" / "{account}.jsonl")
+
+    def run_digest(only_new=True):
+        runner = DigestRunner({"u@x": "pw"}, output, only_new=only_new)
+        try:
+            runner.run()
+        finally:
+            runner.close()
+        with open(output.format(account="u@x"), encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    return run_digest
+
+
+def test_only_new_appends_each_message_once_across_runs(server, run_digest):
+    inbox = server.mailbox()
+    inbox.append(make_message(0, hours_ago=2))
+    inbox.append(make_message(1, hours_ago=1))
+    assert [entry['subject'] for entry in run_digest()] == ["DAIS seminar #1", "DAIS seminar #0"]
+
+    inbox.append(make_message(2, hours_ago=0))
+    assert [entry['subject'] for entry in run_digest()] == [
+        "DAIS seminar #1", "DAIS seminar #0", "DAIS seminar #2"]
+    assert [entry['subject'] for entry in run_digest()] == [
+        "DAIS seminar #1", "DAIS seminar #0", "DAIS seminar #2"]
+
+
+def test_a_deleted_digest_is_written_again_in_full(server, run_digest, tmp_path):
+    server.mailbox().append(make_message(0, hours_ago=1))
+    run_digest()
+
+    digest = tmp_path / "digests" / "u@x.jsonl"
+    digest.unlink()
+    assert [entry['subject'] for entry in run_digest()] == ["DAIS seminar #0"]
+
+
+def test_without_only_new_the_digest_is_overwritten(server, run_digest, tmp_path):
+    server.mailbox().append(make_message(0, hours_ago=1))
+    run_digest(only_new=False)
+    assert len(run_digest(only_new=False)) == 1
+    assert not (tmp_path / "digests" / ("u@x.jsonl" + WRITTEN_SUFFIX)).exists()
+
+
+def test_only_new_rejects_formats_that_cannot_be_appended_to():
+    with pytest.raises(ValueError):
+        DigestRunner({"u@x": "pw"}, "digest.html", "html", only_new=True)
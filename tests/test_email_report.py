@@ -0,0 +1,40 @@
+import io
+from datetime import datetime, timezone
+
+from email_digest import digest_entry
+from email_record import EmailRecord
+from email_report import render_report, write_html
+
+
+def unread_body():
+    raise AssertionError("the body was passed in and must not be loaded again")
+
+
+def listed(uid, group_size=1):
+    record = EmailRecord(uid, date=datetime(2026, 10, 14, 9, 30, tzinfo=timezone.utc), sender="DAIS <d@x>",
+                         subject=f"DAIS seminar #{uid}", account="u@x", mailbox="INBOX", uidvalidity=1,
+                         message_id=f"<m{uid}@x>", has_body=True, load_body=unread_body)
+    record.group_size = group_size
+    return record
+
+
+def test_render_report_streams_one_chunk_per_entry_from_the_given_bodies():
+    chunks = list(render_report([(listed(1, group_size=3), "Graph neural networks"), (listed(2), None)]))
+    assert len(chunks) == 4
+    assert b"<h3>Subject: DAIS seminar #1</h3>" in chunks[1]
+    assert b"Sent 3 times" in chunks[1] and b"Graph neural networks" in chunks[1]
+    assert b"No body available" in chunks[2] and b"Sent" not in chunks[2]
+    assert chunks[-1] == b"</body></html>"
+
+
+def test_write_html_uses_the_given_bodies():
+    f = io.StringIO()
+    write_html(f, [(listed(1, group_size=2), "Graph neural networks")])
+    assert "Graph neural networks" in f.getvalue() and "Sent 2 times" in f.getvalue()
+
+
+def test_digest_entry_uses_the_given_body():
+    entry = digest_entry(listed(1), "Graph neural networks")
+    assert entry['body'] == "Graph neural networks"
+    assert entry['date'] == "2026-10-14T09:30:00+00:00"
+    assert (entry['account'], entry['mailbox'], entry['message_id']) == ("u@x", "INBOX", "<m1@x>")
@@ -0,0 +1,50 @@
+from imap_fetch import build_message_sets, parse_fetch_response
+
+
+def test_literal_keeps_its_bytes_verbatim():
+    data = [(b'1 (UID 10 RFC822.SIZE 5 BODY[] {5}', b'he)(o'), b')']
+    assert list(parse_fetch_response(data)) == [{'SEQ': 1, 'UID': 10, 'RFC822.SIZE': 5, 'BODY[]': b'he)(o'}]
+
+
+def test_items_after_a_literal_continue_the_same_message():
+    data = [(b'1 (UID 10 BODY[] {2}', b'hi'), b' FLAGS (\\Seen \\Answered))']
+    assert list(parse_fetch_response(data)) == [
+        {'SEQ': 1, 'UID': 10, 'BODY[]': b'hi', 'FLAGS': ('\\Seen', '\\Answered')},
+    ]
+
+
+def test_several_literals_in_one_message():
+    data = [
+        (b'2 (UID 11 BODY[HEADER.FIELDS (FROM SUBJECT)] {9}', b'From: a\r\n'),
+        (b' BODY[1]<0> {4}', b'text'),
+        b' INTERNALDATE "17-Oct-2026 10:00:00 +0300")',
+    ]
+    assert list(parse_fetch_response(data)) == [{
+        'SEQ': 2, 'UID': 11, 'BODY[HEADER.FIELDS (FROM SUBJECT)]': b'From: a\r\n', 'BODY[1]<0>': b'text',
+        'INTERNALDATE': '17-Oct-2026 10:00:00 +0300',
+    }]
+
+
+def test_several_messages_with_and_without_literals():
+    data = [
+        (b'1 (UID 10 BODY[] {3}', b'abc'),
+        b')',
+        b'2 (UID 11 FLAGS ())',
+        (b'3 (UID 12 BODY[] {0}', b''),
+        b')',
+    ]
+    messages = list(parse_fetch_response(data))
+    assert [message['UID'] for message in messages] == [10, 11, 12]
+    assert messages[1]['FLAGS'] == ()
+    assert messages[2]['BODY[]'] == b''
+
+
+def test_nested_lists_nil_and_quoted_strings():
+    data = [b'3 (UID 12 BODYSTRUCTURE ("text" "plain" ("charset" "utf-8") NIL "say \\"hi\\"" "7bit" 10 1))']
+    [message] = parse_fetch_response(data)
+    assert message['BODYSTRUCTURE'] == ['text', 'plain', ['charset', 'utf-8'], None, 'say "hi"', '7bit', '10', '1']
+
+
+def test_build_message_sets_merges_runs_and_splits_batches():
+    assert list(build_message_sets([9, 3, 4, 5, 7, 3])) == ["3:5,7,9"]
+    assert list(build_message_sets(range(1, 6), batch_size=2)) == ["1:2", "3:4", "5"]
@@ -0,0 +1,94 @@
+import imaplib
+
+import pytest
+
+from imap_pool import IMAPConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    """Stands in for imaplib.IMAP4_SSL; records its logins and logouts."""
+
+    def __init__(self, passwords=None):
+        self.passwords = passwords or {}
+        self.logged_out = False
+        self.alive = True
+
+    def login(self, username, password):
+        if self.passwords.get(username, password) != password:
+            raise imaplib.IMAP4.error("LOGIN failed")
+
+    def noop(self):
+        if not self.alive:
+            raise imaplib.IMAP4.abort("socket closed")
+
+    def logout(self):
+        self.logged_out = True
+
+
+@pytest.fixture
+def opened():
+    return []
+
+
+@pytest.fixture
+def pool(opened):
+    def connect():
+        opened.append(FakeConnection({"u@x": "pw"}))
+        return opened[-1]
+
+    pool = IMAPConnectionPool(connect, max_per_account=2, checkout_timeout=0.1)
+    yield pool
+    pool.close_all()
+
+
+def test_a_returned_connection_is_reused(pool, opened):
+    with pool.connection("u@x", "pw") as first:
+        pass
+    with pool.connection("u@x", "pw") as second:
+        pass
+    assert second is first
+    assert len(opened) == 1
+
+
+def test_a_connection_is_only_handed_out_for_its_password(pool, opened):
+    with pool.connection("u@x", "pw"):
+        pass
+    with pytest.raises(imaplib.IMAP4.error):
+        with pool.connection("u@x", "wrong"):
+            pass
+    with pool.connection("u@x", "pw") as conn:
+        assert conn is opened[0]
+
+
+def test_checkout_times_out_when_the_account_has_no_free_slot(pool):
+    with pool.connection("u@x", "pw"), pool.connection("u@x", "pw"):
+        with pytest.raises(PoolTimeout):
+            with pool.connection("u@x", "pw"):
+                pass
+        # Other accounts have slots of their own
+        with pool.connection("v@x", "pw"):
+            pass
+
+
+def test_failed_logins_do_not_use_up_slots(pool):
+    for _ in range(3):
+        with pytest.raises(imaplib.IMAP4.error):
+            with pool.connection("u@x", "wrong"):
+                pass
+    with pool.connection("u@x", "pw"), pool.connection("u@x", "pw"):
+        pass
+
+
+def test_aborted_and_dead_connections_are_replaced(pool, opened):
+    with pytest.raises(imaplib.IMAP4.abort):
+        with pool.connection("u@x", "pw"):
+            raise imaplib.IMAP4.abort("connection reset")
+    assert opened[0].logged_out
+
+    pool.health_check_after = 0
+    with pool.connection("u@x", "pw"):
+        pass
+    opened[1].alive = False
+    with pool.connection("u@x", "pw") as conn:
+        assert conn is opened[2]
+    assert opened[1].logged_out
@@ -0,0 +1,68 @@
+import base64
+import quopri
+from email import message_from_bytes
+from email.message import EmailMessage
+
+from mail_parse import (NO_SUBJECT, UNKNOWN_SENDER, decode_bytes, decode_mime_words, decode_text_part,
+                        decode_text_prefix, get_email_body, parse_headers)
+
+TURKISH = "Çarşamba günü semineri iptal edildi"
+
+
+def test_bytes_fall_back_to_the_turkish_code_pages():
+    assert decode_bytes(TURKISH.encode("utf-8")) == TURKISH
+    assert decode_bytes(TURKISH.encode("ISO-8859-9")) == TURKISH
+    # A wrong or unknown declared charset does not stop the fallbacks
+    assert decode_bytes(TURKISH.encode("utf-8"), "us-ascii") == TURKISH
+    assert decode_bytes(TURKISH.encode("utf-8"), "x-unknown") == TURKISH
+
+
+def test_encoded_words_are_decoded():
+    words = "=?ISO-8859-9?Q?=C7ar=FEamba?= =?UTF-8?B?c2VtaW5lcmk=?="
+    # The space between two encoded words is not part of the text
+    assert decode_mime_words(words) == "Çarşambasemineri"
+    assert decode_mime_words("Plain subject") == "Plain subject"
+
+
+def test_missing_headers_get_placeholders():
+    headers = parse_headers(message_from_bytes(b"Date: not a date\r\nList-Id: <dais.bilkent.edu.tr>\r\n\r\n"))
+    assert headers['subject'] == NO_SUBJECT
+    assert headers['from'] == UNKNOWN_SENDER
+    assert headers['date'] is None
+    assert headers['list_id'] == "<dais.bilkent.edu.tr>"
+    assert headers['message_id'] is None
+
+
+def test_naive_dates_are_taken_as_utc():
+    headers = parse_headers(message_from_bytes(b"Date: Mon, 6 May 2024 10:00:00 -0000\r\n\r\n"))
+    assert headers['date'].utcoffset().total_seconds() == 0
+
+
+def test_the_preferred_body_subtype_wins_and_attachments_are_skipped():
+    message = EmailMessage()
+    message.set_content("Plain body")
+    message.add_alternative("<p>HTML body</p>", subtype="html")
+    message.add_attachment(b"text attachment", maintype="text", subtype="plain", filename="notes.txt")
+    assert get_email_body(message, prefer="plain") == "Plain body\n"
+    assert get_email_body(message, prefer="html") == "<p>HTML body</p>\n"
+
+    html_only = EmailMessage()
+    html_only.set_content("<p>Only HTML</p>", subtype="html")
+    assert get_email_body(html_only, prefer="plain") == "<p>Only HTML</p>\n"
+
+
+def test_fetched_parts_are_decoded_by_transfer_encoding():
+    data = TURKISH.encode("ISO-8859-9")
+    assert decode_text_part(base64.encodebytes(data), "base64", "ISO-8859-9") == TURKISH
+    assert decode_text_part(quopri.encodestring(data), "quoted-printable", "ISO-8859-9") == TURKISH
+    assert decode_text_part(data, "8bit") == TURKISH
+
+
+def test_a_cut_off_prefix_drops_the_incomplete_end():
+    encoded = base64.encodebytes(TURKISH.encode("utf-8"))
+    for end in range(len(encoded) - 8, len(encoded)):
+        prefix = decode_text_prefix(encoded[:end], "base64", "utf-8")
+        assert TURKISH.startswith(prefix)
+        assert len(prefix) > len(TURKISH) - 8
+    # A multi-byte character cut in half is held back
+    assert decode_text_prefix(TURKISH.encode("utf-8")[:5], "8bit", "utf-8") == "Çar"
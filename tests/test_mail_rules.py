@@ -0,0 +1,71 @@
+import json
+from datetime import datetime, timezone
+from email.message import EmailMessage
+
+import pytest
+
+from email_record import EmailRecord
+from mail_rules import DEFAULT_RULES, RuleSet, load_rules
+
+RULES = DEFAULT_RULES + [
+    {'category': 'Talks', 'from': ["cs.bilkent.edu.tr"], 'subject': ["talk", "colloquium"]},
+    {'category': 'Spring', 'subject': ["seminar"], 'since': "2024-03-01", 'before': "2024-06-01"},
+]
+
+MESSAGES = [
+    ("DAIS seminar", "Ali <ali@bilkent.edu.tr>", datetime(2024, 4, 2, 10)),
+    ("airs seminar", "Ali <ali@bilkent.edu.tr>", datetime(2024, 7, 2, 10)),
+    ("Invited talk", "Secretary <sec@cs.bilkent.edu.tr>", datetime(2024, 4, 2, 10)),
+    ("Invited talk", "Ali <ali@bilkent.edu.tr>", datetime(2024, 4, 2, 10)),
+    ("Department COLLOQUIUM", "Secretary <sec@cs.bilkent.edu.tr>", datetime(2024, 2, 2, 10)),
+    ("Ring BUSES on Friday", "Transportation <tr@bilkent.edu.tr>", datetime(2024, 4, 2, 10)),
+    ("[BAIS-ANNC:BILKENT] Experiment participants wanted", "Lab <lab@bilkent.edu.tr>", datetime(2024, 4, 2, 10)),
+    ("Lunch menu", "Cafeteria <food@bilkent.edu.tr>", datetime(2024, 4, 2, 10)),
+]
+
+
+def test_the_default_search_ors_the_subjects_in_a_balanced_tree():
+    assert RuleSet(categories=("Seminars",)).search_criteria == '(OR (SUBJECT "DAIS") (SUBJECT "AIRS"))'
+    criteria = RuleSet(DEFAULT_RULES).search_criteria
+    assert criteria.count("SUBJECT") == 6
+    assert criteria.count("(OR ") == 5
+    assert criteria.startswith("(OR (OR (SUBJECT")
+
+
+def test_local_matching_agrees_with_the_server_search(server, mail):
+    rules = RuleSet(RULES)
+    inbox = server.mailbox()
+    records = []
+    for uid, (subject, sender, when) in enumerate(MESSAGES, 1):
+        message = EmailMessage()
+        message['Subject'] = subject
+        message['From'] = sender
+        message.set_content("Body")
+        when = when.replace(tzinfo=timezone.utc)
+        inbox.append(message.as_bytes(), internaldate=when)
+        records.append(EmailRecord(uid, subject=subject, sender=sender, date=when))
+
+    mail.select("INBOX")
+    found = mail.uid("SEARCH", None, rules.search_criteria)[1][0].split()
+    assert [int(uid) for uid in found] == [record.uid for record in rules.tag(records) if record.categories]
+    assert [record.categories for record in records] == [
+        ["Seminars", "Spring"], ["Seminars"], ["Talks"], [], ["Talks"], ["Transportation"], ["Experiments"], []]
+
+
+def test_terms_are_quoted_for_the_search():
+    rules = RuleSet([{'category': 'Quoted', 'subject': ['say "hi" \\ bye']}])
+    assert rules.search_criteria == '(SUBJECT "say \\"hi\\" \\\\ bye")'
+
+
+def test_rules_without_conditions_or_categories_are_refused():
+    with pytest.raises(ValueError):
+        RuleSet([{'category': 'Empty', 'subject': []}])
+    with pytest.raises(ValueError):
+        RuleSet(DEFAULT_RULES, categories=("Unknown",))
+
+
+def test_rules_are_read_from_a_json_file(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps(RULES[-1:]), encoding="utf-8")
+    assert load_rules(str(path)) == RULES[-1:]
+    assert load_rules(None) is DEFAULT_RULES
@@ -0,0 +1,58 @@
+import pytest
+
+from conftest import save_message
+from mail_store import HIGHLIGHT_END, HIGHLIGHT_START
+
+
+@pytest.fixture
+def indexed(store):
+    save_message(store, 1, "TRANSPORTATION ring schedule", body="The ring leaves the main gate at 08:00.")
+    save_message(store, 2, "DAIS seminar", sender="Gülşen Öztürk <g@bilkent.edu.tr>",
+                 body="Graph neural networks, in EA-409.")
+    save_message(store, 3, "Lunch menu", body="Çorba and pilav.")
+    save_message(store, 4, "Ring service for staff", account="other@x", body="Staff ring times.")
+    return store
+
+
+def uids(records):
+    return sorted(record.uid for record in records)
+
+
+def test_every_word_must_match_as_a_prefix(indexed):
+    assert uids(indexed.search("ring")) == [1, 4]
+    assert uids(indexed.search("transp gate")) == [1]
+    assert indexed.search("ring menu") == []
+
+
+def test_body_sender_and_diacritics_are_indexed(indexed):
+    assert uids(indexed.search("neural")) == [2]
+    assert uids(indexed.search("gulsen")) == [2]
+    assert uids(indexed.search("corba")) == [3]
+
+
+def test_results_are_limited_to_the_account(indexed):
+    assert uids(indexed.search("ring", account="u@x")) == [1]
+
+
+def test_snippet_marks_the_matched_terms(indexed):
+    [record] = indexed.search("gate", account="u@x")
+    assert f"{HIGHLIGHT_START}gate{HIGHLIGHT_END}" in record.snippet
+    assert record.score is not None
+
+
+def test_bodies_saved_later_are_searchable(store):
+    save_message(store, 1, "Announcement")
+    assert store.search("shuttle") == []
+    store.save_bodies("u@x", "INBOX", 1, {1: "The shuttle runs on Sunday."})
+    assert uids(store.search("shuttle")) == [1]
+
+
+def test_limit(indexed):
+    assert len(indexed.search("ring", limit=1)) == 1
+    for limit in (0, -1):
+        with pytest.raises(ValueError):
+            indexed.search("ring", limit=limit)
+
+
+def test_quotes_in_the_query_do_not_break_it(indexed):
+    assert uids(indexed.search('"ring')) == uids(indexed.search('ring"')) == [1, 4]
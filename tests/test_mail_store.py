@@ -0,0 +1,80 @@
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import ANNOUNCEMENT, QUERY, make_message
+from fetch_orchestrator import merge_records
+from mail_groups import collapse
+from mail_sync import sync_mailbox
+
+FOLDERS = ["INBOX", "Archive"]
+
+
+@pytest.fixture
+def listing(server, mail, store):
+    """A thread of two, a weekly announcement sent three times, a message filed twice and five single ones."""
+    inbox, archive = server.mailbox("INBOX"), server.mailbox("Archive")
+    inbox.append(make_message(0, hours_ago=10))
+    inbox.append(make_message(1, hours_ago=3, references="<m0@x>"))
+    for number, hours_ago in ((2, 9), (3, 5), (4, 1)):
+        inbox.append(make_message(number, hours_ago, body=ANNOUNCEMENT.replace("this week", f"week {number}")))
+    for number, hours_ago in ((5, 8), (6, 7), (7, 6), (8, 2)):
+        inbox.append(make_message(number, hours_ago))
+    archive.append(make_message(5, hours_ago=8))
+    archive.append(make_message(9, hours_ago=4))
+
+    since = date.today() - timedelta(days=7)
+    for folder in FOLDERS:
+        sync_mailbox(mail, store, "u@x", QUERY, since, folder)
+    return store
+
+
+def pages(store, limit, grouped):
+    """Walk `store.page` with the cursor of each page's last record; returns the records and the first total."""
+    records, total = store.page("u@x", FOLDERS, QUERY, limit=limit, grouped=grouped)
+    while True:
+        last = records[-1]
+        page, _ = store.page("u@x", FOLDERS, QUERY, after=(last.date, last.mailbox, last.uid),
+                             limit=limit, grouped=grouped)
+        if not page:
+            return records, total
+        records += page
+
+
+def listed(records):
+    return [(record.message_id, record.mailbox, record.group_size) for record in records]
+
+
+def test_grouped_pages_list_each_group_once_by_its_newest_message(listing):
+    records, total = pages(listing, limit=2, grouped=True)
+    assert listed(records) == [
+        ("<m4@x>", "INBOX", 3),
+        ("<m8@x>", "INBOX", 1),
+        ("<m1@x>", "INBOX", 2),
+        ("<m9@x>", "Archive", 1),
+        ("<m7@x>", "INBOX", 1),
+        ("<m6@x>", "INBOX", 1),
+        ("<m5@x>", "INBOX", 1),
+    ]
+    assert total == 7
+
+
+@pytest.mark.parametrize("limit", [1, 3, 50])
+def test_cursor_pages_add_up_to_one_page(listing, limit):
+    for grouped in (False, True):
+        whole, total = listing.page("u@x", FOLDERS, QUERY, limit=50, grouped=grouped)
+        records, first_total = pages(listing, limit, grouped)
+        assert listed(records) == listed(whole)
+        assert first_total == total == len(whole)
+
+
+def test_later_pages_have_no_total(listing):
+    records, _ = listing.page("u@x", FOLDERS, QUERY, limit=2)
+    last = records[-1]
+    assert listing.page("u@x", FOLDERS, QUERY, after=(last.date, last.mailbox, last.uid), limit=2)[1] is None
+
+
+def test_collapse_agrees_with_grouped_pages(listing):
+    merged = merge_records(listing, [("u@x", folder) for folder in FOLDERS], QUERY)
+    assert len(merged) == 10
+    assert listed(collapse(merged)) == listed(pages(listing, limit=2, grouped=True)[0])
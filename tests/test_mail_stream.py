@@ -0,0 +1,54 @@
+import base64
+import os
+from email.message import EmailMessage
+
+from mail_parse import get_email_body, parse_headers
+from mail_stream import StreamingMessageParser
+
+PDF = b"%PDF-1.4 " + bytes(range(256)) * 40
+
+
+def make_message():
+    message = EmailMessage()
+    message['From'] = "Sender <s@bilkent.edu.tr>"
+    message['Subject'] = "DAIS seminar slides"
+    message.set_content("See the slides attached.\n--not a boundary\n")
+    message.add_alternative("<p>See the slides attached.</p>", subtype="html")
+    message.add_attachment(PDF, maintype="application", subtype="pdf", filename="slides.pdf")
+    message.add_attachment("Speaker notes", filename="notes.txt")
+    return message.as_bytes()
+
+
+def parse(raw, chunk_size, spill=False):
+    parser = StreamingMessageParser(spill=spill)
+    for start in range(0, len(raw), chunk_size):
+        parser.feed(raw[start:start + chunk_size])
+    return parser, parser.close()
+
+
+def test_text_parts_are_parsed_as_a_whole_message_would_be():
+    raw = make_message()
+    for chunk_size in (1, 7, 4096, len(raw)):
+        _, msg = parse(raw, chunk_size)
+        assert parse_headers(msg)['subject'] == "DAIS seminar slides"
+        assert get_email_body(msg, prefer="plain") == "See the slides attached.\n--not a boundary\n"
+        assert get_email_body(msg, prefer="html") == "<p>See the slides attached.</p>\n"
+
+
+def test_attachments_are_listed_and_left_out_of_the_tree():
+    parser, msg = parse(make_message(), 100)
+    assert [(part['content_type'], part['filename'], part['encoding']) for part in parser.attachments] == [
+        ("application/pdf", "slides.pdf", "base64"), ("text/plain", "notes.txt", "7bit")]
+    assert parser.attachments[0]['size'] >= len(base64.encodebytes(PDF))
+    assert [part.get_filename() for part in msg.walk() if part.get_filename()] == ["slides.pdf", "notes.txt"]
+    assert all(not part.get_payload() for part in msg.walk() if part.get_filename())
+
+
+def test_spilled_attachments_keep_the_encoded_data():
+    parser, _ = parse(make_message(), 100, spill=True)
+    try:
+        with open(parser.attachments[0]['path'], "rb") as f:
+            assert base64.b64decode(f.read()) == PDF
+    finally:
+        for part in parser.attachments:
+            os.remove(part['path'])
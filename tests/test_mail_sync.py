@@ -0,0 +1,87 @@
+from datetime import date, timedelta
+
+from conftest import QUERY, make_message
+from mail_sync import sync_mailbox
+
+SINCE = date.today() - timedelta(days=7)
+
+
+def stored_uids(store):
+    return sorted(record.uid for record in store.messages("u@x", "INBOX", QUERY))
+
+
+def test_first_sync_lists_the_matches_of_the_window(server, mail, store):
+    inbox = server.mailbox()
+    for number in range(3):
+        inbox.append(make_message(number, hours_ago=number))
+    inbox.append(make_message(3, hours_ago=1, subject="Lunch menu"))
+
+    assert sync_mailbox(mail, store, "u@x", QUERY, SINCE) == inbox.uidvalidity
+    assert stored_uids(store) == [1, 2, 3]
+    assert store.get_state("u@x", "INBOX", QUERY) == {
+        'uidvalidity': inbox.uidvalidity, 'last_uid': 3, 'synced_since': SINCE.isoformat()}
+
+
+def test_later_syncs_list_only_new_messages_and_refresh_flags(server, mail, store):
+    inbox = server.mailbox()
+    inbox.append(make_message(0, hours_ago=2))
+    inbox.append(make_message(1, hours_ago=1))
+    sync_mailbox(mail, store, "u@x", QUERY, SINCE)
+
+    inbox.messages[0].flags.add("\\Seen")
+    inbox.append(make_message(2, hours_ago=0))
+    searches = []
+    uid = mail.uid
+
+    def recording_uid(command, *args):
+        if command == "SEARCH":
+            searches.append(args[-1])
+        return uid(command, *args)
+
+    mail.uid = recording_uid
+    sync_mailbox(mail, store, "u@x", QUERY, SINCE)
+
+    # Only UIDs above the last one seen are listed; the stored ones are only checked for expunges
+    assert searches == [f"UID 3:* {QUERY}", f"UID 1:2 {QUERY} SINCE {SINCE.strftime('%d-%b-%Y')}"]
+    assert stored_uids(store) == [1, 2, 3]
+    assert store.get_state("u@x", "INBOX", QUERY)['last_uid'] == 3
+    seen = {record.uid: record.seen for record in store.messages("u@x", "INBOX", QUERY)}
+    assert seen == {1: True, 2: False, 3: False}
+
+
+def test_a_changed_uidvalidity_drops_the_stored_mailbox(server, mail, store):
+    inbox = server.mailbox()
+    inbox.append(make_message(0, hours_ago=2))
+    inbox.append(make_message(1, hours_ago=1))
+    sync_mailbox(mail, store, "u@x", QUERY, SINCE)
+    store.save_bodies("u@x", "INBOX", inbox.uidvalidity, {1: "Body of message 0"})
+
+    # The folder is rebuilt: new UIDVALIDITY, new UIDs
+    inbox.uidvalidity += 1
+    inbox.messages = [message for message in inbox.messages if message.uid == 2]
+    inbox.messages[0].uid = 1
+    inbox.next_uid = 2
+
+    assert sync_mailbox(mail, store, "u@x", QUERY, SINCE) == inbox.uidvalidity
+    records = store.messages("u@x", "INBOX", QUERY)
+    assert [(record.uid, record.uidvalidity, record.message_id) for record in records] == [
+        (1, inbox.uidvalidity, "<m1@x>")]
+    assert not records[0].has_body
+    assert store.get_state("u@x", "INBOX", QUERY)['last_uid'] == 1
+
+
+def test_expunged_messages_are_removed_from_the_store(server, mail, store):
+    inbox = server.mailbox()
+    for number in range(3):
+        inbox.append(make_message(number, hours_ago=3 - number))
+    sync_mailbox(mail, store, "u@x", QUERY, SINCE)
+    store.save_bodies("u@x", "INBOX", inbox.uidvalidity, {2: "Body of message 1"})
+
+    inbox.messages = [message for message in inbox.messages if message.uid != 2]
+    inbox.append(make_message(3, hours_ago=0))
+    sync_mailbox(mail, store, "u@x", QUERY, SINCE)
+
+    assert stored_uids(store) == [1, 3, 4]
+    assert store.body("u@x", "INBOX", inbox.uidvalidity, 2) is None
+    assert store.search("message") == []
+    assert len(store.search("seminar")) == 3
@@ -0,0 +1,45 @@
+import os
+import time
+
+import raw_cache
+from raw_cache import RawMessageCache
+
+
+def test_entries_are_keyed_on_the_uidvalidity_and_section(tmp_path):
+    cache = RawMessageCache(str(tmp_path))
+    cache.put("u@x", "INBOX", 1, 7, b"header block" * 100)
+    cache.put("u@x", "INBOX", 1, 7, b"body text", section="1")
+    assert cache.get("u@x", "INBOX", 1, 7) == b"header block" * 100
+    assert cache.get("u@x", "INBOX", 1, 7, section="1") == b"body text"
+    assert cache.get("u@x", "INBOX", 2, 7) is None
+    assert cache.get("v@x", "INBOX", 1, 7) is None
+
+
+def test_processes_share_the_directory(tmp_path):
+    RawMessageCache(str(tmp_path)).put("u@x", "INBOX", 1, 7, b"fetched elsewhere")
+    assert RawMessageCache(str(tmp_path)).get("u@x", "INBOX", 1, 7) == b"fetched elsewhere"
+
+
+def test_the_least_recently_read_entries_of_the_directory_are_evicted(tmp_path, monkeypatch):
+    monkeypatch.setattr(raw_cache, "RESCAN_INTERVAL", 0)
+    data = {uid: os.urandom(1000) for uid in (1, 2, 3)}  # Incompressible, so about 1 KB on disk each
+    first = RawMessageCache(str(tmp_path), max_bytes=2500)
+    now = time.time()
+    for uid in (1, 2):
+        first.put("u@x", "INBOX", 1, uid, data[uid])
+        os.utime(os.path.join(str(tmp_path), first._name("u@x", "INBOX", 1, uid, None)), (now - 60 + uid,) * 2)
+    # Reading an entry makes it the most recently used, in every process
+    assert first.get("u@x", "INBOX", 1, 1) == data[1]
+
+    # Another process adding an entry counts the files of the first one against the budget
+    second = RawMessageCache(str(tmp_path), max_bytes=2500)
+    second.put("u@x", "INBOX", 1, 3, data[3])
+    assert [first.get("u@x", "INBOX", 1, uid) for uid in (1, 2, 3)] == [data[1], None, data[3]]
+
+
+def test_unreadable_entries_are_misses(tmp_path):
+    cache = RawMessageCache(str(tmp_path))
+    cache.put("u@x", "INBOX", 1, 7, b"body")
+    with open(os.path.join(str(tmp_path), cache._name("u@x", "INBOX", 1, 7, None)), "wb") as f:
+        f.write(b"Xgarbage")
+    assert cache.get("u@x", "INBOX", 1, 7) is None
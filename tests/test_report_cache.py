@@ -0,0 +1,62 @@
+import time
+from datetime import datetime, timezone
+
+from email_record import EmailRecord
+from report_cache import ReportCache, report_key
+
+
+def make_records(*flags, body=None):
+    when = datetime(2024, 5, 6, 10, tzinfo=timezone.utc)
+    return [EmailRecord(uid, account="u@x", mailbox="INBOX", uidvalidity=1, date=when, sender="s@x",
+                        subject=f"DAIS seminar #{uid}", flags=flag, has_body=body is not None, body=body)
+            for uid, flag in enumerate(flags, 1)]
+
+
+def test_the_key_follows_the_listing_but_not_the_bodies():
+    records = make_records((), ())
+    key = report_key(records)
+    assert key[0] == (1, 2)
+    assert report_key(list(reversed(make_records((), ()))))[0] == key[0]
+
+    assert report_key(make_records((), (), body="Downloaded later")) == key
+    # Reading a message changes the report
+    assert report_key(make_records(("\\Seen",), ())) != key
+    assert report_key(make_records(())) != key
+
+
+def test_reports_are_kept_per_owner_until_they_expire(monkeypatch):
+    clock = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: clock)
+    cache = ReportCache(ttl=60)
+    key = report_key(make_records(()))
+    cache.put("u@x", key, b"<html>")
+    assert cache.get("u@x", key) == b"<html>"
+    assert cache.get("v@x", key) is None
+
+    clock += 61
+    assert cache.get("u@x", key) is None
+
+
+def test_the_least_recently_used_reports_are_evicted_first():
+    cache = ReportCache(max_bytes=10)
+    keys = [((uid,), str(uid)) for uid in range(3)]
+    cache.put("u@x", keys[0], b"aaaa")
+    cache.put("u@x", keys[1], b"bbbb")
+    cache.get("u@x", keys[0])
+    cache.put("u@x", keys[2], b"cccc")
+    assert [cache.get("u@x", key) for key in keys] == [b"aaaa", None, b"cccc"]
+
+    # A report over the whole budget is not kept at all
+    cache.put("u@x", keys[1], b"x" * 11)
+    assert cache.get("u@x", keys[1]) is None
+    assert cache.get("u@x", keys[0]) == b"aaaa"
+
+
+def test_invalidate_drops_only_the_owners_reports():
+    cache = ReportCache()
+    key = report_key(make_records(()))
+    cache.put("u@x", key, b"mine")
+    cache.put("v@x", key, b"theirs")
+    cache.invalidate("u@x")
+    assert cache.get("u@x", key) is None
+    assert cache.get("v@x", key) == b"theirs"
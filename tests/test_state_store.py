@@ -0,0 +1,61 @@
+import time
+
+import pytest
+
+from mail_store import MailStore
+from state_store import CredentialHandles, SQLiteStateStore
+
+
+@pytest.fixture
+def state(tmp_path):
+    return SQLiteStateStore(str(tmp_path / "state.db"))
+
+
+def test_keys_expire_and_nx_only_sets_missing_keys(state, monkeypatch):
+    clock = time.time()
+    monkeypatch.setattr(time, "time", lambda: clock)
+    assert state.set("lock", "a", ex=10, nx=True)
+    assert not state.set("lock", "b", ex=10, nx=True)
+    assert state.get("lock") == b"a"
+
+    clock += 11
+    assert state.get("lock") is None
+    assert not state.expire("lock", 10)
+    assert state.set("lock", "b", ex=10, nx=True)
+    assert state.delete("lock", "missing") == 1
+
+
+def test_handles_give_back_the_login_until_revoked(state):
+    handles = CredentialHandles(state)
+    handle = handles.issue("u@x", "secret")
+    assert handles.lookup(handle) == ("u@x", "secret")
+    # The store holds the login encrypted only
+    assert b"secret" not in state.get(f"credentials:{handle.partition('.')[0]}")
+
+    handles.revoke(handle)
+    assert handles.lookup(handle) is None
+
+
+def test_forged_and_expired_handles_are_refused(state, monkeypatch):
+    handles = CredentialHandles(state, ttl=60)
+    handle = handles.issue("u@x", "secret")
+    other = handles.issue("v@x", "other")
+    handle_id = handle.partition(".")[0]
+    assert handles.lookup(f"{handle_id}.{other.partition('.')[2]}") is None
+    assert handles.lookup(f"{handle_id}.not-a-key") is None
+    assert handles.lookup(handle_id) is None
+    assert handles.lookup(None) is None
+
+    clock = time.time() + 61
+    monkeypatch.setattr(time, "time", lambda: clock)
+    assert handles.lookup(handle) is None
+
+
+def test_stores_share_their_file_in_wal_mode(tmp_path):
+    state = SQLiteStateStore(str(tmp_path / "state.db"))
+    store = MailStore(str(tmp_path / "store.db"))
+    try:
+        for db in (state._db, store._db):
+            assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    finally:
+        store.close()